@@ -1,13 +1,24 @@
 import asyncio
-from typing import Annotated, AsyncIterable
+import os
+import time
+from typing import Annotated, AsyncIterable, Literal, Optional, Tuple
 from livekit.agents import Agent, function_tool, RunContext, ModelSettings
-from context import UserData, build_system_prompt
+from context import UserData, build_system_prompt, build_question_instructions, create_greeting, create_closing
+from audio_cache import say_fixed
+from summarizer import build_summary_message
 import logging
-from flow import Node, NodeType
-from logger_config import setup_logging
+from flow import FlowGraph, Node, NodeType
+from worker_metrics import HANDOFFS
 import json
 
-logger = setup_logging()
+logger = logging.getLogger("voice-agent")
+
+# how long the model gets to pick a branch before the fallback policy decides
+BRANCH_DECISION_TIMEOUT = float(os.environ.get("BRANCH_DECISION_TIMEOUT", "8"))
+BRANCH_FALLBACK = os.environ.get("BRANCH_FALLBACK", "first")
+# endpointing.NODE_DELAYS entry used for the agent of each node type
+ENDPOINTING_KINDS = {NodeType.QUESTION: "question", NodeType.BRANCH: "branch"}
+
 rubric = """[Evaluation Rubric]
                         Score 3 - Excellent: fully answers every part; gives concrete, role-relevant examples; concise
                         Score 2 - Adequate: addresses question but lacks examples
@@ -19,61 +30,84 @@ rubric = """[Evaluation Rubric]
 
 @function_tool(description=f"Evaluate the candidate's answer using this rubric: {rubric}, if the answer scores less than a 2, call this function. This function also provides a rationale parameter for you to state why the answer was too weak.")
 async def follow_up(rationale: Annotated[str, "Why the answer was weak?"], context: RunContext[UserData]):
-    logger.info(f"FlowQuestionAgent asking follow-up question...")
+    logger.info("FlowQuestionAgent asking follow-up question...")
+    if context.userdata.prefetcher:
+        context.userdata.prefetcher.discard()
     await context.session.generate_reply(instructions=f"ask a follow-up question since the user's answer is not good enough, dive deeper into their response or the question, the rationale for the follow-up question is: {rationale}", tool_choice="none") 
 
 
+def agent_for_node(node: Optional[Node], userdata: UserData) -> Agent:
+    """
+    Return the agent that handles the given node.
+    START nodes only ever have one successor, so they are resolved locally here;
+    a FlowBranchingAgent (and its LLM call) is only used for real BRANCH nodes.
+    """
+    userdata.latency.start_handoff()
+    flow = userdata.flow
+    while node is not None and node.type == NodeType.START:
+        node = flow.get_next_node(node.id)
+
+    if node is None:
+        logger.warning("Flow resolved to a missing node. handing off to EndInterviewAgent...")
+        if userdata.endpointing:
+            userdata.endpointing.apply("end")
+        return EndInterviewAgent()
+
+    userdata.current_node = node
+    HANDOFFS.inc(node.type.value)
+    if userdata.endpointing:
+        userdata.endpointing.apply(ENDPOINTING_KINDS.get(node.type, "end"), node.id)
+    if node.type == NodeType.QUESTION:
+        logger.info("Next node is a question node. handing off to FlowQuestionAgent...")
+        return FlowQuestionAgent(node, userdata.question_instructions.get(node.id))
+    if node.type == NodeType.BRANCH:
+        logger.info("Next node is a branching node. handing off to FlowBranchingAgent...")
+        return FlowBranchingAgent(node, userdata.flow.get_branch_options(node.id))
+    logger.info("Next node is the end of the interview. handing off to EndInterviewAgent...")
+    return EndInterviewAgent()
+
+
+def next_agent(node: Node, userdata: UserData) -> Agent:
+    """
+    Return the agent for the node following a non-branching node, without asking the LLM.
+    """
+    return agent_for_node(userdata.flow.get_next_node(node.id), userdata)
 
 
 class BaseAgent(Agent):
     async def on_enter(self) -> None:
         agent_name = self.__class__.__name__
-        logger.info(f"Entering {agent_name}")
+        logger.info("Entering %s", agent_name)
+        started = time.perf_counter()
 
         userdata: UserData = self.session.userdata
 
         chat_ctx = self.chat_ctx.copy()
 
         if userdata.prev_agent:
-            items_copy = self._truncate_chat_ctx(
-                userdata.prev_agent.chat_ctx.items, keep_function_call=True
-            )
+            # the previous agent started from a bounded window, so this only appends its new turns
+            prev_node = getattr(userdata.prev_agent, "node", None)
+            userdata.history.extend(userdata.prev_agent.chat_ctx.items, prev_node.id if prev_node else None)
             existing_ids = {item.id for item in chat_ctx.items}
-            items_copy = [item for item in items_copy if item.id not in existing_ids]
-            chat_ctx.items.extend(items_copy)
+            chat_ctx.items.extend(
+                item for item in userdata.history.window() if item.id not in existing_ids
+            )
+
+        summary = build_summary_message(userdata)
+        if summary:
+            chat_ctx.add_message(role="system", content=summary)
 
         chat_ctx.add_message(role="system", content=self.instructions)
 
         await self.update_chat_ctx(chat_ctx)
-
-    def _truncate_chat_ctx(
-        self,
-        items: list,
-        keep_system_message: bool = False,
-        keep_function_call: bool = False,
-    ) -> list:
-        """Truncate the chat context to keep the last n messages."""
-        def _valid_item(item) -> bool:
-            if not keep_system_message and item.type == "message" and item.role == "system":
-                return False
-            if not keep_function_call and item.type in ["function_call", "function_call_output"]:
-                return False
-            return True
-
-        new_items = []
-        for item in reversed(items):
-            if _valid_item(item):
-                new_items.append(item)
-        new_items = new_items[::-1]
-
-        while new_items and new_items[0].type in ["function_call", "function_call_output"]:
-            new_items.pop(0)
-
-        return new_items
+        node = getattr(self, "node", None)
+        userdata.latency.finish_handoff(node.id if node else None, time.perf_counter() - started)
     
     @function_tool(description="Call this function if the interviewee is not being cooperative, or if they are not behaving appropriately, the argument is the rationale for the termination of the interview")
     async def end_interview_prematurely(self, rationale: Annotated[str, "What is the reason for the termination of the interview?"], context: RunContext[UserData]):
-        logger.info(f"Shutting down interview for the following reason: {rationale}")
+        logger.info("Shutting down interview for the following reason: %s", rationale)
+        if context.userdata.prefetcher:
+            context.userdata.prefetcher.discard()
         await context.session.generate_reply(instructions=f"You have chosen to end the interview, inform the candidate of this irreversible decision.", allow_interruptions=False) 
         await context.session.aclose()
         return None
@@ -88,49 +122,84 @@ class GreeterAgent(BaseAgent):
     ):
         instructions = build_system_prompt(context_data) 
         super().__init__(instructions=instructions)
-        logger.info(f"GreeterAgent initialized")
+        logger.info("GreeterAgent initialized")
         self.initial_node = initial_node
         
     async def on_enter(self):
         await super().on_enter()
-        await self.session.generate_reply(instructions="Introduce yourself, and ask the user if they are ready to start the interview.")
+        userdata: UserData = self.session.userdata
+        if userdata.audio_cache:
+            await say_fixed(self.session, create_greeting(userdata.context_data), userdata.audio_cache, userdata.voice_id)
+        else:
+            await self.session.generate_reply(instructions="Introduce yourself, and ask the user if they are ready to start the interview.")
     
     @function_tool(description="Call this function if the user confirms they are ready to start the interview.",)
     async def confirm_ready(self, context: RunContext[UserData]):
-        logger.info(f"GreeterAgent handing off to FlowBranchingAgent...")
+        logger.info("GreeterAgent handing off to the first node of the flow...")
         context.userdata.prev_agent = self
-        return FlowBranchingAgent(self.initial_node)
+        return agent_for_node(self.initial_node, context.userdata)
     
     @function_tool(description="Call this function if the user confirms they want to cancel the interview, or if they are not ready to start the interview.")
     async def confirm_cancel(self, context: RunContext[UserData]):
-        logger.info(f"GreeterAgent handing off to EndInterviewAgent...")
+        logger.info("GreeterAgent handing off to EndInterviewAgent...")
+        context.userdata.latency.start_handoff()
+        HANDOFFS.inc(NodeType.END.value)
         context.userdata.prev_agent = self
         return EndInterviewAgent()
     
 
 class FlowQuestionAgent(BaseAgent):
-    def __init__(self, node: Node):
-        logger.info(f"FlowQuestionAgent initialized...")
+    def __init__(self, node: Node, instructions: Optional[str] = None):
+        logger.info("FlowQuestionAgent initialized...")
         self.node = node
-        super().__init__(instructions=f"Keeping the following criteria for the question in mind: {self.node.criteria}, Please ask the applicant this question: {self.node.content}. Ensure the question is asked in a friendly and natural manner, and keep the flow of the conversation smooth and natural.", tools=[follow_up] if node.follow_up_toggle else [])
+        super().__init__(instructions=instructions or build_question_instructions(node), tools=[follow_up] if node.follow_up_toggle else [])
         
         
     async def on_enter(self): 
+        userdata: UserData = self.session.userdata
+        prefetcher = userdata.prefetcher
+        draft = prefetcher.take(self.node.id) if prefetcher else None
+        if prefetcher:
+            prefetcher.mark_handoff(hit=draft is not None)
         await super().on_enter()
-        logger.info(f"FlowQuestionAgent will ask predefined question: {self.node.content}, remember not to answer any questions from the user if the information was not explicitly provided to you, make no assumptions if you do not have the information, and do not answer questions that are outside the topic of the interview.")
-        await self.session.generate_reply(instructions=f"Ask the applicant the following question: {self.node.content}")
+        logger.info("FlowQuestionAgent will ask predefined question at node %s", self.node.id)
+        logger.debug("Predefined question: %s", self.node.content)
+        if draft is not None:
+            logger.info("Using speculative draft for node %s", self.node.id)
+            await self.session.say(draft.text, audio=prefetcher.audio(draft) if draft.frames else None)
+        else:
+            await self.session.generate_reply(instructions=f"Ask the applicant the following question: {self.node.content}")
+
+        # draft the next question while the candidate answers this one
+        next_node = userdata.flow.get_next_node(self.node.id)
+        if prefetcher and next_node is not None and next_node.type == NodeType.QUESTION:
+            prefetcher.start(
+                next_node,
+                build_system_prompt(userdata.context_data),
+                userdata.question_instructions.get(next_node.id) or build_question_instructions(next_node),
+                self.chat_ctx.items,
+            )
     
     
     @function_tool(description="Call this function if the user's answer is satisfactory, transition to the next node, only use this function if the user did answer the question, but their answer was satisfactory")
     async def transition(self, context: RunContext[UserData]):
-        logger.info(f"FlowQuestionAgent handing off to FlowBranchingAgent...")
+        logger.info("FlowQuestionAgent handing off to the next node...")
+        if context.userdata.summarizer:
+            context.userdata.history.extend(self.chat_ctx.items, self.node.id)
+            context.userdata.summarizer.schedule(context.userdata, self.node)
         context.userdata.prev_agent = self
-        return FlowBranchingAgent(self.node)  # transfer
+        return next_agent(self.node, context.userdata)  # transfer
 
 class FlowBranchingAgent(BaseAgent):
-    def __init__(self, node: Node):
+    def __init__(self, node: Node, options: Optional[Tuple[Node, ...]] = None):
         self.node = node
-        super().__init__(instructions=f"You are a transitioning agent. Your job is to select the next question or step in the interview flow. When presented with multiple options, review each option carefully and select the most appropriate one by providing ONLY the option NUMBER (e.g., 1, 2, 3). Do not provide explanations or additional text with your selection.")
+        self.options = options or ()
+        self._decided = False
+        # resolved by _decide with the chosen node id, whichever of the model and the fallback comes first
+        self._decision: Optional[asyncio.Future] = None
+        self._decision_started = time.perf_counter()
+        tools = [_build_choice_tool(self, self.options)] if self.options else []
+        super().__init__(instructions=f"You are a transitioning agent. Your job is to select the next question or step in the interview flow. When presented with multiple options, review each option carefully and select the most appropriate one by calling choose_next_node with the id of that option. Do not provide explanations or additional text with your selection.", tools=tools)
     
     async def tts_node(self, text: AsyncIterable[str], model_settings: ModelSettings):  
         """Override the default TTS node to skip audio generation."""  
@@ -145,135 +214,94 @@ class FlowBranchingAgent(BaseAgent):
             
     async def on_enter(self):
         await super().on_enter()
-        logger.info(f"FlowBranchingAgent initialized...")
-        await self.session.generate_reply(instructions="Call the transition function to determine which node & question to transition to next. You will be presented with numbered options - select the most appropriate one by its number.", tool_choice={"type": "function", "function": {"name": "transition"}})
+        logger.info("FlowBranchingAgent initialized...")
+        userdata: UserData = self.session.userdata
+        if not self.options:
+            logger.warning("Branching node %s has no options, handing off to EndInterviewAgent...", self.node.id)
+            self.session.update_agent(self._decide(None, userdata, "fallback"))
+            return
+
+        self._decision_started = time.perf_counter()
+        self._decision = asyncio.get_running_loop().create_future()
+        handle = self.session.generate_reply(
+            instructions="Based on the conversation context, select the most appropriate next step by calling choose_next_node.",
+            tool_choice={"type": "function", "function": {"name": "choose_next_node"}},
+        )
+        # Wait for the decision itself rather than the reply's playout: the framework marks the
+        # playout done before the tool call has run, so the fallback could overtake the model
+        try:
+            await asyncio.wait_for(asyncio.shield(self._decision), timeout=BRANCH_DECISION_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Branch decision at node %s timed out after %ss", self.node.id, BRANCH_DECISION_TIMEOUT)
+            handle.interrupt()
+
+        if not self._decided:
+            fallback = choose_fallback(self.options, userdata.flow)
+            logger.info("Fallback option %s selected by the %s policy...", fallback.id, BRANCH_FALLBACK)
+            self.session.update_agent(self._decide(fallback.id, userdata, "fallback"))
+
+    def _decide(self, node_id: Optional[str], userdata: UserData, source: str) -> Optional[Agent]:
+        """
+        Record the branch decision and return the agent for the chosen node.
+        Only the first decision counts, later ones (e.g. a tool call after the timeout) return None.
+        """
+        if self._decided:
+            return None
+        self._decided = True
+        if self._decision is not None and not self._decision.done():
+            self._decision.set_result(node_id)
+        latency = time.perf_counter() - self._decision_started
+        userdata.branch_decisions.append({
+            "node_id": self.node.id,
+            "choice": node_id,
+            "source": source,
+            "latency": latency,
+        })
+        logger.info("Branch decision at node %s: %s (%s, %.0f ms)", self.node.id, node_id, source, latency * 1000)
+        userdata.prev_agent = self
+        return agent_for_node(userdata.flow.get_node(node_id) if node_id else None, userdata)
+
+
+def choose_fallback(options: Tuple[Node, ...], flow: FlowGraph) -> Node:
+    """
+    Pick the branch option used when the model does not decide, according to BRANCH_FALLBACK.
+    - first: the first option in edge order (default)
+    - most_questions / fewest_questions: the option leading to the longest / shortest remaining interview
+    Ties always resolve to the earliest option, so the choice is reproducible.
+    """
+    def questions_left(node: Node) -> int:
+        return flow.get_remaining_questions(node.id) + (node.type == NodeType.QUESTION)
+
+    if BRANCH_FALLBACK == "most_questions":
+        return max(options, key=questions_left)
+    if BRANCH_FALLBACK == "fewest_questions":
+        return min(options, key=questions_left)
+    return options[0]
+
+
+def _build_choice_tool(agent: FlowBranchingAgent, options: Tuple[Node, ...]):
+    """
+    Build the choose_next_node tool for a branching node, its argument is an enum of the successor node ids.
+    """
+    choice = Literal[tuple(node.id for node in options)]
+    described = "\n".join(f"- {node.id}: {node.content} (Type: {node.type.value})" for node in options)
+
+    async def choose_next_node(
+        next_node_id: Annotated[choice, "The id of the selected option"],
+        context: RunContext[UserData],
+    ):
+        if next_node_id not in {node.id for node in options}:
+            logger.warning("Model selected unknown option %s, using fallback", next_node_id)
+            next_node_id = choose_fallback(options, context.userdata.flow).id
+        return agent._decide(next_node_id, context.userdata, "llm")
+
+    return function_tool(
+        choose_next_node,
+        name="choose_next_node",
+        description=f"Select which question or step of the interview comes next. The options are:\n{described}",
+    )
 
-        
-    
-    @function_tool(description="Call this function to determine which question to ask next. You will be given a numbered list of options. Select the most appropriate option by providing ONLY its number (1, 2, 3, etc).", name="transition")
-    async def transition(self, context: RunContext[UserData]):
-        current_node = self.node
-        flow = self.session.userdata.flow
-        
-        if current_node.type == NodeType.END:
-            logger.info("FlowBranchingAgent is at the end of the interview. handing off to EndInterviewAgent...")
-            context.userdata.prev_agent = self
-            return EndInterviewAgent()
-        elif current_node.type == NodeType.START:
-            logger.info("FlowBranchingAgent is at the start of the interview. handing off to FlowQuestionAgent...")
-            #again, we know a question node will follow the start node
-            context.userdata.prev_agent = self
-            next_node = flow.get_node(flow.get_next_node_ids(current_node.id))
-            return FlowQuestionAgent(next_node)
-        elif current_node.type == NodeType.QUESTION:
-            logger.info("FlowBranchingAgent is at a question node.")
-            next_id = flow.get_next_node_ids(current_node.id)
-            next_node = flow.get_node(next_id)
-            if next_node.type == NodeType.QUESTION:
-                logger.info("Next node is a question node. handing off to FlowQuestionAgent...")
-                context.userdata.prev_agent = self
-                return FlowQuestionAgent(next_node)
-            else:
-                logger.info("Next node is not a question node. handing off to FlowBranchingAgent...")
-                context.userdata.prev_agent = self
-                return FlowBranchingAgent(next_node)
-    
-        else: #node must be a branching node, handle choosing next node
-            logger.info("FlowBranchingAgent is at a branching node.")
-            next_node_ids = self.session.userdata.flow.get_next_node_ids(current_node.id)
-            node_options = []
-            valid_ids = []
-            for node_id in next_node_ids:
-                node = self.session.userdata.flow.get_node(node_id)
-                if node is None:
-                    logger.warning(f"Node with id {node_id} is None. Skipping.")
-                    continue  # Skip invalid nodes
-                node_options.append({
-                    "id": node_id,
-                    "content": node.content,
-                    "type": node.type
-                })
-                valid_ids.append(node_id)
-            logger.info(f"Node options: {node_options}")
-            
-            # Instead of showing the full node IDs, use numbers for selection
-            node_display = ""
-            for i, option in enumerate(node_options):
-                node_display += f"OPTION {i+1}: {option['content']} (Type: {option['type']})\n"
-            
-            # Create a mapping from option number to node ID
-            option_to_id = {i+1: option["id"] for i, option in enumerate(node_options)}
-            
-            result = await self.session.generate_reply(instructions = (
-                "INSTRUCTIONS:\n"
-                "Based on the conversation context, you must select exactly ONE option from the following list.\n\n"
-                f"{node_display}\n"
-                "1. RESPOND WITH ONLY A SINGLE NUMBER (e.g., 1, 2, 3, etc.)\n"
-                "2. DO NOT include any explanation, text, or quotes\n"
-                "3. DO NOT repeat the question content\n"
-                "4. Example of valid response: 1\n"
-                "5. Example of invalid response: 'Option 1 seems best'\n"
-                "YOUR RESPONSE:"
-            ), tool_choice="none")
-            
-            msg = result.chat_message
-            fall_back_node = self.session.userdata.flow.get_node(node_options[0]["id"])
-            
-            if not msg or not msg.text_content:
-                logger.warning("No message or empty content returned from LLM. Using fallback node.")
-                logger.info(f"Fallback question selected...")
-                context.userdata.prev_agent = self
-                return FlowQuestionAgent(fall_back_node)
-            
-            # Try to extract an option number from the response
-            raw_response = msg.text_content.strip()
-            logger.info(f"Raw LLM response: {raw_response}")
-            
-            # Extract just the number - remove any non-digit characters
-            import re
-            number_pattern = re.compile(r'\d+')
-            matches = number_pattern.findall(raw_response)
-            
-            if matches:
-                selected_number = int(matches[0])
-                # Check if the selected number is valid
-                if selected_number in option_to_id:
-                    chosen_id = option_to_id[selected_number]
-                    logger.info(f"LLM selected option {selected_number}, which corresponds to node ID: {chosen_id}")
-                    next_node = self.session.userdata.flow.get_node(chosen_id)
-                    if next_node:
-                        logger.info(f"LLM selected next question: {next_node.content}, handing off to FlowQuestionAgent...")
-                        context.userdata.prev_agent = self
-                        return FlowQuestionAgent(next_node)
-                else:
-                    logger.warning(f"Selected number {selected_number} is not a valid option. Using fallback node.")
-            else:
-                logger.warning(f"Could not extract a number from LLM response: {raw_response}")
-            
-            # If we get here, we couldn't extract a valid option
-            logger.info(f"Fallback question selected...")
-            context.userdata.prev_agent = self
-            return FlowQuestionAgent(fall_back_node)
-    
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-    
-            
-        
-        # Get information about each possible next nod
- 
-        
 
-    
 #TODO: implement custom question agent
 # class CustomQuestionAgent(BaseAgent):
 #     def __init__(self, tts):
@@ -297,6 +325,10 @@ class EndInterviewAgent(BaseAgent):
     @function_tool(description="Call this function to end the interview.")
     async def finish(self, context: RunContext[UserData]):
         logger.info("EndInterviewAgent ending interview...")
-        await self.session.generate_reply(instructions="end the interview", allow_interruptions=False)
+        userdata: UserData = self.session.userdata
+        if userdata.audio_cache:
+            await say_fixed(self.session, create_closing(userdata.context_data), userdata.audio_cache, userdata.voice_id, allow_interruptions=False)
+        else:
+            await self.session.generate_reply(instructions="end the interview", allow_interruptions=False)
         await self.session.aclose()
 
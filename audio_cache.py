@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+from typing import Any, AsyncIterable, Dict, List, Optional, Set
+
+from livekit import rtc
+
+logger = logging.getLogger("voice-agent")
+
+# length of the frames played back from the cache
+FRAME_MS = 100
+
+
+def tts_settings(tts: Any) -> Dict[str, Any]:
+    """
+    Return the TTS settings that change the synthesised audio, used as part of the cache key.
+    """
+    opts = getattr(tts, "_opts", None)
+    settings = {
+        "provider": type(tts).__module__,
+        "sample_rate": tts.sample_rate,
+        "num_channels": tts.num_channels,
+    }
+    for name in ("model", "language", "speed", "emotion", "encoding"):
+        if opts is not None and hasattr(opts, name):
+            settings[name] = str(getattr(opts, name))
+    return settings
+
+
+class AudioCache:
+    """
+    Size-bounded on-disk LRU cache of synthesised audio for fixed utterances.
+    Entries are WAV files named by a hash of the voice id, text and TTS settings.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._filling: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        # key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        files = [f for f in os.scandir(directory) if f.name.endswith(".wav")]
+        for entry in sorted(files, key=lambda f: f.stat().st_mtime):
+            self._entries[entry.name[:-4]] = entry.stat().st_size
+        self._size = sum(self._entries.values())
+
+    @staticmethod
+    def key(voice_id: str, text: str, settings: Dict[str, Any]) -> str:
+        payload = json.dumps({"voice": voice_id, "text": text, "tts": settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def _read(self, key: str) -> Optional[List[rtc.AudioFrame]]:
+        try:
+            with wave.open(self._path(key), "rb") as wav:
+                sample_rate = wav.getframerate()
+                num_channels = wav.getnchannels()
+                pcm = wav.readframes(wav.getnframes())
+        except (FileNotFoundError, wave.Error, EOFError):
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+            return None
+        os.utime(self._path(key))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        step = sample_rate * FRAME_MS // 1000 * num_channels * 2
+        return [
+            rtc.AudioFrame(
+                data=pcm[i : i + step],
+                sample_rate=sample_rate,
+                num_channels=num_channels,
+                samples_per_channel=len(pcm[i : i + step]) // (2 * num_channels),
+            )
+            for i in range(0, len(pcm), step)
+        ]
+
+    def _write(self, key: str, frames: List[rtc.AudioFrame]) -> None:
+        if not frames:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with wave.open(tmp_path, "wb") as wav:
+            wav.setnchannels(frames[0].num_channels)
+            wav.setsampwidth(2)
+            wav.setframerate(frames[0].sample_rate)
+            for frame in frames:
+                wav.writeframes(frame.data.tobytes())
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evicted = []
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    async def load(self, key: str) -> Optional[List[rtc.AudioFrame]]:
+        """Return the cached frames for a key, or None on a miss."""
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        frames = await asyncio.to_thread(self._read, key)
+        if frames:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return frames
+
+    def store_in_background(self, key: str, frames: List[rtc.AudioFrame]) -> None:
+        """Write synthesised frames under `key` without blocking the caller."""
+        if key in self._filling:
+            return
+        self._filling.add(key)
+        task = asyncio.create_task(self._store(key, frames))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _store(self, key: str, frames: List[rtc.AudioFrame]) -> None:
+        try:
+            await asyncio.to_thread(self._write, key, frames)
+            logger.debug("Cached %d audio frames for utterance %s", len(frames), key[:12])
+        except Exception as e:
+            logger.warning("Failed to fill audio cache for utterance %s: %s", key[:12], e)
+        finally:
+            self._filling.discard(key)
+
+
+async def _replay(frames: List[rtc.AudioFrame]) -> AsyncIterable[rtc.AudioFrame]:
+    for frame in frames:
+        yield frame
+
+
+async def _synthesize_into(cache: AudioCache, key: str, tts: Any, text: str) -> AsyncIterable[rtc.AudioFrame]:
+    """Play the frames of one synthesis while keeping them for the cache."""
+    frames = []
+    async with tts.synthesize(text) as stream:
+        async for audio in stream:
+            frames.append(audio.frame)
+            yield audio.frame
+    # not reached when playback stops early, an interrupted utterance is not cached
+    cache.store_in_background(key, frames)
+
+
+async def say_fixed(session: Any, text: str, cache: AudioCache, voice_id: str, **kwargs):
+    """
+    Speak a fixed utterance from the audio cache. On a miss it is synthesised once, and the
+    frames are played and written to the cache as they arrive.
+    """
+    key = cache.key(voice_id, text, tts_settings(session.tts))
+    frames = await cache.load(key)
+    if frames:
+        logger.debug("Playing cached audio for utterance %s", key[:12])
+        return await session.say(text, audio=_replay(frames), **kwargs)
+    return await session.say(text, audio=_synthesize_into(cache, key, session.tts, text), **kwargs)
+
+
+_audio_cache: Optional[AudioCache] = None
+
+
+def get_audio_cache() -> Optional[AudioCache]:
+    """
+    Return the process-wide audio cache, or None when TTS_CACHE_DIR is not set.
+    """
+    global _audio_cache
+    directory = os.environ.get("TTS_CACHE_DIR")
+    if not directory:
+        return None
+    if _audio_cache is None:
+        max_bytes = int(float(os.environ.get("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024)
+        _audio_cache = AudioCache(directory, max_bytes)
+    return _audio_cache
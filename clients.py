@@ -0,0 +1,271 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+import aiohttp
+from livekit import api
+
+logger = logging.getLogger("voice-agent")
+
+S3_REGION = "us-east-2"
+# skip the health check when a client was used more recently than this
+HEALTH_CHECK_INTERVAL = float(os.environ.get("CLIENT_HEALTH_CHECK_INTERVAL", "60"))
+
+
+class ClientPool:
+    """
+    Process-wide LiveKit API and S3 clients, shared by every job the worker process runs.
+
+    Clients are created once (S3 in prewarm, LiveKit on first use inside the event loop) and
+    keep their HTTP connections alive between jobs, instead of paying a TLS handshake and
+    credential resolution per interview.
+
+    Jobs share the clients, so they are used through `lease`: a client invalidated while
+    another job is in the middle of a call is swapped for a fresh one right away and only
+    closed once its last lease is returned. The same goes for a client replaced because a job
+    runs on another event loop, which is closed on the loop it was created on.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._s3: Optional[Any] = None
+        self._livekit: Optional[api.LiveKitAPI] = None
+        self._livekit_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_used: Dict[str, float] = {}
+        self._atexit_registered = False
+        # leases per client object, and the replaced clients (with their loop) waiting for theirs to end
+        self._leases: Dict[int, int] = {}
+        self._retired: Dict[int, Tuple[Any, Optional[asyncio.AbstractEventLoop]]] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self._close_tasks: Set[asyncio.Task] = set()
+
+    def prewarm(self) -> None:
+        """Create the clients that do not need an event loop and register cleanup at exit."""
+        try:
+            self.s3()
+        except Exception as e:
+            logger.warning("Failed to create S3 client during prewarm: %s", e)
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    def s3(self):
+        """Return the shared boto3 S3 client, boto3 clients are thread-safe."""
+        with self._lock:
+            if self._s3 is None:
+                # boto3 takes a while to import and is only needed once a job process is prewarmed
+                import boto3
+                from botocore.config import Config
+
+                self._s3 = boto3.client(
+                    "s3",
+                    region_name=S3_REGION,
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_KEY"),
+                    config=Config(
+                        max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "20")),
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+            self._last_used["s3"] = time.monotonic()
+            return self._s3
+
+    def livekit(self) -> api.LiveKitAPI:
+        """
+        Return the shared LiveKit API client.
+        Its HTTP session is bound to the event loop it was created on, so it is recreated
+        if a job runs on a different loop.
+        """
+        return self._livekit_client(lease=False)
+
+    def _livekit_client(self, lease: bool) -> api.LiveKitAPI:
+        loop = asyncio.get_running_loop()
+        stale = None
+        with self._lock:
+            if self._livekit is None or self._livekit_loop is not loop:
+                if self._livekit is not None:
+                    stale = self._retire(self._livekit, self._livekit_loop)
+                self._livekit = api.LiveKitAPI()
+                self._livekit_loop = loop
+            client = self._livekit
+            if lease:
+                # taken under the lock, so another loop cannot close it before the lease starts
+                self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+            self._last_used["livekit"] = time.monotonic()
+        if stale is not None:
+            self._close("livekit", *stale)
+        return client
+
+    def http(self) -> aiohttp.ClientSession:
+        """
+        Return the shared aiohttp session for webhooks, recreated if the event loop changed.
+        It is only used from the outbox worker's loop, so it is not leased: the session of a
+        previous loop is closed on that loop right away.
+        """
+        loop = asyncio.get_running_loop()
+        stale = None
+        with self._lock:
+            if self._http is None or self._http.closed or self._http_loop is not loop:
+                if self._http is not None and not self._http.closed:
+                    stale = (self._http, self._http_loop)
+                self._http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=60))
+                self._http_loop = loop
+            session = self._http
+        if stale is not None:
+            self._close("http", *stale)
+        return session
+
+    def _retire(
+        self, client: Any, loop: Optional[asyncio.AbstractEventLoop],
+    ) -> Optional[Tuple[Any, Optional[asyncio.AbstractEventLoop]]]:
+        """
+        Called with the lock held for a client being replaced: returns it for closing now, or
+        keeps it until its last lease ends and returns None.
+        """
+        if self._leases.get(id(client)):
+            self._retired[id(client)] = (client, loop)
+            return None
+        return client, loop
+
+    @contextmanager
+    def lease(self, name: str) -> Iterator[Any]:
+        """
+        Use the "s3" or "livekit" client for the duration of the block. The LiveKit client
+        needs the running event loop, S3 can be leased from any thread.
+        """
+        if name == "s3":
+            client = self.s3()
+            with self._lock:
+                self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+        else:
+            client = self._livekit_client(lease=True)
+        try:
+            yield client
+        finally:
+            with self._lock:
+                remaining = self._leases[id(client)] - 1
+                if remaining:
+                    self._leases[id(client)] = remaining
+                else:
+                    del self._leases[id(client)]
+                retired = self._retired.pop(id(client), None) if not remaining else None
+            if retired is not None:
+                self._close(name, *retired)
+
+    async def close_http(self) -> None:
+        """Close the aiohttp session if it belongs to the running loop, before that loop is closed."""
+        if self._http is not None and self._http_loop is asyncio.get_running_loop():
+            session, self._http, self._http_loop = self._http, None, None
+            await session.close()
+
+    def invalidate(self, name: str, client: Optional[Any] = None) -> None:
+        """
+        Replace a client after a failure, the next call creates a fresh one. The old client
+        is closed now if nothing is using it, when its last lease ends otherwise. With `client`,
+        only that client is replaced: a concurrent failure does not drop the fresh one.
+        """
+        with self._lock:
+            if name == "s3":
+                old, loop = self._s3, None
+                if old is None or (client is not None and client is not old):
+                    return
+                self._s3 = None
+            elif name == "livekit":
+                old, loop = self._livekit, self._livekit_loop
+                if old is None or (client is not None and client is not old):
+                    return
+                self._livekit = None
+            else:
+                return
+            stale = self._retire(old, loop)
+        if stale is not None:
+            self._close(name, *stale)
+
+    def _close(self, name: str, client: Any, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Close a client, an async one on `loop`, the loop it was created on."""
+        if name == "s3":
+            client.close()
+            return
+        if loop is None or loop.is_closed():
+            # its connections went with the loop
+            return
+        close = client.close if name == "http" else client.aclose
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            task = loop.create_task(close())
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(close(), loop)
+
+    def start_health_check(self) -> asyncio.Task:
+        """Run `check_health` in the background, once at a time; the task is kept by the pool."""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self.check_health())
+        return self._health_task
+
+    async def check_health(self) -> Dict[str, bool]:
+        """
+        Check the clients that have been idle for a while, replacing any that fail.
+        """
+        now = time.monotonic()
+        health: Dict[str, bool] = {}
+        if self._livekit is not None and now - self._last_used.get("livekit", 0) > HEALTH_CHECK_INTERVAL:
+            with self.lease("livekit") as client:
+                try:
+                    await client.room.list_rooms(api.ListRoomsRequest(names=["health-check"]))
+                    health["livekit"] = True
+                except Exception as e:
+                    logger.warning("LiveKit API client failed health check: %s", e)
+                    self.invalidate("livekit", client)
+                    health["livekit"] = False
+        bucket_name = os.environ.get("AWS_BUCKET_NAME")
+        if self._s3 is not None and bucket_name and now - self._last_used.get("s3", 0) > HEALTH_CHECK_INTERVAL:
+            with self.lease("s3") as client:
+                try:
+                    await asyncio.to_thread(client.head_bucket, Bucket=bucket_name)
+                    health["s3"] = True
+                except Exception as e:
+                    logger.warning("S3 client failed health check: %s", e)
+                    self.invalidate("s3", client)
+                    health["s3"] = False
+        return health
+
+    async def aclose(self) -> None:
+        if self._livekit is not None:
+            await self._livekit.aclose()
+            self._livekit = None
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        self.close()
+
+    def close(self) -> None:
+        """Close the clients at worker shutdown."""
+        if self._livekit is not None:
+            loop = self._livekit_loop
+            if loop is not None and not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(self._livekit.aclose())
+            self._livekit = None
+        if self._http is not None:
+            loop = self._http_loop
+            if not self._http.closed and loop is not None and not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(self._http.close())
+            self._http = None
+        with self._lock:
+            if self._s3 is not None:
+                self._s3.close()
+                self._s3 = None
+
+
+client_pool = ClientPool()
@@ -1,18 +1,28 @@
 import logging
 from context import UserData
-from logger_config import setup_logging
+from summarizer import AnswerSummarizer, LiveKitCompletionLLM, summaries_enabled
+from prefetch import QuestionPrefetcher, prefetch_enabled, presynthesis_enabled
+from audio_cache import get_audio_cache
+from endpointing import NODE_DELAYS, EndpointingPolicy
+from worker_metrics import observe_pipeline_metrics
 from livekit.agents import llm, metrics
-from livekit.agents import Agent, AgentSession, RunContext
-from livekit.plugins import (
-    cartesia,
-    openai,
-    deepgram,
-)
-from livekit.plugins.turn_detector.multilingual import MultilingualModel
+from livekit.agents import Agent, AgentSession, RunContext, MetricsCollectedEvent
 
 # Use the centralized logger configuration
 logger = logging.getLogger("voice-agent")
 
+
+def import_plugins():
+    """
+    Import the STT, LLM and TTS plugins. They are the bulk of the worker's import time (the openai
+    SDK alone is about a second) and only job processes use them, so they are not imported with
+    this module. livekit plugins register themselves on import, which is only allowed on the main
+    thread: call this from prewarm, or before the worker starts with the thread job executor.
+    """
+    from livekit.plugins import cartesia, deepgram, openai
+    return cartesia, deepgram, openai
+
+
 def create_voice_agent(ctx, userdata, voice_id = None):
     """Create and configure the VoicePipelineAgent."""
     
@@ -28,50 +38,96 @@ def create_voice_agent(ctx, userdata, voice_id = None):
     # Create the agent with all plugins
     logger.info("Configuring voice pipeline agent with plugins")
     try:
+        cartesia, deepgram, openai = import_plugins()
+
         logger.debug("Setting up deepgram STT")
         stt = deepgram.STT()
         
         logger.debug("Setting up OpenAI LLM with gpt-4o-mini model")
         llm_engine = openai.LLM(model="gpt-4o-mini")
+        background_llm = openai.LLM(model="gpt-4o-mini")
         
         logger.debug("Setting up Cartesia TTS")
         if voice_id:
             tts = cartesia.TTS(voice=voice_id)
+            background_tts = cartesia.TTS(voice=voice_id)
         else:
             tts = cartesia.TTS()
-        
-        logger.debug("Setting up turn detector and noise cancellation")
-        # For compatibility with _TurnDetector, use directly from turn_detector without our own variable
+            background_tts = cartesia.TTS()
         
         logger.info("Creating VoicePipelineAgent with all components")
-        agent = AgentSession[UserData](
-            userdata=userdata,
-            vad=ctx.proc.userdata["vad"],
+        models = ctx.proc.userdata["models"]
+        return build_agent_session(
+            userdata,
+            vad=models.vad,
             stt=stt,
-            llm=llm_engine,
+            llm_engine=llm_engine,
             tts=tts,
-            # use LiveKit's transformer-based turn detector
-            turn_detection=MultilingualModel(),  # Create directly inline
-            # minimum delay for endpointing, used when turn detector believes the user is done with their turn
-            min_endpointing_delay=0.5,
-            # maximum delay for endpointing, used when turn detector does not believe the user is done with their turn
-            max_endpointing_delay=5.0,
-            # enable background voice & noise cancellation, powered by Krisp
-            # included at no additional cost with LiveKit Cloud
+            background_llm=background_llm,
+            background_tts=background_tts,
+            # use LiveKit's transformer-based turn detector, shared by the sessions of this process
+            turn_detection=models.turn_detector(),
         )
-        logger.info("Voice pipeline agent created successfully")
     except Exception as e:
-        logger.error(f"Failed to create voice pipeline agent: {str(e)}", exc_info=True)
+        logger.error("Failed to create voice pipeline agent: %s", e, exc_info=True)
         raise
 
+
+def build_agent_session(userdata, *, vad, stt, llm_engine, tts, background_llm, background_tts, turn_detection):
+    """
+    Build the AgentSession from its plugins and attach the interview's background workers
+    and metrics collection. Shared by the live worker and the offline replay harness.
+
+    `background_llm` and `background_tts` serve the LLM calls and speech synthesis made between
+    turns. They are separate instances from `llm_engine` and `tts`: the session reports the
+    metrics of its own LLM and TTS as the turns' metrics.
+    """
+    agent = AgentSession[UserData](
+        userdata=userdata,
+        vad=vad,
+        stt=stt,
+        llm=llm_engine,
+        tts=tts,
+        turn_detection=turn_detection,
+        # endpointing delays for the greeting, each handoff sets those of the next agent (see endpointing.py)
+        # minimum delay for endpointing, used when turn detector believes the user is done with their turn
+        min_endpointing_delay=NODE_DELAYS["greeting"].min_delay,
+        # maximum delay for endpointing, used when turn detector does not believe the user is done with their turn
+        max_endpointing_delay=NODE_DELAYS["greeting"].max_delay,
+        # enable background voice & noise cancellation, powered by Krisp
+        # included at no additional cost with LiveKit Cloud
+    )
+    logger.info("Voice pipeline agent created successfully")
+
+    vad_options = getattr(vad, "_opts", None)
+    userdata.endpointing = EndpointingPolicy(silence=getattr(vad_options, "min_silence_duration", 0.0))
+    userdata.endpointing.bind(agent)
+    userdata.endpointing.apply("greeting")
+    agent.on("user_state_changed", userdata.endpointing.on_user_state_changed)
+    agent.on("agent_state_changed", userdata.endpointing.on_agent_state_changed)
+
+    if summaries_enabled():
+        logger.debug("Setting up background answer summariser")
+        userdata.summarizer = AnswerSummarizer(LiveKitCompletionLLM(background_llm))
+
+    userdata.audio_cache = get_audio_cache()
+
+    if prefetch_enabled():
+        logger.debug("Setting up speculative question prefetch")
+        userdata.prefetcher = QuestionPrefetcher(
+            LiveKitCompletionLLM(background_llm),
+            tts=background_tts if presynthesis_enabled() else None,
+        )
+        agent.on("agent_state_changed", userdata.prefetcher.on_agent_state_changed)
+
     # Set up metrics collection
     logger.debug("Setting up metrics collection")
     usage_collector = metrics.UsageCollector()
 
-    # @agent.on("metrics_collected")
-    # def on_metrics_collected(agent_metrics: metrics.AgentMetrics):
-    #     logger.debug(f"Metrics collected: {type(agent_metrics).__name__}")
-    #     metrics.log_metrics(agent_metrics)
-    #     usage_collector.collect(agent_metrics)
-        
+    @agent.on("metrics_collected")
+    def on_metrics_collected(event: MetricsCollectedEvent):
+        usage_collector.collect(event.metrics)
+        userdata.latency.on_metrics(event.metrics)
+        observe_pipeline_metrics(event.metrics)
+
     return agent, usage_collector 
\ No newline at end of file
@@ -1,11 +1,16 @@
-import json
 import logging
-from logger_config import setup_logging
 from livekit.agents.voice import Agent
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
 from flow import FlowGraph, Node
-from openai import OpenAI
+from history import ChatHistory
+from summarizer import AnswerSummarizer
+from prefetch import QuestionPrefetcher
+from audio_cache import AudioCache
+from recording import RecordingTask
+from latency import TurnLatencyTracker
+from endpointing import EndpointingPolicy
+from metadata import SessionMetadata
 
 # Use the centralized logger configuration
 logger = logging.getLogger("voice-agent")
@@ -21,31 +26,48 @@ class UserData:
     prev_agent: Optional[Agent] = None
     # store candidate’s answers for summary or follow-ups
     answers: Dict[str, str] = field(default_factory=dict)
+    # prebuilt FlowQuestionAgent instructions by node id, shared through the flow cache
+    question_instructions: Dict[str, str] = field(default_factory=dict)
+    # shared conversation log, each agent gets a bounded window of it on handoff
+    history: ChatHistory = field(default_factory=ChatHistory)
+    # fills `answers` in the background once a question has been answered
+    summarizer: Optional[AnswerSummarizer] = None
+    # opt-in speculative drafting of the next question
+    prefetcher: Optional[QuestionPrefetcher] = None
+    # pre-synthesised audio for fixed utterances, None when TTS_CACHE_DIR is not set
+    audio_cache: Optional[AudioCache] = None
+    # egress setup running in the background, see RecordingTask
+    recording: Optional[RecordingTask] = None
+    # per-turn latency breakdown, fed by the session's metrics events and the agents
+    latency: TurnLatencyTracker = field(default_factory=TurnLatencyTracker)
+    # endpointing delays of each agent, adapted to the candidate's pauses
+    endpointing: Optional[EndpointingPolicy] = None
+    # the participant metadata, parsed once at join (None in the offline replay)
+    metadata: Optional[SessionMetadata] = None
+    # one record per branch decision: node, choice, source (llm / fallback) and latency
+    branch_decisions: List[Dict[str, Any]] = field(default_factory=list)
 
+    @property
+    def voice_id(self) -> str:
+        if self.metadata is not None:
+            return self.metadata.voice_id
+        return (self.context_data.get("voice") or {}).get("id", "")
 
 
-def extract_context_data(participant):
-    """Extract context data from participant metadata if it exists."""
-    logger.info(f"Extracting context data for participant {participant.identity}")
-    context_data = {}
-    if participant.metadata:
-        try:
-            logger.debug(f"Raw metadata: {participant.metadata}")
-            metadata = json.loads(participant.metadata)
-            if metadata.get("type") == "interview_context":
-                context_data = metadata
-                logger.info(f"Successfully parsed interview context with {len(context_data)} fields")
-                # Log specific fields for debugging but avoid sensitive data
-                for key in ["scout_name", "company_name", "type", "voice"]:
-                    if key in context_data:
-                        logger.debug(f"Context contains {key}: {context_data[key]}")
-            else:
-                logger.info(f"Metadata does not contain interview context, type: {metadata.get('type')}")
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse participant metadata as JSON: {participant.metadata[:50]}...")
-    else:
-        logger.info("No metadata available for participant")
-    return context_data
+def extract_context_data(metadata: SessionMetadata):
+    """Return the interview context of the participant's parsed metadata, empty if there is none."""
+    if metadata.is_interview:
+        context_data = metadata.context
+        logger.info("Successfully parsed interview context with %d fields", len(context_data))
+        # Log specific fields for debugging but avoid sensitive data
+        if logger.isEnabledFor(logging.DEBUG):
+            for key in ["scout_name", "company_name", "type", "voice"]:
+                if key in context_data:
+                    logger.debug("Context contains %s: %s", key, context_data[key])
+        return context_data
+    if metadata.type is not None:
+        logger.info("Metadata does not contain interview context, type: %s", metadata.type)
+    return {}
 
 
 def build_system_prompt(context_data):
@@ -61,7 +83,7 @@ def build_system_prompt(context_data):
         company_description = context_data.get("company_description", "")
         company_culture = context_data.get("company_culture", "")
         
-        logger.debug(f"Using scout_name: {scout_name}, scout_role: {scout_role}, company_name: {company_name}")
+        logger.debug("Using scout_name: %s, scout_role: %s, company_name: %s", scout_name, scout_role, company_name)
         
         # Create a more detailed interview-specific prompt
         system_prompt = (
@@ -111,16 +133,27 @@ def build_system_prompt(context_data):
             "You were created as a demo to showcase the capabilities of LiveKit's agents framework."
         )
     
-    logger.debug(f"Built system prompt with {len(system_prompt)} characters")
+    logger.debug("Built system prompt with %d characters", len(system_prompt))
     return system_prompt
 
+def build_question_instructions(node: Node) -> str:
+    """Build the FlowQuestionAgent instructions for a question node."""
+    return f"Keeping the following criteria for the question in mind: {node.criteria}, Please ask the applicant this question: {node.content}. Ensure the question is asked in a friendly and natural manner, and keep the flow of the conversation smooth and natural."
+
+
 def create_greeting(context_data):
     """Create a personalized greeting based on context."""
     logger.info("Creating greeting for participant")
     greeting = "Hey, how can I help you today?"
     if context_data.get("scout_name"):
-        logger.info(f"Creating personalized greeting for {context_data.get('scout_name')}")
-        greeting = f"Hello, I'm {context_data.get('scout_name')} from {context_data.get('company_name', 'the company')}. Thanks for joining this interview today. How are you doing?"
-    logger.debug(f"Greeting: {greeting}")
+        logger.info("Creating personalized greeting for %s", context_data.get("scout_name"))
+        greeting = f"Hello, I'm {context_data.get('scout_name')} from {context_data.get('company_name', 'the company')}. Thanks for joining this interview today. Are you ready to get started?"
+    logger.debug("Greeting: %s", greeting)
     return greeting
 
+
+def create_closing(context_data):
+    """Create the closing line spoken at the end of the interview."""
+    company_name = context_data.get("company_name", "the company")
+    return f"Thank you so much for your time today. The team at {company_name} will be in touch about next steps. Goodbye!"
+
@@ -0,0 +1,138 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from latency import Histogram
+
+logger = logging.getLogger("voice-agent")
+
+# pauses seen before the candidate's own pauses replace the node defaults
+MIN_PAUSE_SAMPLES = int(os.environ.get("ENDPOINTING_MIN_SAMPLES", "5"))
+# added to the minimum delay for every turn the candidate resumed right after it was closed
+CUTOFF_STEP = 0.1
+# the maximum delay waits this long past the candidate's p90 pause
+MAX_DELAY_MARGIN = 0.5
+
+
+def adaptive_endpointing_enabled() -> bool:
+    return os.environ.get("ENDPOINTING_ADAPTIVE", "true").lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class EndpointingDelays:
+    # used when the turn detector believes the candidate is done
+    min_delay: float
+    # used when the turn detector believes the candidate will go on
+    max_delay: float
+
+
+# by the kind of answer the agent expects: a yes/no to the greeting, a pick between options at
+# a branch, an open answer to a question
+NODE_DELAYS = {
+    "greeting": EndpointingDelays(0.3, 2.0),
+    "branch": EndpointingDelays(0.4, 3.0),
+    "question": EndpointingDelays(0.5, 5.0),
+    "end": EndpointingDelays(0.3, 2.0),
+}
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return min(high, max(low, value))
+
+
+class EndpointingPolicy:
+    """
+    Picks the endpointing delays of each agent from the kind of node it handles and the
+    candidate's pauses so far.
+
+    A pause is a silence after which the candidate went on talking before the agent took the turn.
+    A cutoff is the candidate starting to talk again while the agent was already preparing its
+    reply. Once MIN_PAUSE_SAMPLES pauses are known, the minimum delay follows the candidate's median
+    pause (plus CUTOFF_STEP per cutoff) and the maximum delay their p90 pause plus a margin, each
+    kept within a range around the node default.
+
+    The session reads the delays when an agent starts, so decisions are applied on handoff (see
+    agents.agent_for_node). Every decision is logged and kept in `decisions` for the replay report.
+    """
+    def __init__(self, silence: float = 0.0):
+        # the VAD reports the end of speech after this much silence, counted back into the pauses
+        self.silence = silence
+        self.pauses = Histogram(size=256)
+        self.cutoffs = 0
+        self.decisions: List[Dict[str, Any]] = []
+        self._options: Optional[Any] = None
+        self._agent_state = "initializing"
+        self._stopped_at: Optional[float] = None
+        self._turn_closed = False
+
+    def bind(self, session: Any) -> None:
+        self._options = session.options
+
+    def observe_pause(self, seconds: float) -> None:
+        self.pauses.observe(seconds)
+
+    def observe_cutoff(self) -> None:
+        self.cutoffs += 1
+        logger.info("Candidate resumed after the turn was closed (%d so far)", self.cutoffs)
+
+    def on_user_state_changed(self, event: Any) -> None:
+        now = time.monotonic()
+        if event.new_state == "listening":
+            self._stopped_at = now
+            self._turn_closed = False
+            return
+        if event.new_state != "speaking" or self._stopped_at is None:
+            return
+        pause = now - self._stopped_at + self.silence
+        self._stopped_at = None
+        if not self._turn_closed:
+            self.observe_pause(pause)
+        elif self._agent_state == "thinking":
+            self.observe_cutoff()
+
+    def on_agent_state_changed(self, event: Any) -> None:
+        self._agent_state = event.new_state
+        if event.new_state == "thinking":
+            self._turn_closed = True
+        elif event.new_state == "speaking":
+            # the agent has the turn, the next speech is a new answer (or an interruption)
+            self._stopped_at = None
+
+    def decide(self, kind: str, node_id: Optional[str] = None) -> EndpointingDelays:
+        base = NODE_DELAYS.get(kind, NODE_DELAYS["question"])
+        min_delay = base.min_delay + self.cutoffs * CUTOFF_STEP
+        max_delay = base.max_delay
+        source = "node"
+        if adaptive_endpointing_enabled() and self.pauses.count >= MIN_PAUSE_SAMPLES:
+            min_delay = self.pauses.percentile(0.5) + self.cutoffs * CUTOFF_STEP
+            max_delay = self.pauses.percentile(0.9) + MAX_DELAY_MARGIN
+            source = "candidate"
+        delays = EndpointingDelays(
+            min_delay=round(_clamp(min_delay, base.min_delay * 0.6, base.min_delay * 2), 3),
+            max_delay=round(_clamp(max_delay, base.max_delay * 0.5, base.max_delay * 1.5), 3),
+        )
+        self.decisions.append({
+            "node": node_id,
+            "kind": kind,
+            "source": source,
+            "min_delay": delays.min_delay,
+            "max_delay": delays.max_delay,
+            "pauses": self.pauses.count,
+            "pause_p50_ms": self.pauses.summary()["p50_ms"],
+            "cutoffs": self.cutoffs,
+        })
+        logger.info(
+            "Endpointing for %s %s: min %.2fs, max %.2fs (from %s, %d pauses, %d cutoffs)",
+            kind, node_id or "-", delays.min_delay, delays.max_delay, source, self.pauses.count, self.cutoffs,
+        )
+        return delays
+
+    def apply(self, kind: str, node_id: Optional[str] = None) -> EndpointingDelays:
+        """Decide the delays for the agent about to start and set them on the session."""
+        delays = self.decide(kind, node_id)
+        if self._options is not None:
+            self._options.min_endpointing_delay = delays.min_delay
+            self._options.max_endpointing_delay = delays.max_delay
+        return delays
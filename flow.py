@@ -1,6 +1,12 @@
+from collections import deque
+from dataclasses import dataclass
 from enum import Enum, auto
 import json
-from typing import List, Dict, Optional, Any, Union
+import logging
+from types import MappingProxyType
+from typing import List, Dict, Optional, Any, Union, Mapping, Tuple
+
+logger = logging.getLogger("voice-agent")
 
 class NodeType(Enum):
     """Enum representing different types of nodes in the interview flow."""
@@ -9,6 +15,13 @@ class NodeType(Enum):
     START = "start"
     END = "conclusion"
 
+
+_NODE_TYPES: Dict[str, NodeType] = {t.value: t for t in NodeType}
+
+
+class FlowValidationError(ValueError):
+    """Raised when an interview flow cannot be compiled into a traversal plan."""
+
 class Node:
     """
     Represents a node in the interview flow.
@@ -18,12 +31,8 @@ class Node:
         self.content = content
         self.criteria = criteria
         self.follow_up_toggle = follow_up_toggle
-        # Convert string node_type to enum
-        try:
-            self.type = next((t for t in NodeType if t.value == node_type), NodeType.END)
-        except Exception:
-            # Fallback to END in case of any error
-            self.type = NodeType.END
+        # Convert string node_type to enum, falling back to END for unknown types
+        self.type = _NODE_TYPES.get(node_type, NodeType.END)
 
 
     def __repr__(self):
@@ -46,9 +55,124 @@ class Edge:
         return f"Edge(id={self.id!r}, {self.source!r} -> {self.target!r})"
 
 
+@dataclass(frozen=True)
+class FlowPlan:
+    """
+    Immutable traversal plan compiled from a FlowGraph.
+    Nodes are addressed by their position in `nodes`; every per-node table is indexed the same way.
+    """
+    nodes: Tuple[Node, ...]
+    index: Mapping[str, int]
+    start: int
+    # successor indices in edge order, branch options are the successors of BRANCH nodes
+    successors: Tuple[Tuple[int, ...], ...]
+    branch_options: Tuple[Tuple[Node, ...], ...]
+    # shortest number of edges from the START node
+    depth: Tuple[int, ...]
+    # most question nodes left on any path after this node
+    remaining_questions: Tuple[int, ...]
+
+
+def compile_plan(nodes: Dict[str, Node], edges: List[Edge]) -> FlowPlan:
+    """
+    Validate the flow and build its traversal plan.
+
+    Raises:
+        FlowValidationError: if the flow has no single START node, dangling edges,
+            dead ends, cycles, or no reachable END node.
+    """
+    starts = [n.id for n in nodes.values() if n.type == NodeType.START]
+    if len(starts) != 1:
+        raise FlowValidationError(f"Flow must have exactly one start node, found {len(starts)}")
+
+    dangling = [e.id for e in edges if e.source not in nodes or e.target not in nodes]
+    if dangling:
+        raise FlowValidationError(f"Flow has edges pointing to unknown nodes: {dangling}")
+
+    ordered = tuple(nodes.values())
+    index = {node.id: i for i, node in enumerate(ordered)}
+    targets: List[List[int]] = [[] for _ in ordered]
+    for edge in edges:
+        target = index[edge.target]
+        if target not in targets[index[edge.source]]:
+            targets[index[edge.source]].append(target)
+    start = index[starts[0]]
+
+    for i, node in enumerate(ordered):
+        if node.type not in (NodeType.BRANCH, NodeType.END) and len(targets[i]) > 1:
+            logger.warning("Node %s is not a branching node but has %s outgoing edges, only the first is used", node.id, len(targets[i]))
+    # the edges that can actually be taken at runtime
+    successors = tuple(
+        () if node.type == NodeType.END else tuple(t) if node.type == NodeType.BRANCH else tuple(t[:1])
+        for node, t in zip(ordered, targets)
+    )
+
+    # breadth-first walk from START gives reachability and depth
+    depth = [-1] * len(ordered)
+    depth[start] = 0
+    queue = deque([start])
+    while queue:
+        i = queue.popleft()
+        for j in successors[i]:
+            if depth[j] < 0:
+                depth[j] = depth[i] + 1
+                queue.append(j)
+
+    reachable = [i for i in range(len(ordered)) if depth[i] >= 0]
+    unreachable = [ordered[i].id for i in range(len(ordered)) if depth[i] < 0]
+    if unreachable:
+        logger.warning("Flow nodes are unreachable from the start node: %s", unreachable)
+    if not any(ordered[i].type == NodeType.END for i in reachable):
+        raise FlowValidationError("Flow has no end node reachable from the start node")
+
+    dead_ends = [ordered[i].id for i in reachable if ordered[i].type != NodeType.END and not successors[i]]
+    if dead_ends:
+        raise FlowValidationError(f"Flow nodes have no outgoing edges: {dead_ends}")
+
+    # depth-first post order over the reachable subgraph, detecting back edges (cycles)
+    order: List[int] = []
+    state = [0] * len(ordered)  # 0 = unvisited, 1 = on stack, 2 = done
+    stack = [(start, iter(successors[start]))]
+    state[start] = 1
+    while stack:
+        i, children = stack[-1]
+        for j in children:
+            if state[j] == 1:
+                raise FlowValidationError(f"Flow contains a cycle through node {ordered[j].id}")
+            if state[j] == 0:
+                state[j] = 1
+                stack.append((j, iter(successors[j])))
+                break
+        else:
+            state[i] = 2
+            order.append(i)
+            stack.pop()
+
+    remaining = [0] * len(ordered)
+    for i in order:
+        remaining[i] = max(
+            (remaining[j] + (ordered[j].type == NodeType.QUESTION) for j in successors[i]),
+            default=0,
+        )
+
+    return FlowPlan(
+        nodes=ordered,
+        index=MappingProxyType(index),
+        start=start,
+        successors=successors,
+        branch_options=tuple(
+            tuple(ordered[j] for j in succ) if node.type == NodeType.BRANCH else ()
+            for node, succ in zip(ordered, successors)
+        ),
+        depth=tuple(depth),
+        remaining_questions=tuple(remaining),
+    )
+
+
 class FlowGraph:
     """
     Encapsulates the nodes and edges of the interview flow and provides utility methods.
+    The flow is validated and compiled into a FlowPlan on construction.
     """
     def __init__(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]):
         # Parse nodes
@@ -81,6 +205,8 @@ class FlowGraph:
             self._by_source.setdefault(edge.source, []).append(edge)
             self._by_target.setdefault(edge.target, []).append(edge)
 
+        self.plan: FlowPlan = compile_plan(self.nodes, self.edges)
+
     @classmethod
     def from_json_file(cls, path: str) -> "FlowGraph":
         """
@@ -110,22 +236,54 @@ class FlowGraph:
         - For question/section nodes: returns a single node ID
         - For end nodes: raises an error
         """
-        node = self.get_node(node_id)
-        if node is None:
+        i = self.plan.index.get(node_id)
+        if i is None:
             return None
-        
+        node = self.plan.nodes[i]
+
         if node.type == NodeType.END:
             raise ValueError(f"Cannot get next node for end node {node_id}")
-        
-        outgoing_edges = self._by_source.get(node_id, [])
-        if not outgoing_edges:
+
+        successors = self.plan.successors[i]
+        if not successors:
+            # only possible for nodes that are unreachable from the start node
             raise ValueError(f"Node {node_id} has no outgoing edges")
-            
+
         if node.type == NodeType.BRANCH:
-            return [edge.target for edge in outgoing_edges]
+            return [self.plan.nodes[j].id for j in successors]
         else:
             # For question/section nodes, return just the first target as a string
-            return outgoing_edges[0].target
+            return self.plan.nodes[successors[0]].id
+
+    def get_next_node(self, node_id: str) -> Optional[Node]:
+        """
+        Return the single node following a non-branching node, or None if there is none.
+        """
+        i = self.plan.index.get(node_id)
+        if i is None or not self.plan.successors[i]:
+            return None
+        return self.plan.nodes[self.plan.successors[i][0]]
+
+    def get_branch_options(self, node_id: str) -> Tuple[Node, ...]:
+        """
+        Return the candidate next nodes of a branching node, in edge order.
+        """
+        i = self.plan.index.get(node_id)
+        return self.plan.branch_options[i] if i is not None else ()
+
+    def get_depth(self, node_id: str) -> Optional[int]:
+        """
+        Return the number of edges between the START node and the given node.
+        """
+        i = self.plan.index.get(node_id)
+        return self.plan.depth[i] if i is not None else None
+
+    def get_remaining_questions(self, node_id: str) -> int:
+        """
+        Return the most question nodes that can still follow the given node.
+        """
+        i = self.plan.index.get(node_id)
+        return self.plan.remaining_questions[i] if i is not None else 0
 
     def get_previous_node_ids(self, node_id: str) -> List[str]:
         """
@@ -136,12 +294,9 @@ class FlowGraph:
 
     def get_initial_node(self) -> Optional[Node]:
         """
-        Return the START node in the flow, or None if none exists.
+        Return the START node in the flow, compilation guarantees there is exactly one.
         """
-        for node_id, node in self.nodes.items():
-            if node.type == NodeType.START:
-                return node
-        return None
+        return self.plan.nodes[self.plan.start]
 
     def is_question_node(self, node_id: str) -> bool:
         """
@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from context import build_question_instructions
+from flow import FlowGraph
+from metadata import flow_key
+
+logger = logging.getLogger("voice-agent")
+
+
+@dataclass(frozen=True)
+class CompiledFlow:
+    """A compiled flow graph together with the prebuilt per-node agent instructions."""
+    key: str
+    graph: FlowGraph
+    # FlowQuestionAgent instructions by question node id
+    question_instructions: Dict[str, str]
+
+
+def compile_flow(flow_data: Dict[str, Any], key: str = "") -> CompiledFlow:
+    """
+    Parse and compile a flow payload and prebuild the instructions for its question nodes.
+    """
+    graph = FlowGraph.from_dict(flow_data)
+    instructions = {
+        node_id: build_question_instructions(graph.get_node(node_id))
+        for node_id in graph.all_question_ids()
+    }
+    return CompiledFlow(key=key or flow_key(flow_data), graph=graph, question_instructions=instructions)
+
+
+class FlowCache:
+    """
+    Process-wide LRU cache of compiled flows, keyed by a hash of the payload (see flow_key).
+    Every applicant to a job sends the same flow, so it only needs compiling once per worker process.
+
+    Only the thread job executor (JOB_EXECUTOR_TYPE=thread) runs several sessions in one process.
+    The default process executor starts a fresh process for every job and never reuses it, so
+    the cache never hits there and each session compiles its flow once, as it would uncached.
+    """
+    def __init__(self, max_size: int = 64, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, CompiledFlow]]" = OrderedDict()
+        # job executors may run sessions on threads of the same process
+        self._lock = threading.Lock()
+
+    def get(self, flow_data: Dict[str, Any], key: Optional[str] = None) -> CompiledFlow:
+        """
+        Return the compiled flow for the payload, compiling and caching it on a miss.
+        `key` is the payload's flow_key when the caller has it already.
+        Invalid flows raise FlowValidationError and are never cached.
+        """
+        key = key or flow_key(flow_data)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+
+        compiled = compile_flow(flow_data, key)
+        with self._lock:
+            self._entries[key] = (now, compiled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        logger.info("Compiled flow %s cached (%s)", key, self.stats())
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+flow_cache = FlowCache(
+    max_size=int(os.environ.get("FLOW_CACHE_SIZE", "64")),
+    ttl=float(os.environ.get("FLOW_CACHE_TTL", "3600")),
+)
+
+
+def get_compiled_flow(flow_data: Dict[str, Any], key: Optional[str] = None) -> CompiledFlow:
+    """
+    Return the compiled flow for a payload from the process-wide cache.
+    """
+    return flow_cache.get(flow_data, key)
@@ -0,0 +1,101 @@
+import os
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+# default budget for the context each agent inherits on handoff
+MAX_ITEMS = int(os.environ.get("CONTEXT_MAX_ITEMS", "30"))
+MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "3000"))
+MAX_FUNCTION_CALLS = int(os.environ.get("CONTEXT_MAX_FUNCTION_CALLS", "2"))
+
+_FUNCTION_ITEMS = ("function_call", "function_call_output")
+
+
+def estimate_tokens(item: Any) -> int:
+    """Rough token estimate for a chat item (about four characters per token)."""
+    if item.type == "message":
+        text = item.text_content or ""
+    elif item.type == "function_call":
+        text = f"{item.name}{item.arguments}"
+    else:
+        text = str(getattr(item, "output", ""))
+    return len(text) // 4 + 4
+
+
+class ChatHistory:
+    """
+    Append-only conversation log shared by every agent of a session.
+
+    On handoff the previous agent's new items are appended once, and the next agent
+    receives a bounded window of the log instead of a full copy, so the cost of a
+    handoff and the size of the prompt stay constant as the interview goes on.
+    Items are tagged with the flow node they were spoken at, so an answered question
+    can be compacted out of the log once it has been summarised.
+    """
+    def __init__(
+        self,
+        max_items: int = MAX_ITEMS,
+        max_tokens: int = MAX_TOKENS,
+        max_function_calls: int = MAX_FUNCTION_CALLS,
+    ):
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_function_calls = max_function_calls
+        self._items: List[Tuple[Any, int, Optional[str]]] = []
+        self._ids: Set[str] = set()
+
+    def extend(self, items: Iterable[Any], node_id: Optional[str] = None) -> int:
+        """
+        Append the items not already in the log and return how many were added.
+        System messages are agent specific and never enter the log.
+        """
+        added = 0
+        for item in items:
+            if item.id in self._ids:
+                continue
+            if item.type == "message" and item.role == "system":
+                continue
+            self._ids.add(item.id)
+            self._items.append((item, estimate_tokens(item), node_id))
+            added += 1
+        return added
+
+    def window(self) -> List[Any]:
+        """
+        Return the most recent items that fit the item and token budgets.
+        Only the newest `max_function_calls` tool calls are kept, with their outputs.
+        """
+        selected: List[Any] = []
+        kept_calls: Set[str] = set()
+        tokens = 0
+        for item, cost, _ in reversed(self._items):
+            if len(selected) >= self.max_items or tokens + cost > self.max_tokens:
+                break
+            if item.type == "function_call_output":
+                if len(kept_calls) >= self.max_function_calls:
+                    continue
+                kept_calls.add(item.call_id)
+            elif item.type == "function_call" and item.call_id not in kept_calls:
+                continue
+            selected.append(item)
+            tokens += cost
+        selected.reverse()
+
+        # never start the context in the middle of a tool call
+        while selected and selected[0].type in _FUNCTION_ITEMS:
+            selected.pop(0)
+        return selected
+
+    def items_for(self, node_id: str) -> List[Any]:
+        """Return the logged items spoken at the given node."""
+        return [item for item, _, node in self._items if node == node_id]
+
+    def compact(self, node_id: str) -> int:
+        """
+        Drop the items of a summarised node from the log and return how many were removed.
+        Their ids stay known, so they are not appended again by a later handoff.
+        """
+        before = len(self._items)
+        self._items = [entry for entry in self._items if entry[2] != node_id]
+        return before - len(self._items)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,227 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger("voice-agent")
+
+# samples kept per histogram, percentiles are computed over this window
+RESERVOIR_SIZE = 2048
+
+# stages on the path from the end of the candidate's speech to the agent's first audio
+TURN_STAGES = ("end_of_utterance", "llm_ttft", "llm_followup_ttft", "handoff", "tts_ttfb")
+
+
+class Histogram:
+    """Latency histogram over a bounded window of recent samples, in seconds."""
+    def __init__(self, size: int = RESERVOIR_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean and p50/p95/p99 in milliseconds."""
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.50)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+        }
+
+
+class LatencyStats:
+    """A histogram per pipeline stage, and per stage of each flow node when observed with one."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.nodes: Dict[str, Dict[str, Histogram]] = {}
+
+    def observe(self, stage: str, value: float, node: Optional[str] = None) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(value)
+            if node is None:
+                return
+            by_stage = self.nodes.setdefault(node, {})
+            histogram = by_stage.get(stage)
+            if histogram is None:
+                histogram = by_stage[stage] = Histogram(size=256)
+            histogram.observe(value)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: histogram.summary() for stage, histogram in self.stages.items()}
+
+    def node_summary(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        with self._lock:
+            return {
+                node: {stage: histogram.summary() for stage, histogram in by_stage.items()}
+                for node, by_stage in self.nodes.items()
+            }
+
+
+# aggregated over every session of this worker process
+worker_latency = LatencyStats()
+
+
+class TurnLatencyTracker:
+    """
+    Breaks down the latency of each turn, from the end of the candidate's speech to the
+    agent's first audio, by joining the pipeline metrics of that turn on its speech id.
+
+    Stages: end_of_utterance (VAD end of speech to turn detector decision), stt_final
+    (end of speech to final transcript), llm_ttft, llm_followup_ttft (tool call round trips),
+    tts_ttfb, plus handoff time measured by the agents. `turn` is the sum of TURN_STAGES.
+
+    An answer that ends in a transition tool is not spoken: the new agent asks the next question
+    from on_enter, without an end of utterance of its own. The answer's stages are carried over
+    to that speech, with the handoff time, so the turn is still measured end to end.
+
+    The session's stats are also kept per flow node, the node the agent was at when the turn
+    started. Node ids are only unique within a flow, so the worker-wide stats are by stage only.
+    A turn without TTS (a silent branch decision, a reply interrupted before synthesis) is dropped
+    when the candidate's next turn starts.
+    """
+    def __init__(self):
+        self.session = LatencyStats()
+        self._turns: Dict[str, Dict[str, float]] = {}
+        self._turn_nodes: Dict[str, Optional[str]] = {}
+        self._pending_eou: Optional[Dict[str, float]] = None
+        self.node_id: Optional[str] = None
+        self.handoff_started: Optional[float] = None
+        # (answer speech id, its stages, its node) while waiting for the new agent's speech
+        self._handoff_turn: Optional[Tuple[str, Dict[str, float], Optional[str]]] = None
+
+    def observe(self, stage: str, value: float, node: Optional[str] = None) -> None:
+        self.session.observe(stage, value, node)
+        worker_latency.observe(stage, value)
+
+    def _turn(self, speech_id: str) -> Dict[str, float]:
+        turn = self._turns.get(speech_id)
+        if turn is None:
+            turn = self._turns[speech_id] = {}
+            self._turn_nodes[speech_id] = self.node_id
+        return turn
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        stale = [speech_id for speech_id in self._turns if speech_id != keep]
+        for speech_id in stale:
+            del self._turns[speech_id]
+            self._turn_nodes.pop(speech_id, None)
+        if self._handoff_turn is not None:
+            stale.append(self._handoff_turn[0])
+            self._handoff_turn = None
+        if stale and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Dropped %d turns without TTS: %s", len(stale), ", ".join(stale))
+
+    def _resume_handoff(self, speech_id: str) -> Dict[str, float]:
+        """Return the turn for `speech_id`, taking over the turn carried by a handoff if any."""
+        if self._handoff_turn is None:
+            return self._turn(speech_id)
+        origin, turn, node = self._handoff_turn
+        if speech_id != origin:
+            # the new agent's first speech
+            self._handoff_turn = None
+            self._turns[speech_id] = turn
+            self._turn_nodes[speech_id] = node
+        return turn
+
+    def on_metrics(self, metrics: Any) -> None:
+        """Feed one item from the session's `metrics_collected` events."""
+        kind = type(metrics).__name__
+        if kind == "EOUMetrics":
+            eou = {
+                "end_of_utterance": metrics.end_of_utterance_delay,
+                "stt_final": metrics.transcription_delay,
+            }
+            speech_id = getattr(metrics, "speech_id", None)
+            # the candidate's next turn: anything still pending never got to TTS
+            self._evict(keep=speech_id)
+            if speech_id:
+                self._turn(speech_id).update(eou)
+            else:
+                self._pending_eou = eou
+        elif kind == "LLMMetrics" and metrics.speech_id:
+            turn = self._turns.get(metrics.speech_id)
+            if turn is None:
+                turn = self._resume_handoff(metrics.speech_id)
+            if "llm_ttft" in turn:
+                # a tool call round trip within the same turn, or the new agent's reply after a handoff
+                turn["llm_followup_ttft"] = turn.get("llm_followup_ttft", 0.0) + metrics.ttft
+                return
+            turn["llm_ttft"] = metrics.ttft
+            if self._pending_eou is not None and "end_of_utterance" not in turn:
+                turn.update(self._pending_eou)
+            self._pending_eou = None
+        elif kind == "TTSMetrics" and metrics.speech_id:
+            if metrics.speech_id not in self._turns:
+                self._resume_handoff(metrics.speech_id)
+            turn = self._turns.pop(metrics.speech_id, None)
+            node = self._turn_nodes.pop(metrics.speech_id, self.node_id)
+            if turn is None or "llm_ttft" not in turn:
+                # agent initiated speech (e.g. a cached utterance), not a reply to the candidate
+                return
+            turn["tts_ttfb"] = metrics.ttfb
+            self._finish_turn(metrics.speech_id, turn, node)
+
+    def _finish_turn(self, speech_id: str, turn: Dict[str, float], node: Optional[str]) -> None:
+        for stage, value in turn.items():
+            if value is not None and value >= 0:
+                self.observe(stage, value, node)
+        if "end_of_utterance" in turn:
+            total = sum(turn.get(stage, 0.0) for stage in TURN_STAGES)
+            self.observe("turn", total, node)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Turn latency %.0f ms at node %s (%s): %s", total * 1000, node, speech_id,
+                    ", ".join(f"{stage}={value * 1000:.0f}ms" for stage, value in turn.items()),
+                )
+
+    def start_handoff(self) -> None:
+        """Mark the start of a handoff, when a transition tool is called."""
+        self.handoff_started = time.perf_counter()
+
+    def finish_handoff(self, node_id: Optional[str], setup: float) -> None:
+        """
+        Record the handoff into a new agent: `handoff` spans the tool call to the end of the
+        new agent's context setup, `agent_setup` is the on_enter context carry-over alone.
+        The handoff is added to the answer's turn, which the new agent's first speech completes.
+        """
+        self.node_id = node_id
+        self.observe("agent_setup", setup, node_id)
+        if self.handoff_started is None:
+            return
+        handoff = time.perf_counter() - self.handoff_started
+        self.handoff_started = None
+        answered = [speech_id for speech_id, turn in self._turns.items() if "end_of_utterance" in turn]
+        if not answered:
+            # not triggered by an answer of the candidate
+            self.observe("handoff", handoff, node_id)
+            return
+        speech_id = answered[-1]
+        turn = self._turns.pop(speech_id)
+        turn["handoff"] = turn.get("handoff", 0.0) + handoff
+        self._handoff_turn = (speech_id, turn, self._turn_nodes.pop(speech_id, node_id))
+
+    def report(self) -> None:
+        logger.info("Session latency (by stage): %s", self.session.summary())
+        logger.info("Session latency (by node): %s", self.session.node_summary())
+        logger.info("Worker latency (by stage): %s", worker_latency.summary())
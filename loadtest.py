@@ -0,0 +1,311 @@
+"""
+Find how many concurrent interviews one worker process can hold.
+
+Runs N scripted interviews at once in this process, for each N in --sessions. Each interview
+goes through the replay harness (real agents, stub LLM/TTS, see replay.py) with a synthetic
+candidate of its own:
+
+- a microphone streaming in real time through the session's Silero VAD stream: a voiced signal
+  while the candidate speaks a turn (0.3 s per word), silence while the agent has the turn. The
+  turn is submitted once the VAD reports the end of speech
+- the end-of-turn prediction on the session's conversation, through the batching turn detector of
+  the process (turn_service.py) as with TURN_BATCHING, its time added to the turn's latency
+
+For every step it records:
+
+- cpu: process CPU time over wall time, in cores, and as a fraction of the machine, which is
+  what the default WorkerOptions load function reports against `load_threshold`
+- rss_mb: resident memory at the end of the step
+- loop lag: delay of the event loop waking up a 50 ms timer
+- per-turn latency across every session of the step
+
+    python loadtest.py --sessions 1,2,4,8,16 --max-p95-ms 2000 --max-lag-ms 100
+
+The turn detector runs the real model, which has to be downloaded first (`python session.py
+download-files`). --eou-synthetic BASE_MS,PER_ITEM_MS stands in a model of that cost instead (see
+turn_bench.py), and --no-eou skips it: the results are then marked as excluding end-of-turn inference.
+
+The largest N within both budgets is reported with its CPU load, as a starting point for
+`load_threshold` and instance sizing.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from livekit import rtc
+from livekit.plugins.turn_detector.base import MAX_HISTORY_TURNS
+from livekit.plugins.turn_detector.multilingual import _EUORunnerMultilingual
+
+from latency import Histogram
+from logger_config import setup_logging
+from models import model_pool, rss_mb
+from replay import add_replay_arguments, replay
+from turn_bench import SyntheticTurnModel
+from turn_service import OnnxTurnModel, TurnInferenceService
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+LAG_INTERVAL = 0.05
+SECONDS_PER_WORD = 0.3
+# the VAD has this long after the end of a turn to report it, before the turn goes ahead anyway
+VAD_GRACE = 3.0
+
+
+def _turn_messages(items: List[Any]) -> List[Dict[str, str]]:
+    """The conversation as the turn detector plugin sends it: the text of the user and assistant messages."""
+    messages = []
+    for item in items:
+        if item.type == "message" and item.role in ("user", "assistant") and item.text_content:
+            messages.append({"role": item.role, "content": item.text_content})
+    return messages
+
+
+class SyntheticCandidate:
+    """
+    The candidate of one session, passed to replay() as its `candidate`. The microphone runs for
+    the whole interview like on a real call; each turn is spoken into it, then the turn detector
+    is run on the conversation.
+    """
+    def __init__(self, vad: Optional[Any], service: Optional[TurnInferenceService], seed: int, eou: Histogram):
+        self.vad = vad
+        self.service = service
+        # end-of-turn inference time, shared by the sessions of a step
+        self.eou = eou
+        self.speech_segments = 0
+        self.vad_timeouts = 0
+        self._rng = np.random.default_rng(seed)
+        self._speaking_until = 0.0
+        self._end_of_speech = asyncio.Event()
+        self._stream: Any = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self.vad is None:
+            return
+        self._stream = self.vad.stream()
+        self._tasks = [asyncio.create_task(self._pump()), asyncio.create_task(self._consume())]
+
+    async def aclose(self) -> None:
+        if self._stream is None:
+            return
+        pump, consumer = self._tasks
+        pump.cancel()
+        self._stream.end_input()
+        # let the VAD finish the audio already pushed, then close the stream
+        try:
+            await asyncio.wait_for(consumer, timeout=VAD_GRACE)
+        except asyncio.TimeoutError:
+            pass
+        await self._stream.aclose()
+
+    def _frame(self, position: float, speaking: bool) -> rtc.AudioFrame:
+        samples = SAMPLE_RATE * FRAME_MS // 1000
+        if speaking:
+            # harmonics of a slowly moving pitch with a syllable envelope, which the VAD takes for a voice
+            t = position + np.arange(samples) / SAMPLE_RATE
+            phase = 2 * np.pi * (120 * t - 15 / (2 * np.pi * 0.7) * np.cos(2 * np.pi * 0.7 * t))
+            voice = sum(np.sin(k * phase) / k for k in range(1, 25)) / 4
+            signal = 0.3 * voice * (0.5 + 0.5 * np.abs(np.sin(2 * np.pi * 3 * t))) + 0.01 * self._rng.standard_normal(samples)
+        else:
+            signal = 0.002 * self._rng.standard_normal(samples)
+        data = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+        return rtc.AudioFrame(data=data.tobytes(), sample_rate=SAMPLE_RATE, num_channels=1, samples_per_channel=samples)
+
+    async def _pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_frame = started = loop.time()
+        while True:
+            self._stream.push_frame(self._frame(next_frame - started, next_frame < self._speaking_until))
+            next_frame += FRAME_MS / 1000
+            await asyncio.sleep(max(0.0, next_frame - loop.time()))
+
+    async def _consume(self) -> None:
+        async for event in self._stream:
+            if event.type.name == "END_OF_SPEECH":
+                self.speech_segments += 1
+                self._end_of_speech.set()
+
+    async def _speak(self, seconds: float) -> None:
+        loop = asyncio.get_running_loop()
+        self._end_of_speech.clear()
+        self._speaking_until = loop.time() + seconds
+        try:
+            await asyncio.wait_for(self._end_of_speech.wait(), timeout=seconds + VAD_GRACE)
+        except asyncio.TimeoutError:
+            self.vad_timeouts += 1
+
+    async def __call__(self, session: Any, turn: Dict[str, Any]) -> float:
+        if self._stream is not None:
+            await self._speak(SECONDS_PER_WORD * max(1, len(turn["text"].split())))
+        if self.service is None:
+            return 0.0
+        # what the turn detector sees at the end of the turn: the conversation so far and the new transcript
+        messages = _turn_messages(session.history.items) + [{"role": "user", "content": turn["text"]}]
+        request = json.dumps({"chat_ctx": messages[-MAX_HISTORY_TURNS:]}).encode()
+        started = time.perf_counter()
+        await self.service.do_inference(_EUORunnerMultilingual.INFERENCE_METHOD, request)
+        elapsed = time.perf_counter() - started
+        self.eou.observe(elapsed)
+        return elapsed
+
+
+async def _sample_lag(histogram: Histogram, stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        histogram.observe(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+
+async def _session(
+    script: Dict[str, Any], args: argparse.Namespace, vad: Any, service: Optional[TurnInferenceService], index: int, eou: Histogram,
+) -> Dict[str, Any]:
+    # stagger the starts, sessions rarely begin on the same frame
+    await asyncio.sleep(index * args.stagger)
+    candidate = SyntheticCandidate(vad, service, index, eou)
+    candidate.start()
+    try:
+        report = await replay(script, args, candidate if vad is not None or service is not None else None)
+    finally:
+        await candidate.aclose()
+    report["vad_timeouts"] = candidate.vad_timeouts
+    return report
+
+
+async def run_step(
+    script: Dict[str, Any], args: argparse.Namespace, vad: Any, service: Optional[TurnInferenceService], sessions: int,
+) -> Dict[str, Any]:
+    lag = Histogram()
+    eou = Histogram()
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_lag(lag, stop))
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+
+    reports = await asyncio.gather(*(_session(script, args, vad, service, i, eou) for i in range(sessions)), return_exceptions=True)
+
+    wall = time.perf_counter() - wall_started
+    cores = (time.process_time() - cpu_started) / wall
+    stop.set()
+    await sampler
+
+    turns = Histogram()
+    failed = 0
+    vad_timeouts = 0
+    for report in reports:
+        if isinstance(report, BaseException) or not report["completed"]:
+            failed += 1
+            continue
+        vad_timeouts += report["vad_timeouts"]
+        for turn in report["turns"]:
+            if turn["latency_ms"] is not None:
+                turns.observe(turn["latency_ms"] / 1000)
+    return {
+        "sessions": sessions,
+        "failed": failed,
+        "wall_time_s": round(wall, 1),
+        "cpu_cores": round(cores, 2),
+        "cpu_load": round(cores / (os.cpu_count() or 1), 3),
+        "rss_mb": round(rss_mb(), 1),
+        "loop_lag": lag.summary(),
+        "turn_latency": turns.summary(),
+        "eou_inference": eou.summary(),
+        "vad_timeouts": vad_timeouts,
+    }
+
+
+def _within_budget(step: Dict[str, Any], args: argparse.Namespace) -> bool:
+    p95 = step["turn_latency"]["p95_ms"]
+    lag = step["loop_lag"]["p95_ms"]
+    return (
+        step["failed"] == 0
+        and (args.max_p95_ms is None or (p95 is not None and p95 <= args.max_p95_ms))
+        and (args.max_lag_ms is None or (lag is not None and lag <= args.max_lag_ms))
+    )
+
+
+async def run(script: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    vad = None
+    if not args.no_vad:
+        # the same models, loaded and warmed the same way, as a worker process after prewarm
+        model_pool.prewarm()
+        vad = model_pool.vad
+    service = None
+    if not args.no_eou:
+        if args.eou_synthetic:
+            base, per_item = (float(v) / 1000 for v in args.eou_synthetic.split(","))
+            model: Any = SyntheticTurnModel(base, per_item)
+        else:
+            model = OnnxTurnModel()
+        # one service shared by every session of the process, as with TURN_BATCHING
+        service = TurnInferenceService(model)
+        service.start()
+
+    steps: List[Dict[str, Any]] = []
+    best: Optional[Dict[str, Any]] = None
+    for sessions in args.sessions:
+        step = await run_step(script, args, vad, service, sessions)
+        steps.append(step)
+        ok = _within_budget(step, args)
+        print(
+            f"N={sessions:<4} cpu={step['cpu_cores']:.2f} cores ({step['cpu_load']:.0%}) rss={step['rss_mb']:.0f} MB "
+            f"lag p95={step['loop_lag']['p95_ms']} ms turn p95={step['turn_latency']['p95_ms']} ms "
+            f"eou p95={step['eou_inference']['p95_ms']} ms "
+            f"failed={step['failed']} {'ok' if ok else 'over budget'}",
+            flush=True,
+        )
+        if not ok:
+            break
+        best = step
+    if service is not None:
+        service.stop()
+    return {
+        "cpu_count": os.cpu_count(),
+        # without it, turn latency leaves out the end-of-turn inference of the worker
+        "includes_eou_inference": service is not None,
+        "eou_model": None if service is None else ("synthetic" if args.eou_synthetic else "onnx"),
+        "steps": steps,
+        "max_sessions": best,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure CPU, memory, loop lag and turn latency as concurrent sessions grow.")
+    add_replay_arguments(parser)
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="comma separated session counts, run in order")
+    parser.add_argument("--stagger", type=float, default=0.2, help="seconds between session starts")
+    parser.add_argument("--no-vad", action="store_true", help="skip the synthetic microphone and VAD")
+    parser.add_argument("--no-eou", action="store_true", help="skip the end-of-turn inference, turn latency then excludes it")
+    parser.add_argument("--eou-synthetic", help="BASE_MS,PER_ITEM_MS: use a synthetic turn detector model instead of the real one")
+    parser.add_argument("--max-p95-ms", type=float, default=2500, help="turn latency budget")
+    parser.add_argument("--max-lag-ms", type=float, default=50, help="loop lag budget (p95)")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    # play the agent's audio back in real time, so sessions overlap like live interviews
+    parser.set_defaults(playback_speed=1.0)
+    args = parser.parse_args()
+    args.sessions = [int(n) for n in args.sessions.split(",")]
+    setup_logging()
+
+    with open(args.script) as f:
+        script = json.load(f)
+    results = asyncio.run(run(script, args))
+
+    best = results["max_sessions"]
+    if not results["includes_eou_inference"]:
+        print("Turn latency excludes end-of-turn inference (--no-eou)")
+    if best:
+        print(f"Max sessions within budget: {best['sessions']} at {best['cpu_load']:.0%} CPU load, {best['rss_mb']:.0f} MB RSS")
+    else:
+        print("No step was within budget")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if best else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,62 +1,280 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
 
-def setup_logging(log_level=logging.DEBUG):
+LOG_DIR = os.environ.get("LOG_DIR", "logs")
+# level of the voice-agent logger, DEBUG also enables the expensive debug dumps
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# json or text, for the log file, the console always uses text
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# time (daily, at midnight) or size
+LOG_ROTATION = os.environ.get("LOG_ROTATION", "time")
+LOG_MAX_BYTES = int(float(os.environ.get("LOG_MAX_MB", "50")) * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "14"))
+# how often the rotating process checks for a rollover between its own records
+ROLLOVER_CHECK_INTERVAL = 30.0
+# Within a session, records at or below LOG_SAMPLE_LEVEL from the same call site are all
+# written up to LOG_SAMPLE_BURST, then one in LOG_SAMPLE_EVERY. INFO covers the per-turn call sites
+LOG_SAMPLE_LEVEL = logging.getLevelName(os.environ.get("LOG_SAMPLE_LEVEL", "INFO").upper())
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "10"))
+# Sampled-out records kept per session, written out when the session fails (flush_session_log)
+LOG_ERROR_BUFFER = int(os.environ.get("LOG_ERROR_BUFFER", "200"))
+# Records below LOG_LEVEL but at or above LOG_BUFFER_LEVEL are not written, only kept in that buffer
+LOG_BUFFER_LEVEL = logging.getLevelName(os.environ.get("LOG_BUFFER_LEVEL", "DEBUG").upper())
+
+# Set by the session entrypoint and inherited by every task it starts
+room_id: ContextVar[Optional[str]] = ContextVar("room_id", default=None)
+session_id: ContextVar[Optional[str]] = ContextVar("session_id", default=None)
+participant_id: ContextVar[Optional[str]] = ContextVar("participant_id", default=None)
+
+
+@dataclass
+class _SessionLogState:
+    counts: Dict[Tuple[str, int], int] = field(default_factory=dict)
+    dropped: Deque[logging.LogRecord] = field(default_factory=lambda: deque(maxlen=LOG_ERROR_BUFFER))
+
+
+_session_state: ContextVar[Optional[_SessionLogState]] = ContextVar("session_log_state", default=None)
+_SESSION_VARS = (room_id, session_id, participant_id, _session_state)
+
+TEXT_FORMAT = logging.Formatter('%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+_session_filter: Optional["SessionContextFilter"] = None
+
+
+def bind_session(room: Optional[str], session: Optional[str]) -> None:
+    """
+    Tag the log records of the current context and the tasks it starts with the room and session id,
+    and start sampling their noisy records.
+    """
+    room_id.set(room)
+    session_id.set(session)
+    participant_id.set(None)
+    _session_state.set(_SessionLogState())
+
+
+def bind_participant(identity: Optional[str]) -> None:
+    participant_id.set(identity)
+
+
+def in_session_context(callback: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Wrap an async callback so it logs with the current session's tags, for callbacks the framework
+    runs outside the session's tasks (e.g. shutdown callbacks).
+    """
+    values = [(var, var.get()) for var in _SESSION_VARS]
+
+    @wraps(callback)
+    async def run(*args, **kwargs):
+        for var, value in values:
+            var.set(value)
+        return await callback(*args, **kwargs)
+
+    return run
+
+
+def flush_session_log() -> int:
+    """
+    Write out the current session's sampled-out records, marked as replayed, so a failure still
+    comes with the detail leading up to it. Called from the session's failure paths only: an error
+    the session recovers from does not need it. Returns the number of records written.
+    """
+    state = _session_state.get()
+    if state is None or _queue_handler is None:
+        return 0
+    flushed = 0
+    while state.dropped:
+        try:
+            record = state.dropped.popleft()
+        except IndexError:
+            break
+        record.replayed = True
+        _queue_handler.emit(record)
+        flushed += 1
+    return flushed
+
+
+class SessionContextFilter(logging.Filter):
+    """
+    Attach the room, session and participant ids of the current context to each record, and
+    sample records at or below LOG_SAMPLE_LEVEL per session and call site.
+
+    Records below `level` (LOG_LEVEL) are never written: the logger lets them through only so
+    a session can keep them. They go to the per-session ring buffer with the sampled-out
+    records, written out by flush_session_log.
+    """
+    def __init__(self, level: int = logging.NOTSET):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.room_id = room_id.get()
+        record.session_id = session_id.get()
+        record.participant_id = participant_id.get()
+        state = _session_state.get()
+        if record.levelno < self.level:
+            if state is not None:
+                state.dropped.append(record)
+            return False
+        if state is None or record.levelno > LOG_SAMPLE_LEVEL:
+            return True
+        site = (record.pathname, record.lineno)
+        count = state.counts.get(site, 0) + 1
+        state.counts[site] = count
+        if count <= LOG_SAMPLE_BURST or (count - LOG_SAMPLE_BURST) % LOG_SAMPLE_EVERY == 0:
+            return True
+        state.dropped.append(record)
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+            "room_id": getattr(record, "room_id", None),
+            "session_id": getattr(record, "session_id", None),
+            "participant_id": getattr(record, "participant_id", None),
+        }
+        if getattr(record, "replayed", False):
+            entry["replayed"] = True
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback here so the record can cross threads,
+        # the formatting itself happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = TEXT_FORMAT.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(rotate: bool) -> logging.Handler:
+    path = f"{LOG_DIR}/voice-agent.log"
+    if not rotate:
+        # job processes only append, and reopen the file once the worker process has rotated it
+        return logging.handlers.WatchedFileHandler(path)
+    if LOG_ROTATION == "size":
+        return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    return logging.handlers.TimedRotatingFileHandler(path, when="midnight", backupCount=LOG_BACKUP_COUNT)
+
+
+def _watch_rollover(handler: logging.handlers.BaseRotatingHandler) -> None:
     """
-    Set up enhanced logging with file and console handlers.
-    
+    Rotate the file when due even if this process logs nothing: the job processes write most of
+    it, and a rotating handler only checks for a rollover when it emits a record.
+    """
+    record = logging.LogRecord("voice-agent", logging.INFO, __file__, 0, "", None, None)
+    while True:
+        time.sleep(ROLLOVER_CHECK_INTERVAL)
+        handler.acquire()
+        try:
+            if handler.shouldRollover(record):
+                handler.doRollover()
+        except OSError:
+            pass
+        finally:
+            handler.release()
+
+
+def setup_logging(log_level=None, rotate: bool = True):
+    """
+    Set up logging with rotating file and console handlers, written from a background thread.
+
+    Log calls only put the record on a queue, a QueueListener thread formats and writes it,
+    so the event loop never waits on disk I/O. Safe to call more than once.
+
     Args:
-        log_level: The logging level to use (default: DEBUG)
-        
+        log_level: The logging level to use (default: LOG_LEVEL from the environment, INFO)
+        rotate: Whether this process rotates the log file. Job processes share the worker
+            process's file and pass False, so only the worker process rotates it
+
     Returns:
         The configured logger
     """
-    # Create logs directory if it doesn't exist
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    
-    # Configure logger with file and console handlers
+    global _listener, _queue_handler, _session_filter
     logger = logging.getLogger("voice-agent")
-    logger.setLevel(log_level)
-    
-    # Clear any existing handlers (in case this is called multiple times)
+    level = log_level if log_level is not None else LOG_LEVEL
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    # the logger also passes the records only the session buffer keeps, the filter drops them
+    logger.setLevel(min(level, LOG_BUFFER_LEVEL) if LOG_ERROR_BUFFER > 0 else level)
+    if _session_filter is not None:
+        _session_filter.level = level
+    if _listener is not None:
+        return logger
+
+    # Create logs directory if it doesn't exist
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    # Clear any existing handlers
     if logger.handlers:
         logger.handlers.clear()
-    
-    # Configure log format with timestamp, level, and module
-    log_format = logging.Formatter('%(asctime)s - %(levelname)s - %(module)s - %(message)s')
-    
-    # Create file handler with date-based log file
-    today = datetime.now().strftime("%Y-%m-%d")
-    file_handler = logging.FileHandler(f"{log_dir}/voice-agent-{today}.log")
+
+    file_handler = _file_handler(rotate)
     file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(log_format)
-    
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TEXT_FORMAT)
+
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(log_format)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+    console_handler.setFormatter(TEXT_FORMAT)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = _QueueHandler(log_queue)
+    _session_filter = SessionContextFilter(level)
+    _queue_handler.addFilter(_session_filter)
+    logger.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush the queue on exit
+    atexit.register(_listener.stop)
+    if rotate:
+        threading.Thread(target=_watch_rollover, args=(file_handler,), name="log-rollover", daemon=True).start()
+
     # Log uncaught exceptions
     def handle_exception(exc_type, exc_value, exc_traceback):
         if issubclass(exc_type, KeyboardInterrupt):
             # Don't log keyboard interrupt
             sys.__excepthook__(exc_type, exc_value, exc_traceback)
             return
-            
+
         logger.critical("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
-    
+
     # Set the exception hook
     sys.excepthook = handle_exception
-    
+
     return logger
 
 # Example usage:
 # logger = setup_logging()
-# logger.info("Application starting") 
\ No newline at end of file
+# logger.info("Application starting")
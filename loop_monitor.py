@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from worker_metrics import BLOCKING_CALLS, LOOP_LAG
+
+logger = logging.getLogger("voice-agent")
+
+MONITOR_ENABLED = os.environ.get("LOOP_MONITOR_ENABLED", "true").lower() not in ("0", "false", "no")
+LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD_MS", "250")) / 1000
+INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+# stack frames included in a blocking report
+STACK_DEPTH = 12
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _describe(frame_summary: traceback.FrameSummary) -> str:
+    module = os.path.splitext(os.path.basename(frame_summary.filename))[0]
+    return f"{module}.{frame_summary.name} ({os.path.basename(frame_summary.filename)}:{frame_summary.lineno})"
+
+
+class LoopWatchdog:
+    """
+    Detects a blocked event loop and reports the code that is blocking it.
+
+    A heartbeat task on the loop records when it last ran and samples the loop lag. A
+    daemon thread checks the heartbeat, and when the loop has not run for longer than the
+    threshold it captures the loop thread's stack while the blocking call is still on it,
+    naming the innermost application function (e.g. recording.save_transcript) and the
+    innermost frame overall (e.g. a socket or file write).
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float = LAG_THRESHOLD, interval: float = INTERVAL):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._reported_beat: Optional[float] = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start monitoring, must be called from the loop's thread."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _heartbeat(self) -> None:
+        try:
+            while True:
+                started = self.loop.time()
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                LOOP_LAG.observe(max(0.0, self.loop.time() - started - self.interval))
+        finally:
+            # the loop is shutting down
+            self.stop()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval / 2):
+            if self.loop.is_closed():
+                self.stop()
+                return
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled > self.threshold and self._reported_beat != beat:
+                # report each stall once, while it is still happening
+                self._reported_beat = beat
+                self._report(stalled)
+
+    def _report(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)[-STACK_DEPTH:]
+        app_frames = [
+            f for f in stack
+            if f.filename.startswith(_APP_DIR) and not f.filename.endswith("loop_monitor.py")
+        ]
+        culprit = _describe(app_frames[-1]) if app_frames else "unknown"
+        try:
+            task = asyncio.current_task(self.loop)
+            task_name = task.get_name() if task else None
+        except RuntimeError:
+            task_name = None
+        self.stalls += 1
+        BLOCKING_CALLS.inc(culprit.split(" ")[0])
+        logger.warning(
+            "Event loop blocked for %.0f ms by %s in task %s, innermost frame %s\n%s",
+            stalled * 1000, culprit, task_name, _describe(stack[-1]), "".join(traceback.format_list(stack)),
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+        with _watchdogs_lock:
+            if _watchdogs.get(self.loop) is self:
+                del _watchdogs[self.loop]
+
+
+# one watchdog per loop: the thread executor runs each job on its own loop in the same process
+_watchdogs: Dict[asyncio.AbstractEventLoop, LoopWatchdog] = {}
+_watchdogs_lock = threading.Lock()
+
+
+def start_loop_monitor() -> Optional[LoopWatchdog]:
+    """
+    Start the watchdog on the running loop, once per loop; it stops when its loop shuts down.
+    Disabled with LOOP_MONITOR_ENABLED=false.
+    """
+    if not MONITOR_ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    with _watchdogs_lock:
+        watchdog = _watchdogs.get(loop)
+        if watchdog is not None:
+            return watchdog
+        watchdog = _watchdogs[loop] = LoopWatchdog(loop)
+    watchdog.start()
+    return watchdog
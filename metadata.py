@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # optional, noticeably faster on the large flow payload
+    orjson = None
+
+logger = logging.getLogger("voice-agent")
+
+INTERVIEW_CONTEXT = "interview_context"
+_ID_FIELDS = ("applicant_id", "user_id", "job_id", "application_id")
+_NAME_FIELDS = ("applicant_name", "scout_name")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON with orjson when it is installed, the standard library otherwise."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_canonical(value: Any) -> bytes:
+    """Compact JSON with sorted keys, for content hashes."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def flow_key(flow: Dict[str, Any]) -> str:
+    """
+    Cache key of a flow payload: a content hash independent of key order, prefixed with the
+    flow's id and version when the payload carries them. The id and version only label the key,
+    a flow edited without bumping its version still gets a new one.
+    """
+    digest = hashlib.sha256(dumps_canonical(flow)).hexdigest()
+    flow_id = flow.get("id")
+    version = flow.get("version", flow.get("updated_at"))
+    if isinstance(flow_id, (str, int)) and isinstance(version, (str, int)) and not isinstance(version, bool):
+        return f"{flow_id}@{version}:{digest}"
+    return digest
+
+
+class SessionMetadata:
+    """
+    The participant metadata of an interview, parsed and checked once when the candidate joins.
+
+    Parsing never raises: fields that are missing or of the wrong type fall back to their
+    defaults and are listed in `errors`, so the session can report them all up front.
+    `context` is the whole payload for an interview_context, the dict the prompts are built from.
+    `flow_key` is the flow's cache key (see flow_key), computed here once per join.
+    """
+    __slots__ = (
+        "type",
+        "applicant_id",
+        "user_id",
+        "job_id",
+        "application_id",
+        "applicant_name",
+        "scout_name",
+        "is_demo",
+        "voice_id",
+        "flow",
+        "flow_key",
+        "context",
+        "errors",
+    )
+
+    def __init__(self):
+        self.type: Optional[str] = None
+        self.applicant_id: Optional[str] = None
+        self.user_id: Optional[str] = None
+        self.job_id: Optional[str] = None
+        self.application_id: Optional[str] = None
+        self.applicant_name: Optional[str] = None
+        self.scout_name: Optional[str] = None
+        self.is_demo = False
+        self.voice_id = ""
+        self.flow: Dict[str, Any] = {}
+        self.flow_key: Optional[str] = None
+        self.context: Dict[str, Any] = {}
+        self.errors: List[str] = []
+
+    @property
+    def is_interview(self) -> bool:
+        return self.type == INTERVIEW_CONTEXT
+
+    @classmethod
+    def parse(cls, raw: Optional[Union[str, bytes]]) -> "SessionMetadata":
+        metadata = cls()
+        if not raw:
+            metadata.errors.append("metadata is empty")
+            return metadata
+        try:
+            data = loads(raw)
+        except ValueError as e:
+            metadata.errors.append(f"metadata is not valid JSON: {e}")
+            return metadata
+        if not isinstance(data, dict):
+            metadata.errors.append(f"metadata is a JSON {type(data).__name__}, not an object")
+            return metadata
+        metadata._read(data)
+        return metadata
+
+    def _read(self, data: Dict[str, Any]) -> None:
+        self.type = data.get("type")
+        for name in _ID_FIELDS:
+            setattr(self, name, self._id(data, name))
+        for name in _NAME_FIELDS:
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                self.errors.append(f"{name} should be a string, got {type(value).__name__}")
+                value = str(value)
+            setattr(self, name, value)
+
+        is_demo = data.get("is_demo", False)
+        if not isinstance(is_demo, bool):
+            self.errors.append(f"is_demo should be a boolean, got {is_demo!r}")
+        # truthiness, as before the check, so a demo flagged as "true" still skips recording
+        self.is_demo = bool(is_demo)
+
+        voice = data.get("voice")
+        if isinstance(voice, dict):
+            voice_id = voice.get("id") or ""
+            if not isinstance(voice_id, str):
+                self.errors.append(f"voice.id should be a string, got {type(voice_id).__name__}")
+                voice_id = ""
+            self.voice_id = voice_id
+        elif voice is not None:
+            self.errors.append(f"voice should be an object, got {type(voice).__name__}")
+
+        if not self.is_interview:
+            return
+        self.context = data
+        flow = data.get("flow")
+        if isinstance(flow, dict):
+            self.flow = flow
+            self.flow_key = flow_key(flow)
+        else:
+            self.errors.append("flow is missing" if flow is None else f"flow should be an object, got {type(flow).__name__}")
+
+    def _id(self, data: Dict[str, Any], name: str) -> Optional[str]:
+        value = data.get(name)
+        if value is None or isinstance(value, str):
+            return value or None
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        self.errors.append(f"{name} should be a string, got {type(value).__name__}")
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"SessionMetadata(type={self.type!r}, applicant_id={self.applicant_id!r}, user_id={self.user_id!r}, "
+            f"job_id={self.job_id!r}, is_demo={self.is_demo}, voice_id={self.voice_id!r}, errors={len(self.errors)})"
+        )
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from livekit import rtc
+# registers the turn detector's inference runner, must be imported before the worker starts
+from livekit.plugins.turn_detector.multilingual import MultilingualModel
+
+from turn_service import TURN_BATCHING, BatchedTurnDetector, turn_service
+from worker_metrics import MODEL_LOAD
+
+logger = logging.getLogger("voice-agent")
+
+VAD_WARMUP_SECONDS = 0.5
+WARMUP_CONVERSATION = [
+    {"role": "assistant", "content": "Thanks for joining this interview today. Are you ready to get started?"},
+    {"role": "user", "content": "Yes, I'm ready."},
+]
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        # peak rather than current outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_to_completion(coro) -> Any:
+    """Run a coroutine from synchronous code, on its own thread so it works under a running loop too."""
+    result: Dict[str, Any] = {}
+
+    def run():
+        result["value"] = asyncio.run(coro)
+
+    thread = threading.Thread(target=run, name="model-warmup")
+    thread.start()
+    thread.join()
+    return result.get("value")
+
+
+async def _warm_vad(vad: Any) -> None:
+    samples = vad._opts.sample_rate // 100
+    frame = rtc.AudioFrame(data=bytes(samples * 2), sample_rate=vad._opts.sample_rate, num_channels=1, samples_per_channel=samples)
+    stream = vad.stream()
+    for _ in range(int(VAD_WARMUP_SECONDS * 100)):
+        stream.push_frame(frame)
+    stream.end_input()
+    async for _ in stream:
+        pass
+
+
+def _load_vad() -> Any:
+    from livekit.plugins import silero
+    vad = silero.VAD.load()
+    _run_to_completion(_warm_vad(vad))
+    return vad
+
+
+def _load_noise_cancellation() -> Any:
+    # importing the plugin loads its native audio filter into the process, the model itself only
+    # runs on room media, so there is nothing to infer on before a participant's track arrives
+    from livekit.plugins import noise_cancellation
+    return noise_cancellation.BVC()
+
+
+def _load_turn_service() -> None:
+    turn_service.start()
+    _run_to_completion(turn_service.predict([dict(message) for message in WARMUP_CONVERSATION]))
+
+
+class ModelPool:
+    """
+    Heavy models of a job process, loaded once and shared by every session it runs.
+
+    VAD (with a warm-up pass over silence) and the noise cancellation plugin are loaded in prewarm.
+    The turn detector needs the job's inference executor, so it is created with the first session and
+    warmed with a dummy prediction in the background while the greeting plays, so the candidate's
+    first turn does not pay for a cold inference. With TURN_BATCHING the process runs the turn
+    detector itself (see turn_service.py), so it is loaded and warmed in prewarm as well.
+    """
+    def __init__(self):
+        self.vad: Optional[Any] = None
+        self.noise_cancellation: Optional[Any] = None
+        self.loads: Dict[str, Dict[str, float]] = {}
+        self._turn_detector: Optional[MultilingualModel] = None
+        self._warmup: Optional[asyncio.Task] = None
+
+    def _record(self, name: str, seconds: float, rss_delta: float) -> None:
+        self.loads[name] = {"seconds": round(seconds, 3), "rss_mb": round(rss_delta, 1)}
+        MODEL_LOAD.set(seconds, name)
+        logger.info("Loaded %s in %.0f ms (%+.1f MB RSS)", name, seconds * 1000, rss_delta)
+
+    def _timed(self, name: str, load: Callable[[], Any]) -> Any:
+        rss, started = rss_mb(), time.perf_counter()
+        handle = load()
+        self._record(name, time.perf_counter() - started, rss_mb() - rss)
+        return handle
+
+    def prewarm(self) -> None:
+        if self.vad is None:
+            self.vad = self._timed("vad", _load_vad)
+        if self.noise_cancellation is None:
+            self.noise_cancellation = self._timed("noise_cancellation", _load_noise_cancellation)
+        if TURN_BATCHING and not turn_service.running:
+            self._timed("turn_service", _load_turn_service)
+
+    def turn_detector(self) -> MultilingualModel:
+        """Return the process's turn detector, creating and warming it on the first call (inside a job)."""
+        if self._turn_detector is None and TURN_BATCHING:
+            self._turn_detector = BatchedTurnDetector(turn_service)
+        if self._turn_detector is None:
+            self._turn_detector = self._timed("turn_detector", MultilingualModel)
+            self._warmup = asyncio.create_task(self._warm_turn_detector(self._turn_detector))
+        return self._turn_detector
+
+    async def _warm_turn_detector(self, model: MultilingualModel) -> None:
+        from livekit.agents.llm import ChatContext
+
+        chat_ctx = ChatContext()
+        for message in WARMUP_CONVERSATION:
+            chat_ctx.add_message(role=message["role"], content=message["content"])
+        rss, started = rss_mb(), time.perf_counter()
+        try:
+            await model.predict_end_of_turn(chat_ctx)
+        except Exception as e:
+            logger.warning("Turn detector warm-up failed: %s", e)
+            return
+        self._record("turn_detector_warmup", time.perf_counter() - started, rss_mb() - rss)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return dict(self.loads)
+
+
+model_pool = ModelPool()
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from worker_metrics import DELIVERIES
+
+logger = logging.getLogger("voice-agent")
+
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "outbox/outbox.db")
+BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "16"))
+POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "30"))
+# how long a claimed item is hidden from other drainers
+LEASE_SECONDS = 120.0
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 3600.0
+# failed attempts after which an item is moved to the dead-letter table, about a day of backoff
+MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "30"))
+
+
+class PermanentError(Exception):
+    """A delivery failure that retrying will not fix, the item is dead-lettered right away."""
+
+
+@dataclass
+class OutboxItem:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class Outbox:
+    """
+    Durable write-ahead outbox for post-interview deliveries, backed by SQLite.
+
+    Items survive worker restarts and are claimed with a lease, so several worker
+    processes can drain the same file without delivering an item twice at once.
+    Items still failing after `max_attempts`, or failing permanently, are moved to the
+    `outbox_dead` table with their last error, for inspection and manual replay.
+    Methods block on disk I/O and are meant to be called through `asyncio.to_thread`.
+    """
+    def __init__(self, path: str = OUTBOX_PATH, max_attempts: int = MAX_ATTEMPTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_dead ("
+            " id INTEGER PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " dead_at REAL NOT NULL)"
+        )
+
+    def append(self, items: Sequence[Tuple[str, Dict[str, Any]]]) -> List[int]:
+        """Append items in a single transaction, i.e. a single fsync, and return their ids."""
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for kind, payload in items:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (kind, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                        (kind, json.dumps(payload), now, now),
+                    )
+                    ids.append(cursor.lastrowid)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def claim(self, limit: int = BATCH_SIZE) -> List[OutboxItem]:
+        """Lease up to `limit` due items to this process."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, kind, payload, attempts FROM outbox"
+                    " WHERE next_attempt_at <= ? AND lease_until <= ? ORDER BY id LIMIT ?",
+                    (now, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET lease_until = ? WHERE id = ?",
+                    [(now + LEASE_SECONDS, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [OutboxItem(id=row[0], kind=row[1], payload=json.loads(row[2]), attempts=row[3]) for row in rows]
+
+    def complete(self, ids: Sequence[int]) -> None:
+        """Remove delivered items."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def retry_later(self, failures: Sequence[Tuple[OutboxItem, str]]) -> List[OutboxItem]:
+        """
+        Release failed items with an exponential backoff before their next attempt. Items that
+        reached `max_attempts` are dead-lettered instead, and returned.
+        """
+        now = time.time()
+        retry = [(item, error) for item, error in failures if item.attempts + 1 < self.max_attempts]
+        dead = [(item, error) for item, error in failures if item.attempts + 1 >= self.max_attempts]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, lease_until = 0, last_error = ? WHERE id = ?",
+                    [
+                        (item.attempts + 1, now + min(BACKOFF_BASE ** (item.attempts + 1), BACKOFF_MAX), error, item.id)
+                        for item, error in retry
+                    ],
+                )
+                self._bury(dead, now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [item for item, _ in dead]
+
+    def dead_letter(self, failures: Sequence[Tuple[OutboxItem, str]]) -> None:
+        """Move items that failed permanently to the dead-letter table, with their error."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._bury(failures, now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _bury(self, failures: Sequence[Tuple[OutboxItem, str]], now: float) -> None:
+        # within the caller's transaction
+        for item, error in failures:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outbox_dead (id, kind, payload, attempts, last_error, created_at, dead_at)"
+                " SELECT id, kind, payload, ?, ?, created_at, ? FROM outbox WHERE id = ?",
+                (item.attempts + 1, error, now, item.id),
+            )
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (item.id,))
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[bool]]
+
+# outcome of one delivery attempt
+DELIVERED = "delivered"
+RETRY = "retry"
+DEAD = "dead"
+
+
+class OutboxWorker:
+    """
+    Drains the outbox in the background, delivering each claimed batch concurrently.
+    Items left over by a previous worker process are replayed when the worker starts.
+
+    The drain loop runs on a thread of its own with its own event loop, not on the loop of the
+    job that started it: with the thread executor, jobs of the same process each have a loop
+    that stops when the job ends. `wake` and `drain_now` can be called from any thread or loop.
+    The thread starts without the session's context, so deliveries log without session tags.
+    """
+    def __init__(self, outbox: Outbox, handlers: Dict[str, Handler], on_stop: Optional[Callable[[], Awaitable[None]]] = None):
+        self.outbox = outbox
+        self.handlers = handlers
+        # run on the worker's loop before it closes, e.g. to close the handlers' HTTP session
+        self.on_stop = on_stop
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the drain loop on its own thread, if it is not running already."""
+        with self._lock:
+            if self.running:
+                return
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._serve, args=(ready,), name="outbox-worker", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def _serve(self, ready: threading.Event) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+        ready.set()
+        try:
+            loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop = None
+            if self.on_stop is not None:
+                try:
+                    loop.run_until_complete(self.on_stop())
+                except Exception as e:
+                    logger.warning("Outbox worker cleanup failed: %s", e)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def wake(self) -> None:
+        """Drain now instead of at the next poll, from any thread."""
+        loop, wake = self._loop, self._wake
+        if loop is None or wake is None:
+            return
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            # the worker stopped in the meantime
+            pass
+
+    async def drain_now(self) -> int:
+        """Drain on the worker's loop and wait for it, from any event loop. Drains in place if the worker is not running."""
+        loop = self._loop
+        if loop is None:
+            return await self.drain()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.drain(), loop))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Outbox drain failed: %s", e, exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def drain(self) -> int:
+        """Deliver every item that is currently due and return how many were completed (delivered or dead-lettered)."""
+        delivered = 0
+        while True:
+            batch = await asyncio.to_thread(self.outbox.claim)
+            if not batch:
+                return delivered
+            results = await asyncio.gather(*(self._deliver(item) for item in batch))
+            done = [item.id for item, (outcome, _) in zip(batch, results) if outcome == DELIVERED]
+            dead = [(item, error) for item, (outcome, error) in zip(batch, results) if outcome == DEAD]
+            failed = [(item, error) for item, (outcome, error) in zip(batch, results) if outcome == RETRY]
+            if done:
+                await asyncio.to_thread(self.outbox.complete, done)
+            if dead:
+                await asyncio.to_thread(self.outbox.dead_letter, dead)
+            if failed:
+                for item in await asyncio.to_thread(self.outbox.retry_later, failed):
+                    DELIVERIES.inc(item.kind, "dropped")
+                    logger.error(
+                        "Outbox item %s (%s) failed %d times, moved to the dead-letter table",
+                        item.id, item.kind, item.attempts + 1,
+                    )
+            delivered += len(done) + len(dead)
+            if len(batch) < BATCH_SIZE:
+                return delivered
+
+    async def _deliver(self, item: OutboxItem) -> Tuple[str, str]:
+        handler = self.handlers.get(item.kind)
+        if handler is None:
+            DELIVERIES.inc(item.kind, "dropped")
+            logger.error("No outbox handler for item kind %s, moving item %s to the dead-letter table", item.kind, item.id)
+            return DEAD, f"no handler for {item.kind}"
+        try:
+            if await handler(item.payload):
+                DELIVERIES.inc(item.kind, "success")
+                return DELIVERED, ""
+            error = "delivery failed"
+        except PermanentError as e:
+            DELIVERIES.inc(item.kind, "dropped")
+            logger.error("Outbox item %s (%s) failed permanently, moved to the dead-letter table: %s", item.id, item.kind, e)
+            return DEAD, str(e)
+        except Exception as e:
+            error = str(e)
+        DELIVERIES.inc(item.kind, "retry")
+        logger.warning("Outbox item %s (%s) attempt %s failed: %s", item.id, item.kind, item.attempts + 1, error)
+        return RETRY, error
+
+    def stop(self) -> None:
+        """Stop the drain loop and wait for its thread to end. Blocks, see aclose."""
+        with self._lock:
+            thread, loop, task = self._thread, self._loop, self._task
+            if thread is None:
+                return
+            if loop is not None and task is not None:
+                try:
+                    loop.call_soon_threadsafe(task.cancel)
+                except RuntimeError:
+                    pass
+            thread.join()
+            self._thread = self._task = self._wake = None
+
+    async def aclose(self) -> None:
+        await asyncio.to_thread(self.stop)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from clients import client_pool
+from context import UserData
+from metadata import SessionMetadata
+from outbox import Outbox, OutboxWorker, PermanentError
+from recording import upload_object
+from transcript import TranscriptWriter, recover_orphaned_spools
+
+logger = logging.getLogger("voice-agent")
+
+# must stay below the framework's shutdown budget for the job process
+SHUTDOWN_DEADLINE = float(os.environ.get("SHUTDOWN_DEADLINE", "20"))
+WEBHOOK_TIMEOUT = float(os.environ.get("ANALYSIS_BOT_TIMEOUT", "10"))
+# client errors retried by the outbox: request timeout, too many requests
+RETRYABLE_STATUSES = (408, 429)
+
+
+async def deliver_s3_object(payload: Dict[str, Any]) -> bool:
+    """Upload an object with the blocking boto3 call offloaded to a worker thread."""
+    return await asyncio.to_thread(
+        upload_object, payload["key"], payload["body"], payload.get("content_type", "application/json")
+    )
+
+
+async def deliver_webhook(payload: Dict[str, Any]) -> bool:
+    """Notify the analysis bot over the worker's shared aiohttp session."""
+    async with client_pool.http().post(
+        payload["endpoint"],
+        json=payload["json"],
+        headers={"Content-Type": "application/json"},
+        timeout=aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT),
+    ) as response:
+        # any 2xx: 201/202/204 are deliveries too, retrying them would notify the bot twice
+        if 200 <= response.status < 300:
+            logger.info("Analysis bot notification successful (%s)", response.status)
+            return True
+        text = await response.text()
+        # timeouts and rate limiting are worth retrying like 5xx, other client errors are not
+        if 400 <= response.status < 500 and response.status not in RETRYABLE_STATUSES:
+            raise PermanentError(f"Analysis bot notification rejected: {response.status} - {text}")
+        logger.warning("Analysis bot notification failed: %s - %s", response.status, text)
+        return False
+
+
+_worker: Optional[OutboxWorker] = None
+
+
+def get_outbox_worker() -> OutboxWorker:
+    """Return the process-wide outbox worker, opening the outbox on first use."""
+    global _worker
+    if _worker is None:
+        _worker = OutboxWorker(
+            Outbox(),
+            handlers={"s3_object": deliver_s3_object, "webhook": deliver_webhook},
+            on_stop=client_pool.close_http,
+        )
+    return _worker
+
+
+_enqueue_tasks: Set[asyncio.Task] = set()
+
+
+def enqueue_in_background(entries: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """Append entries to the outbox off the event loop and wake the worker to deliver them."""
+    worker = get_outbox_worker()
+
+    async def _enqueue():
+        try:
+            await asyncio.to_thread(worker.outbox.append, entries)
+            worker.wake()
+        except Exception as e:
+            logger.error("Failed to write %s items to the outbox: %s", len(entries), e, exc_info=True)
+
+    task = asyncio.create_task(_enqueue())
+    _enqueue_tasks.add(task)
+    task.add_done_callback(_enqueue_tasks.discard)
+
+
+def recover_transcripts() -> None:
+    """
+    Write the transcripts of interviews whose job crashed before its post-interview delivery
+    to the outbox. Called when a job process is prewarmed, blocks on file I/O.
+    """
+    try:
+        recovered = recover_orphaned_spools(get_outbox_worker().outbox.append)
+    except Exception as e:
+        logger.error("Failed to recover orphaned transcript spools: %s", e, exc_info=True)
+        return
+    if recovered:
+        logger.info("Recovered %s orphaned transcript spools into the outbox", recovered)
+
+
+# sessions of this process using the outbox worker, the last one to finish stops it. Sessions
+# of the thread executor start and stop from their own threads, hence the lock
+_worker_users = 0
+_worker_users_lock = threading.Lock()
+
+
+def start_outbox_worker() -> None:
+    """Start draining the outbox, replaying anything a previous worker process left behind."""
+    global _worker_users
+    with _worker_users_lock:
+        _worker_users += 1
+    try:
+        get_outbox_worker().start()
+    except Exception as e:
+        logger.error("Failed to start outbox worker: %s", e, exc_info=True)
+
+
+async def stop_outbox_worker() -> None:
+    """Stop the background drain once no session of this process needs it any more."""
+    global _worker_users
+    with _worker_users_lock:
+        _worker_users = max(0, _worker_users - 1)
+        last = _worker_users == 0
+    # a session starting meanwhile waits in OutboxWorker.start for the stop, then restarts it
+    if last and _worker is not None:
+        await _worker.aclose()
+
+
+async def run_post_interview(
+    userdata: UserData,
+    transcript: TranscriptWriter,
+    room_name: str,
+    metadata: SessionMetadata,
+    deadline: float = SHUTDOWN_DEADLINE,
+) -> int:
+    """
+    Write the rest of the transcript, its manifest and the analysis notification to the outbox,
+    then try to deliver them right away within `deadline`. Anything not delivered stays in the
+    outbox and is retried by the background worker, also after a restart.
+
+    Returns the number of items written to the outbox.
+    """
+    items = []
+
+    async def _run():
+        egress_id = await userdata.recording.result() if userdata.recording else None
+        user_id = metadata.user_id
+        job_id = metadata.job_id
+        analysis_endpoint = os.environ.get("ANALYSIS_BOT_ENDPOINT")
+        # Skip notification if recording wasn't successful
+        if not egress_id:
+            logger.warning("No recording egress ID available - skipping analysis notification")
+        elif metadata.is_demo:
+            logger.info("Demo interview - skipping analysis notification")
+        elif not user_id or not job_id:
+            logger.warning("Missing user_id or job_id - skipping analysis notification")
+        elif not analysis_endpoint:
+            logger.error("Missing ANALYSIS_BOT_ENDPOINT environment variable")
+        else:
+            items.append(("webhook", {
+                "endpoint": analysis_endpoint,
+                "json": {
+                    "recording_id": egress_id,
+                    "user_id": user_id,
+                    "job_id": job_id,
+                    "application_id": metadata.application_id,
+                },
+            }))
+
+        worker = get_outbox_worker()
+
+        def _enqueue():
+            # the notification does not depend on the transcript, so it is written on its own first
+            if items:
+                worker.outbox.append(items)
+            logger.info("Saving %s transcript segments", len(transcript))
+            try:
+                entries = transcript.finish()
+            except Exception as e:
+                # the spool is kept, and recovered into the outbox by a later prewarm
+                logger.error("Failed to finish the transcript of room %s: %s", room_name, e, exc_info=True)
+                return
+            if entries:
+                worker.outbox.append(entries)
+                items.extend(entries)
+            transcript.discard_spool()
+
+        # the only blocking cost of shutdown: one local fsync, off the event loop
+        await asyncio.to_thread(_enqueue)
+        if items:
+            delivered = await worker.drain_now()
+            logger.info("Completed %s outbox items after room %s", delivered, room_name)
+
+    try:
+        await asyncio.wait_for(_run(), timeout=deadline)
+    except asyncio.TimeoutError:
+        logger.warning("Post-interview delivery for room %s did not finish within %ss, left in the outbox", room_name, deadline)
+    except Exception as e:
+        logger.error("Error in post-interview pipeline for room %s: %s", room_name, e, exc_info=True)
+    return len(items)
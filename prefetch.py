@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Dict, List, Optional
+
+from flow import Node
+from summarizer import CompletionLLM, format_transcript
+
+logger = logging.getLogger("voice-agent")
+
+DRAFT_PROMPT = (
+    "{persona}\n\n"
+    "You are about to ask the candidate the next interview question. {instructions}\n"
+    "Write exactly what you will say, in one to three short spoken sentences. "
+    "Do not comment on or evaluate the candidate's previous answer.\n\n"
+    "Conversation so far:\n{transcript}"
+)
+
+
+def prefetch_enabled() -> bool:
+    return os.environ.get("SPECULATIVE_PREFETCH", "false").lower() in ("1", "true", "yes")
+
+
+def presynthesis_enabled() -> bool:
+    return os.environ.get("SPECULATIVE_PRESYNTH", "false").lower() in ("1", "true", "yes")
+
+
+@dataclass
+class Draft:
+    """Speculatively drafted opening of a question, with optional pre-synthesised first sentence."""
+    node_id: str
+    text: str
+    created_at: float
+    frames: List[Any] = field(default_factory=list)
+    rest: str = ""
+
+
+def split_first_sentence(text: str) -> List[str]:
+    """Split text into its first sentence and the remainder."""
+    for i, char in enumerate(text):
+        if char in ".?!" and (i + 1 == len(text) or text[i + 1] == " "):
+            return [text[: i + 1], text[i + 1 :].strip()]
+    return [text, ""]
+
+
+class QuestionPrefetcher:
+    """
+    Speculatively drafts the next question's phrasing while the candidate is still answering.
+
+    Only linear edges are prefetched, where the next node is already known from the flow plan.
+    The draft is thrown away on a follow-up or early termination, and when the next agent
+    takes it, it is spoken with `session.say` instead of a cold `generate_reply`.
+    Inter-question latency (handoff to agent speaking) is recorded for hits and misses.
+    """
+    def __init__(self, backend: CompletionLLM, tts: Any = None, timeout: float = 10.0):
+        self.backend = backend
+        # only set when pre-synthesis of the first sentence is enabled
+        self.tts = tts
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+        self._node_id: Optional[str] = None
+        self._handoff: Optional[tuple] = None
+        self.stats: Dict[str, int] = {"drafted": 0, "used": 0, "discarded": 0, "failed": 0}
+        self.latencies: Dict[str, List[float]] = {"hit": [], "miss": []}
+
+    def start(self, node: Node, persona: str, instructions: str, items: List[Any]) -> None:
+        """Start drafting the opening for `node`, replacing any earlier draft."""
+        self.discard()
+        prompt = DRAFT_PROMPT.format(
+            persona=persona, instructions=instructions, transcript=format_transcript(items)
+        )
+        self._node_id = node.id
+        self._task = asyncio.create_task(self._draft(node.id, prompt))
+
+    async def _draft(self, node_id: str, prompt: str) -> Optional[Draft]:
+        started = time.perf_counter()
+        try:
+            text = await asyncio.wait_for(self.backend.complete(prompt), timeout=self.timeout)
+            if not text:
+                return None
+            draft = Draft(node_id=node_id, text=text, created_at=time.perf_counter())
+            if self.tts is not None:
+                first, draft.rest = split_first_sentence(text)
+                async with self.tts.synthesize(first) as stream:
+                    async for audio in stream:
+                        draft.frames.append(audio.frame)
+            self.stats["drafted"] += 1
+            logger.debug("Drafted opening for node %s in %.0f ms", node_id, (time.perf_counter() - started) * 1000)
+            return draft
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning("Failed to draft opening for node %s: %s", node_id, e)
+            return None
+
+    def discard(self) -> None:
+        """Throw away the pending draft, e.g. after a follow-up question."""
+        if self._task is not None:
+            self._task.cancel()
+            self.stats["discarded"] += 1
+        self._task = None
+        self._node_id = None
+
+    def take(self, node_id: str) -> Optional[Draft]:
+        """
+        Return the finished draft for `node_id`, or None if there is none ready.
+        A draft that is still being generated is dropped rather than awaited.
+        """
+        task, self._task = self._task, None
+        matches = task is not None and self._node_id == node_id
+        self._node_id = None
+        if task is None:
+            return None
+        if not matches or not task.done() or task.cancelled() or task.exception() is not None:
+            task.cancel()
+            self.stats["discarded"] += 1
+            return None
+        draft = task.result()
+        if draft is not None:
+            self.stats["used"] += 1
+        return draft
+
+    async def audio(self, draft: Draft) -> AsyncIterable[Any]:
+        """Yield the pre-synthesised first sentence, then synthesise the rest live."""
+        for frame in draft.frames:
+            yield frame
+        if draft.rest:
+            async with self.tts.synthesize(draft.rest) as stream:
+                async for audio in stream:
+                    yield audio.frame
+
+    def mark_handoff(self, hit: bool) -> None:
+        """Start timing a question handoff, stopped when the agent starts speaking."""
+        self._handoff = (time.perf_counter(), "hit" if hit else "miss")
+
+    def on_agent_state_changed(self, event: Any) -> None:
+        if self._handoff is None or event.new_state != "speaking":
+            return
+        started, label = self._handoff
+        self._handoff = None
+        self.latencies[label].append(time.perf_counter() - started)
+
+    def report(self) -> Dict[str, Any]:
+        """Return draft counters and the median handoff-to-speech latency for hits and misses."""
+        report: Dict[str, Any] = dict(self.stats)
+        for label, values in self.latencies.items():
+            report[f"{label}_count"] = len(values)
+            report[f"{label}_median_ms"] = round(statistics.median(values) * 1000) if values else None
+        return report
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        logger.info("Speculative prefetch report: %s", self.report())
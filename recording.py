@@ -1,15 +1,18 @@
+import asyncio
 import logging
 import os
 import json
+import time
 from datetime import datetime
+from typing import Optional
 from livekit import api
-from dotenv import load_dotenv
-import boto3
-
-logger = logging.getLogger("voice-agent")
 
+from clients import client_pool
+from metadata import SessionMetadata
+from outbox import PermanentError
+from worker_metrics import EGRESS_SETUP
 
-load_dotenv(dotenv_path=".env")
+logger = logging.getLogger("voice-agent")
 
 
 # Custom JSON encoder to handle non-serializable objects
@@ -21,14 +24,16 @@ class CustomJSONEncoder(json.JSONEncoder):
             return str(obj)
 
 
-async def setup_recording(room_name, participant=None):
+async def setup_recording(room_name, metadata: Optional[SessionMetadata] = None, attempts=3, backoff=1.0):
     """
     Set up recording for a LiveKit room and store it in Supabase storage bucket
     with an organized directory structure: user_id/job_id/recording_file.
     
     Args:
         room_name: The name of the LiveKit room to record
-        participant: The participant object containing metadata with applicant_id and job_id
+        metadata: The participant's parsed metadata, with applicant_id and job_id
+        attempts: How many times to try starting the egress
+        backoff: Delay in seconds before the first retry, doubled after every failed attempt
         
     Returns:
         Tuple containing (egress_id, user_id, job_id) if successful, (None, None, None) otherwise
@@ -37,15 +42,9 @@ async def setup_recording(room_name, participant=None):
     try:
 
          # check if is demo and skip if true 
-        if participant and participant.metadata:
-            try:
-                metadata = json.loads(participant.metadata)
-                is_demo = metadata.get("is_demo", False)
-                if is_demo:
-                    logger.info(f"Demo interview detected for room {room_name} - skipping recording")
-                    return None, None, None
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse participant metadata as JSON")
+        if metadata and metadata.is_demo:
+            logger.info("Demo interview detected for room %s - skipping recording", room_name)
+            return None, None, None
 
         # Default file path (in case we can't extract user_id/job_id)
         filepath = f"recordings/interview_{room_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
@@ -54,22 +53,18 @@ async def setup_recording(room_name, participant=None):
         user_id = None
         job_id = None
         
-        if participant and participant.metadata:
-            try:
-                metadata = json.loads(participant.metadata)
-                user_id = metadata.get("applicant_id")
-                job_id = metadata.get("job_id")
-                
-                if user_id and job_id:
-                    logger.info(f"Using organized directory structure: {user_id}/{job_id}/")
-                    # Create the organized filepath
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"interview_recording.mp4"
-                    filepath = f"{user_id}/{job_id}/{filename}"
-                else:
-                    logger.warning("applicant_id or job_id not found in participant metadata, using default path")
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse participant metadata as JSON, using default path")
+        if metadata:
+            user_id = metadata.applicant_id
+            job_id = metadata.job_id
+            
+            if user_id and job_id:
+                logger.info("Using organized directory structure: %s/%s/", user_id, job_id)
+                # Create the organized filepath
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"interview_recording.mp4"
+                filepath = f"{user_id}/{job_id}/{filename}"
+            else:
+                logger.warning("applicant_id or job_id not found in participant metadata, using default path")
         else:
             logger.info("No participant metadata available, using default path")
         
@@ -79,9 +74,7 @@ async def setup_recording(room_name, participant=None):
         access_key = os.environ.get("AWS_ACCESS_KEY")
         secret_key = os.environ.get("AWS_SECRET_KEY")
 
-        logger.info(f"BucketName: {bucket_name}")
-        logger.info(f"AccessKey: {access_key}")
-        logger.info(f"SecretKey: {secret_key}")
+        logger.info("BucketName: %s", bucket_name)
         # Create the recording request
         req = api.RoomCompositeEgressRequest(
             room_name=room_name,
@@ -100,22 +93,155 @@ async def setup_recording(room_name, participant=None):
             )],
         )
 
-        # Initialize the LiveKit API client
-        lkapi = api.LiveKitAPI()
-        # Start the recording
-        res = await lkapi.egress.start_room_composite_egress(req)
-        # Close the API client
-        await lkapi.aclose()
+        for attempt in range(1, attempts + 1):
+            try:
+                # Start the recording with the worker's shared LiveKit API client
+                with client_pool.lease("livekit") as lkapi:
+                    try:
+                        res = await lkapi.egress.start_room_composite_egress(req)
+                    except Exception:
+                        # closed once the other sessions' calls on it have finished
+                        client_pool.invalidate("livekit", lkapi)
+                        raise
+                break
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                delay = backoff * 2 ** (attempt - 1)
+                logger.warning("Recording attempt %s/%s failed for room %s: %s, retrying in %ss", attempt, attempts, room_name, e, delay)
+                await asyncio.sleep(delay)
         
         egress_id = res.egress_id
-        logger.info(f"Recording started successfully for room {room_name}, egress ID: {egress_id}, path: {filepath}")
+        logger.info("Recording started successfully for room %s, egress ID: %s, path: %s", room_name, egress_id, filepath)
         return egress_id, user_id, job_id
         
     except Exception as e:
-        logger.error(f"Failed to set up recording for room {room_name}: {str(e)}", exc_info=True)
+        logger.error("Failed to set up recording for room %s: %s", room_name, e, exc_info=True)
         return None, None, None
 
 
+class RecordingTask:
+    """
+    Runs `setup_recording` as a supervised background task, so egress setup does not delay the greeting.
+    The outcome is posted on the task object, which is kept on `UserData.recording`.
+    """
+    def __init__(self, room_name, metadata: Optional[SessionMetadata] = None, attempts=3, backoff=1.0):
+        self.room_name = room_name
+        self.metadata = metadata
+        self.attempts = attempts
+        self.backoff = backoff
+        self.egress_id: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.setup_time: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> "RecordingTask":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            self.egress_id, _, _ = await setup_recording(
+                self.room_name, self.metadata, attempts=self.attempts, backoff=self.backoff
+            )
+        except Exception as e:
+            # setup_recording logs its own failures, this only guards against unexpected errors
+            self.error = e
+            logger.error("Recording task failed for room %s: %s", self.room_name, e, exc_info=True)
+        self.setup_time = time.perf_counter() - started
+        EGRESS_SETUP.observe(self.setup_time, "success" if self.egress_id else "failure")
+        if self.egress_id:
+            logger.info("Recording set up with egress ID: %s in %.2fs", self.egress_id, self.setup_time)
+        return self.egress_id
+
+    async def result(self, timeout: float = 10.0) -> Optional[str]:
+        """
+        Wait for the egress setup to finish and return its egress id, or None if recording failed.
+        On a timeout the setup keeps running: cancelling it could abandon an egress that is
+        already starting, and the task still logs its egress id once it has one.
+        """
+        if self._task is None:
+            return None
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Recording setup for room %s did not finish within %ss, still waiting for it in the background", self.room_name, timeout)
+        if not self.egress_id:
+            logger.warning("No recording available for room %s", self.room_name)
+        return self.egress_id
+
+
+def transcript_key(room_name, user_id=None, job_id=None):
+    """
+    Return the S3 key of an interview's transcript, next to its recording when the ids are known.
+    """
+    if user_id and job_id:
+        return f"{user_id}/{job_id}/interview_transcript.json"
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"recordings/{user_id}/{job_id}/transcript_{timestamp}.json"
+
+
+def build_transcript(conversation_transcripts, room_name):
+    """
+    Serialise transcript segments into the JSON document stored in S3.
+    
+    Args:
+        conversation_transcripts: List of transcript segments with speaker and text
+        room_name: The name of the LiveKit room
+        
+    Returns:
+        The JSON document as a string
+    """
+    # Format the transcript data
+    transcript_data = {
+        "room_name": room_name,
+        "timestamp": datetime.now().isoformat(),
+        "conversation": []
+    }
+    
+    # Build the conversation as a simple array with speaker names
+    for segment in conversation_transcripts:
+        speaker = segment["speaker"]
+        text = segment["text"]
+        entry = {speaker: text}
+        transcript_data["conversation"].append(entry)
+    return json.dumps(transcript_data, indent=2, cls=CustomJSONEncoder)
+
+
+def upload_object(key, body, content_type="application/json"):
+    """
+    Upload an object to the recordings bucket with the worker's shared boto3 client.
+    
+    Returns:
+        Boolean indicating success or failure
+
+    Raises:
+        PermanentError: if the S3 settings are missing, retrying will not help
+    """
+    # Get S3 credentials
+    bucket_name = os.environ.get("AWS_BUCKET_NAME")
+    access_key = os.environ.get("AWS_ACCESS_KEY")
+    secret_key = os.environ.get("AWS_SECRET_KEY")
+    
+    if not all([bucket_name, access_key, secret_key]):
+        raise PermanentError("Missing S3 credentials for transcript upload")
+    
+    try:
+        with client_pool.lease("s3") as s3:
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=body,
+                ContentType=content_type
+            )
+        logger.info("Uploaded %s", key)
+        return True
+    except Exception as s3_error:
+        logger.error("S3 upload error: %s", s3_error, exc_info=True)
+        return False
+
+
 def save_transcript(conversation_transcripts, room_name, user_id=None, job_id=None):
     """
     Save conversation transcripts to the same S3 bucket as the recording.
@@ -130,64 +256,18 @@ def save_transcript(conversation_transcripts, room_name, user_id=None, job_id=No
         Boolean indicating success or failure
     """
     try:
-        logger.info(f"Saving transcript for room {room_name}")
+        logger.info("Saving transcript for room %s", room_name)
         
         # Skip if no transcripts
         if not conversation_transcripts:
             logger.warning("No transcript data to save")
             return False
-            
-        # Determine filepath
-        if user_id and job_id:
-            transcript_filepath = f"{user_id}/{job_id}/interview_transcript.json"
-        else:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            transcript_filepath = f"recordings/{user_id}/{job_id}/transcript_{timestamp}.json"
-        
-        # Format the transcript data
-        transcript_data = {
-            "room_name": room_name,
-            "timestamp": datetime.now().isoformat(),
-            "conversation": []
-        }
         
-        # Build the conversation as a simple array with speaker names
-        for segment in conversation_transcripts:
-            speaker = segment["speaker"]
-            text = segment["text"]
-            entry = {speaker: text}
-            transcript_data["conversation"].append(entry)
-        
-        # Get S3 credentials
-        bucket_name = os.environ.get("AWS_BUCKET_NAME")
-        access_key = os.environ.get("AWS_ACCESS_KEY")
-        secret_key = os.environ.get("AWS_SECRET_KEY")
-        
-        if not all([bucket_name, access_key, secret_key]):
-            logger.error("Missing S3 credentials for transcript upload")
-            return False
-        
-        # Upload transcript to S3 using boto3
-        try:
-            s3_client = boto3.client('s3',
-                region_name="us-east-2",
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key
-            )
-            
-            s3_client.put_object(
-                Bucket=bucket_name,
-                Key=transcript_filepath,
-                Body=json.dumps(transcript_data, indent=2, cls=CustomJSONEncoder),
-                ContentType='application/json'
-            )
-            
-            logger.info(f"Uploaded transcript to {transcript_filepath}")
-            return True
-        except Exception as s3_error:
-            logger.error(f"S3 upload error: {str(s3_error)}", exc_info=True)
-            return False
+        return upload_object(
+            transcript_key(room_name, user_id, job_id),
+            build_transcript(conversation_transcripts, room_name),
+        )
             
     except Exception as e:
-        logger.error(f"Failed to save transcript for room {room_name}: {str(e)}", exc_info=True)
-        return False
\ No newline at end of file
+        logger.error("Failed to save transcript for room %s: %s", room_name, e, exc_info=True)
+        return False
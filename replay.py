@@ -0,0 +1,436 @@
+"""
+Offline replay of a scripted interview through the real agents.
+
+Drives an AgentSession with GreeterAgent, FlowQuestionAgent, FlowBranchingAgent and
+EndInterviewAgent, using deterministic local stand-ins for the LLM, TTS and audio output,
+and reports handoffs, LLM calls per node, context growth and per-turn latency. Nothing
+leaves the machine, so changes to the agents, handoffs and prompts can be benchmarked in CI:
+
+    python replay.py assets/replay/sample_interview.json --output replay-report.json
+
+Candidate turns are submitted as text, which skips STT and the turn detector; their latency is
+simulated with --stt-latency and --eou-delay, waited before each turn and added to its latency.
+A `candidate` callback (see loadtest.py) can speak each turn and run the turn detector on it
+first; the inference time it returns is added to the turn's latency as well.
+Without --eou-delay, the minimum endpointing delay picked for the current agent is used (see
+endpointing.py), and the decisions are part of the report.
+
+A script is a JSON object with:
+- context: the participant metadata of an interview_context, including the flow
+- turns: candidate turns, {"text": ..., "tool": ..., "arguments": {...}, "pauses": [...]}. `tool` is
+  the tool the LLM calls in reply, by default confirm_ready or transition, whichever the agent has.
+  `pauses` are the candidate's silences within the turn in seconds, fed to the endpointing policy;
+  one longer than the current maximum delay counts as a cutoff
+- branches: the option the LLM picks at each branching node, by node id (default: the first)
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from livekit import rtc
+from livekit.agents import APIConnectOptions, llm, tts, utils
+from livekit.agents.llm.tool_context import is_function_tool
+from livekit.agents.llm.utils import build_legacy_openai_schema
+from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS, NOT_GIVEN, NotGivenOr
+from livekit.agents.voice import io
+
+from agents import GreeterAgent
+from config import build_agent_session
+from context import UserData
+from flow_cache import get_compiled_flow
+from history import estimate_tokens
+from latency import LatencyStats
+from logger_config import setup_logging
+
+# tools the stub LLM calls after a candidate turn when the script does not name one
+DEFAULT_TOOLS = ("confirm_ready", "transition")
+SAMPLE_RATE = 24000
+
+
+class ScriptPolicy:
+    """
+    Decides what the stub LLM replies: a forced tool call, the scripted tool for a new
+    candidate turn, or text. Records every call for the report.
+    """
+    def __init__(self, script: Dict[str, Any], userdata: UserData, reply_words: int):
+        self.turns: List[Dict[str, Any]] = script.get("turns", [])
+        self.branches: Dict[str, str] = script.get("branches", {})
+        self.userdata = userdata
+        self.reply_words = reply_words
+        self.turn: Dict[str, Any] = {}
+        self.session: Any = None
+        self.calls: List[Dict[str, Any]] = []
+        self._answered = set()
+
+    def respond(self, chat_ctx: llm.ChatContext, tools: List[Any], tool_choice: Any) -> Tuple[str, Optional[Tuple[str, Dict[str, Any]]]]:
+        schemas = {
+            schema["function"]["name"]: schema["function"]
+            for schema in (build_legacy_openai_schema(tool) for tool in tools if is_function_tool(tool))
+        }
+        reply: Optional[Tuple[str, Dict[str, Any]]] = None
+        if isinstance(tool_choice, dict):
+            name = tool_choice["function"]["name"]
+            reply = (name, self._arguments(name, schemas.get(name)))
+        elif tool_choice != "none" and schemas:
+            # tool items of the previous reply can be recorded after the candidate's next message
+            last = next((item for item in reversed(chat_ctx.items) if item.type == "message" and item.role == "user"), None)
+            if last is not None and last.id not in self._answered:
+                self._answered.add(last.id)
+                name = self.turn.get("tool") or next((name for name in DEFAULT_TOOLS if name in schemas), None)
+                if name in schemas:
+                    reply = (name, self._arguments(name, schemas[name]))
+
+        node = self.userdata.current_node
+        self.calls.append({
+            "node": node.id if node else None,
+            "agent": type(self.session.current_agent).__name__ if self.session else None,
+            # the summariser and prefetcher call the LLM without tools
+            "kind": ("tool:" + reply[0]) if reply else ("text" if schemas or tool_choice is not NOT_GIVEN else "background"),
+            "items": len(chat_ctx.items),
+            "tokens": sum(estimate_tokens(item) for item in chat_ctx.items),
+        })
+        if reply:
+            return "", reply
+        return " ".join(["This is a scripted reply from the replay harness."] * max(1, self.reply_words // 9)), None
+
+    def _arguments(self, name: str, schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if name == self.turn.get("tool") and "arguments" in self.turn:
+            return self.turn["arguments"]
+        arguments: Dict[str, Any] = {}
+        properties = (schema or {}).get("parameters", {}).get("properties", {})
+        for param, spec in properties.items():
+            if "enum" in spec:
+                node = self.userdata.current_node
+                choice = self.branches.get(node.id) if node else None
+                arguments[param] = choice if choice in spec["enum"] else spec["enum"][0]
+            else:
+                arguments[param] = "replay"
+        return arguments
+
+
+class StubLLM(llm.LLM):
+    """LLM stand-in that answers after a fixed latency, as decided by a ScriptPolicy."""
+    def __init__(self, policy: ScriptPolicy, latency: float):
+        super().__init__()
+        self.policy = policy
+        self.latency = latency
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        tools: Optional[List[Any]] = None,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+        parallel_tool_calls: NotGivenOr[bool] = NOT_GIVEN,
+        tool_choice: NotGivenOr[Any] = NOT_GIVEN,
+        extra_kwargs: NotGivenOr[Dict[str, Any]] = NOT_GIVEN,
+    ) -> "StubLLMStream":
+        return StubLLMStream(self, chat_ctx=chat_ctx, tools=tools or [], conn_options=conn_options, tool_choice=tool_choice)
+
+
+class StubLLMStream(llm.LLMStream):
+    def __init__(self, llm_: StubLLM, *, chat_ctx: llm.ChatContext, tools: List[Any], conn_options: APIConnectOptions, tool_choice: Any):
+        super().__init__(llm_, chat_ctx=chat_ctx, tools=tools, conn_options=conn_options)
+        self._tool_choice = tool_choice
+
+    async def _run(self) -> None:
+        stub: StubLLM = self._llm
+        await asyncio.sleep(stub.latency)
+        request_id = utils.shortuuid()
+        text, call = stub.policy.respond(self._chat_ctx, self._tools, self._tool_choice)
+        if call:
+            name, arguments = call
+            delta = llm.ChoiceDelta(
+                role="assistant",
+                tool_calls=[llm.FunctionToolCall(name=name, arguments=json.dumps(arguments), call_id=f"call_{request_id}")],
+            )
+            self._event_ch.send_nowait(llm.ChatChunk(id=request_id, delta=delta))
+            return
+        for sentence in text.split(". "):
+            self._event_ch.send_nowait(llm.ChatChunk(id=request_id, delta=llm.ChoiceDelta(role="assistant", content=sentence + ". ")))
+
+
+class StubTTS(tts.TTS):
+    """TTS stand-in producing silence, the first frame after a fixed latency."""
+    def __init__(self, latency: float, seconds_per_word: float = 0.3):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=SAMPLE_RATE, num_channels=1)
+        self.latency = latency
+        self.seconds_per_word = seconds_per_word
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> "StubChunkedStream":
+        return StubChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class StubChunkedStream(tts.ChunkedStream):
+    async def _run(self) -> None:
+        stub: StubTTS = self._tts
+        await asyncio.sleep(stub.latency)
+        request_id = utils.shortuuid()
+        samples = SAMPLE_RATE // 10
+        duration = max(0.2, len(self.input_text.split()) * stub.seconds_per_word)
+        for _ in range(math.ceil(duration * 10)):
+            frame = rtc.AudioFrame(data=bytes(samples * 2), sample_rate=SAMPLE_RATE, num_channels=1, samples_per_channel=samples)
+            self._event_ch.send_nowait(tts.SynthesizedAudio(frame=frame, request_id=request_id))
+
+
+class ReplayAudioOutput(io.AudioOutput):
+    """
+    Audio sink that plays segments back in sequence at `speed` times their duration
+    (0 finishes them at once), and timestamps the first frame of each turn.
+    """
+    def __init__(self, recorder: "ReplayRecorder", speed: float):
+        super().__init__(sample_rate=None)
+        self.recorder = recorder
+        self.speed = speed
+        self._capturing = False
+        self._segment = 0.0
+        self._playout_end = 0.0
+        self._timers: List[asyncio.TimerHandle] = []
+
+    @property
+    def playing(self) -> bool:
+        return self._capturing or bool(self._timers)
+
+    async def capture_frame(self, frame: rtc.AudioFrame) -> None:
+        await super().capture_frame(frame)
+        self._capturing = True
+        self._segment += frame.duration
+        self.recorder.on_audio()
+
+    def flush(self) -> None:
+        super().flush()
+        if not self._capturing:
+            return
+        loop = asyncio.get_running_loop()
+        duration, self._segment, self._capturing = self._segment, 0.0, False
+        self._playout_end = max(loop.time(), self._playout_end) + duration * self.speed
+        timer = loop.call_at(self._playout_end, self._finish, duration)
+        self._timers.append(timer)
+
+    def _finish(self, duration: float) -> None:
+        self._timers.pop(0)
+        self.on_playback_finished(playback_position=duration, interrupted=False)
+
+    def clear_buffer(self) -> None:
+        pending = len(self._timers) + self._capturing
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        self._segment, self._capturing, self._playout_end = 0.0, False, 0.0
+        for _ in range(pending):
+            self.on_playback_finished(playback_position=0.0, interrupted=True)
+
+
+class ReplayRecorder:
+    """Collects turn latencies and handoffs while the script runs."""
+    def __init__(self, userdata: UserData):
+        self.userdata = userdata
+        self.latency = LatencyStats()
+        self.turns: List[Dict[str, Any]] = []
+        self.handoffs: List[str] = []
+        self._agent: Any = None
+        self._turn_started: Optional[float] = None
+        self._offset = 0.0
+        # the greeting, then the reply to each candidate turn
+        self.awaiting_audio = True
+
+    def user_turn(self, text: str, simulated: float) -> None:
+        node = self.userdata.current_node
+        self.turns.append({"node": node.id if node else None, "text": text, "latency_ms": None})
+        self._turn_started = time.perf_counter()
+        self._offset = simulated
+        self.awaiting_audio = True
+
+    def on_audio(self) -> None:
+        self.awaiting_audio = False
+        if self._turn_started is None:
+            return
+        value = time.perf_counter() - self._turn_started + self._offset
+        self._turn_started = None
+        self.turns[-1]["latency_ms"] = round(value * 1000, 1)
+        self.latency.observe("turn", value)
+
+    def on_agent(self, agent: Any) -> None:
+        if agent is self._agent or agent is None:
+            return
+        node = getattr(agent, "node", None)
+        name = type(agent).__name__ + (f"({node.id})" if node else "")
+        if self._agent is not None:
+            self.handoffs.append(name)
+        self._agent = agent
+
+
+async def _wait_idle(session: Any, output: ReplayAudioOutput, recorder: ReplayRecorder, closed: asyncio.Event, settle: float, timeout: float) -> bool:
+    """
+    Wait until the agent has replied and has then been listening, with nothing playing, for
+    `settle` seconds. Handoffs through a branching node are silent, so a turn is only over
+    once some audio came back.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    quiet_since: Optional[float] = None
+    while loop.time() < deadline:
+        recorder.on_agent(session.current_agent)
+        if closed.is_set():
+            return True
+        if session.agent_state == "listening" and not output.playing and not recorder.awaiting_audio:
+            quiet_since = quiet_since or loop.time()
+            if loop.time() - quiet_since >= settle:
+                return True
+        else:
+            quiet_since = None
+        await asyncio.sleep(0.02)
+    return False
+
+
+# called with the session and the script turn before the turn is submitted, returns the seconds to add to its latency
+Candidate = Callable[[Any, Dict[str, Any]], Awaitable[float]]
+
+
+async def replay(script: Dict[str, Any], args: argparse.Namespace, candidate: Optional[Candidate] = None) -> Dict[str, Any]:
+    context_data = script["context"]
+    compiled_flow = get_compiled_flow(context_data.get("flow", {}))
+    userdata = UserData(
+        context_data=context_data,
+        flow=compiled_flow.graph,
+        current_node=compiled_flow.graph.get_initial_node(),
+        question_instructions=compiled_flow.question_instructions,
+    )
+    policy = ScriptPolicy(script, userdata, args.reply_words)
+    recorder = ReplayRecorder(userdata)
+    session, usage_collector = build_agent_session(
+        userdata,
+        vad=None,
+        stt=None,
+        llm_engine=StubLLM(policy, args.llm_latency),
+        tts=StubTTS(args.tts_latency),
+        background_llm=StubLLM(policy, args.llm_latency),
+        background_tts=StubTTS(args.tts_latency),
+        turn_detection=None,
+    )
+    policy.session = session
+    output = ReplayAudioOutput(recorder, args.playback_speed)
+    session.output.audio = output
+    closed = asyncio.Event()
+    session.on("close", lambda _: closed.set())
+
+    started = time.perf_counter()
+    await session.start(agent=GreeterAgent(initial_node=userdata.current_node, context_data=context_data))
+    stuck = not await _wait_idle(session, output, recorder, closed, args.settle, args.turn_timeout)
+
+    for turn in policy.turns:
+        if closed.is_set() or stuck:
+            break
+        cutoff = False
+        for pause in turn.get("pauses", []):
+            userdata.endpointing.observe_pause(pause)
+            if pause > session.options.max_endpointing_delay:
+                userdata.endpointing.observe_cutoff()
+                cutoff = True
+        eou_delay = args.eou_delay if args.eou_delay is not None else session.options.min_endpointing_delay
+        simulated = args.stt_latency + eou_delay
+        measured = await candidate(session, turn) if candidate is not None else 0.0
+        await asyncio.sleep(simulated)
+        simulated += measured
+        policy.turn = turn
+        recorder.user_turn(turn["text"], simulated)
+        recorder.turns[-1]["cutoff"] = cutoff
+        session.generate_reply(user_input=turn["text"])
+        stuck = not await _wait_idle(session, output, recorder, closed, args.settle, args.turn_timeout)
+
+    if not closed.is_set():
+        await session.aclose()
+    for worker in (userdata.summarizer, userdata.prefetcher):
+        if worker:
+            await worker.aclose()
+
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for call in policy.calls:
+        stats = nodes.setdefault(call["node"] or "-", {"calls": 0, "tool_calls": 0, "background_calls": 0, "first_tokens": call["tokens"], "max_tokens": 0, "max_items": 0})
+        stats["calls"] += 1
+        stats["tool_calls"] += call["kind"].startswith("tool:")
+        stats["background_calls"] += call["kind"] == "background"
+        stats["max_tokens"] = max(stats["max_tokens"], call["tokens"])
+        stats["max_items"] = max(stats["max_items"], call["items"])
+
+    return {
+        "completed": closed.is_set() and not stuck,
+        "wall_time_s": round(time.perf_counter() - started, 2),
+        "turns": recorder.turns,
+        "turn_latency": recorder.latency.summary().get("turn"),
+        "stage_latency": userdata.latency.session.summary(),
+        "node_latency": userdata.latency.session.node_summary(),
+        "handoffs": len(recorder.handoffs),
+        "handoff_path": recorder.handoffs,
+        "branch_decisions": userdata.branch_decisions,
+        "endpointing": userdata.endpointing.decisions,
+        "cutoffs": sum(turn["cutoff"] for turn in recorder.turns),
+        "llm_calls": len(policy.calls),
+        "llm_calls_by_node": nodes,
+        "context_growth": [(call["node"], call["kind"], call["items"], call["tokens"]) for call in policy.calls],
+        "usage": usage_collector.get_summary().__dict__,
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"Completed: {report['completed']} in {report['wall_time_s']}s")
+    print(f"Handoffs: {report['handoffs']}  " + " -> ".join(report["handoff_path"]))
+    print(f"Turn latency: {report['turn_latency']}")
+    for turn in report["turns"]:
+        print(f"  {turn['node'] or '-':<16} {turn['latency_ms']} ms")
+    print(f"Endpointing: {report['cutoffs']} cutoffs")
+    for decision in report["endpointing"]:
+        print(f"  {decision['node'] or '-':<16} min={decision['min_delay']}s max={decision['max_delay']}s from {decision['source']}")
+    print(f"LLM calls: {report['llm_calls']}")
+    for node, stats in report["llm_calls_by_node"].items():
+        print(f"  {node:<16} calls={stats['calls']} tools={stats['tool_calls']} background={stats['background_calls']} "
+              f"tokens={stats['first_tokens']}->{stats['max_tokens']} items<={stats['max_items']}")
+    print("Stage latency:")
+    for stage, summary in report["stage_latency"].items():
+        print(f"  {stage:<16} {summary}")
+
+
+def add_replay_arguments(parser: argparse.ArgumentParser) -> None:
+    """Stub latency and pacing options, shared with loadtest.py."""
+    parser.add_argument("script", nargs="?", default="assets/replay/sample_interview.json")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to the stub LLM's reply")
+    parser.add_argument("--tts-latency", type=float, default=0.15, help="seconds to the stub TTS's first frame")
+    parser.add_argument("--stt-latency", type=float, default=0.1, help="simulated final transcript delay per turn")
+    parser.add_argument("--eou-delay", type=float, help="simulated turn detector delay per turn (default: the agent's minimum endpointing delay)")
+    parser.add_argument("--playback-speed", type=float, default=0.0, help="playback time as a fraction of audio duration")
+    parser.add_argument("--reply-words", type=int, default=27, help="length of the stub LLM's text replies")
+    parser.add_argument("--settle", type=float, default=0.5, help="idle time that ends a turn")
+    parser.add_argument("--turn-timeout", type=float, default=30.0)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay a scripted interview offline and report latency and LLM usage.")
+    add_replay_arguments(parser)
+    parser.add_argument("--max-p95-ms", type=float, help="exit with 1 if the p95 turn latency is above this")
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+    setup_logging()
+
+    with open(args.script) as f:
+        script = json.load(f)
+    report = asyncio.run(replay(script, args))
+
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    p95 = (report["turn_latency"] or {}).get("p95_ms")
+    if not report["completed"]:
+        return 1
+    if args.max_p95_ms is not None and p95 is not None and p95 > args.max_p95_ms:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,190 +1,191 @@
+import logging
 import os
 from dotenv import load_dotenv
+
+# before the app modules, which read their settings from the environment when imported
+load_dotenv(dotenv_path=".env")
+
 from livekit.agents import (
     AutoSubscribe,
     JobContext,
+    JobExecutorType,
     JobProcess,
     WorkerOptions,
     cli,
 )
-from livekit.plugins import (
-    noise_cancellation,
-)
-import requests
 import json
 
 from agents import GreeterAgent
 from context import UserData, extract_context_data, build_system_prompt, create_greeting
-from config import create_voice_agent
-from flow import FlowGraph
-from logger_config import setup_logging
-from recording import setup_recording, save_transcript
+from config import create_voice_agent, import_plugins
+from flow_cache import get_compiled_flow
+from metadata import SessionMetadata
+from logger_config import bind_participant, bind_session, flush_session_log, in_session_context, setup_logging
+from recording import RecordingTask, transcript_key
+from post_interview import (
+    enqueue_in_background,
+    recover_transcripts,
+    run_post_interview,
+    start_outbox_worker,
+    stop_outbox_worker,
+)
+from transcript import TranscriptWriter
+from clients import client_pool
+from models import model_pool
+from worker_metrics import ACTIVE_SESSIONS, observe_usage, start_metrics_export, start_metrics_server
+from loop_monitor import start_loop_monitor
 from livekit.agents.voice.room_io import RoomInputOptions
 
+logger = logging.getLogger("voice-agent")
 
-load_dotenv(dotenv_path=".env")
-                                                                                                                                    
-# Set up enhanced logging
-logger = setup_logging()
-logger.info("Voice agent application starting")
+JOB_EXECUTOR_TYPE = JobExecutorType(os.environ.get("JOB_EXECUTOR_TYPE", "process"))
 
 
 def prewarm(proc: JobProcess):
-    logger.info("Prewarming model - loading VAD")
+    # job processes do not run __main__, set up their logging here. They append to the worker
+    # process's log file, which only the worker process rotates (a no-op with the thread executor)
+    setup_logging(rotate=False)
+    logger.info("Importing STT, LLM and TTS plugins")
+    import_plugins()
+
+    logger.info("Prewarming models - VAD and noise cancellation")
     try:
-        from livekit.plugins import silero
-        proc.userdata["vad"] = silero.VAD.load()
-        logger.info("VAD loaded successfully")
+        model_pool.prewarm()
+        proc.userdata["models"] = model_pool
+        proc.userdata["vad"] = model_pool.vad
+        logger.info("Models loaded successfully: %s", model_pool.report())
     except Exception as e:
-        logger.error(f"Failed to load VAD: {str(e)}", exc_info=True)
+        logger.error("Failed to load models: %s", e, exc_info=True)
         raise
 
+    logger.info("Prewarming API clients")
+    client_pool.prewarm()
+    proc.userdata["clients"] = client_pool
+
+    # transcripts of interviews a crashed job left in the spool, delivered by the next session's outbox worker
+    recover_transcripts()
+
+    # served by the main worker process, see start_metrics_server
+    start_metrics_export()
+
 
 async def entrypoint(ctx: JobContext):
     room_name = ctx.room.name
-    logger.info(f"Connecting to room: {room_name}")
+    # Tag every log record of this session
+    bind_session(room_name, ctx.job.id)
+    logger.info("Connecting to room: %s", room_name)
     
     try:
         # Connect to the room 
         await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
-        logger.info(f"Successfully connected to room: {room_name}")
+        logger.info("Successfully connected to room: %s", room_name)
         
         # Wait for the first participant to connect
         logger.info("Waiting for participant to join...")
         participant = await ctx.wait_for_participant()
-        logger.info(f"Participant joined - identity: {participant.identity}, sid: {participant.sid}")
+        bind_participant(participant.identity)
+        logger.info("Participant joined - identity: %s, sid: %s", participant.identity, participant.sid)
         
-        # Set up recording with participant metadata
-        logger.info("Setting up reccording for this session")
-        egress_id = await setup_recording(room_name, participant)
-
-        if egress_id:
-            logger.info(f"Recording set up with egress ID: {egress_id}")
-        else:
-            logger.warning("Failed to set up recording, continuing without recording")
+        # Parse the participant metadata once, everything below uses this object
+        metadata = SessionMetadata.parse(participant.metadata)
+        if metadata.errors:
+            logger.error("Invalid participant metadata: %s", "; ".join(metadata.errors))
 
         # Extract context data and build prompt
         logger.info("Extracting context data from participant metadata")
-        context_data = extract_context_data(participant)
-
-        # Extract metadata from participant
-        metadata = json.loads(participant.metadata)
-        user_id = metadata.get("user_id")
-        job_id = metadata.get("job_id")
-        applicant_name = metadata.get("applicant_name")
-        scout_name = metadata.get("scout_name")
+        context_data = extract_context_data(metadata)
+        applicant_name = metadata.applicant_name
+        scout_name = metadata.scout_name
         
-        flow_data = context_data.get("flow", {})
-        flow_graph = FlowGraph.from_dict(flow_data)
+        # keyed by the flow_key computed while parsing the metadata. Only hits with the thread
+        # executor: the process executor runs each job in a new process
+        compiled_flow = get_compiled_flow(metadata.flow, metadata.flow_key)
+        flow_graph = compiled_flow.graph
         initial_node = flow_graph.get_initial_node()
-        if initial_node is None:
-            raise ValueError("Flow graph must have an initial node")
-        userdata = UserData(context_data=context_data, flow=flow_graph, current_node=initial_node)
-        logger.debug(f"Context data extracted: {context_data}")
+        userdata = UserData(
+            context_data=context_data,
+            flow=flow_graph,
+            current_node=initial_node,
+            question_instructions=compiled_flow.question_instructions,
+            metadata=metadata,
+        )
+
+        # Replace any pooled API client that went stale while the worker was idle
+        client_pool.start_health_check()
+        # Deliver post-interview items left over from earlier sessions
+        start_outbox_worker()
+        # Report event loop stalls and the code that caused them
+        start_loop_monitor()
+
+        # Set up recording in the background, the egress ID is only needed at shutdown
+        logger.info("Setting up recording for this session")
+        userdata.recording = RecordingTask(room_name, metadata).start()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Context data extracted: %s", json.dumps(context_data, default=str))
         
         logger.info("Building system prompt from context")
 
         
         # Create and start the agent
-        voice_data = context_data.get('voice', {})
-
-        # logger.info(f"Creating voice agent, setting voice to: {voice_data.get('id', '')}")
-        agent_session, usage_collector = create_voice_agent(ctx, userdata, voice_data.get("id", ""))
+        # logger.info(f"Creating voice agent, setting voice to: {metadata.voice_id}")
+        agent_session, usage_collector = create_voice_agent(ctx, userdata, metadata.voice_id)
         
-        # Create a list to store all transcripts
-        conversation_transcripts = []
+        # Stream transcript segments to a local spool, checkpointed to S3 in parts
+        transcript = TranscriptWriter(
+            room_name,
+            transcript_key(room_name, metadata.user_id, metadata.job_id),
+            upload=not metadata.is_demo,
+        )
 
         @agent_session.on("conversation_item_added")
         def on_conversation_item_added(event):
             if event.item.role == "user":
-                conversation_transcripts.append({
-                    "speaker": f"applicant({applicant_name})", 
-                    "text": event.item.text_content
-                })
+                speaker = f"applicant({applicant_name})"
             elif event.item.role == "assistant":
-                conversation_transcripts.append({
-                    "speaker": f"scout({scout_name})", 
-                    "text": event.item.text_content
-                })
-
+                speaker = f"scout({scout_name})"
+            else:
+                return
+            node_id = userdata.current_node.id if userdata.current_node else None
+            part = transcript.append(speaker, event.item.role, event.item.text_content, node_id)
+            if part:
+                enqueue_in_background([part])
+
+
+        @agent_session.on("close")
+        def on_session_close(event):
+            # closed on an unrecoverable LLM, STT or TTS error
+            if event.error is not None:
+                flush_session_log()
+                logger.error("Session closed on error: %s", event.error)
 
         async def notify_analysis_bot():
-            logger.info("Interview finished - notifying analysis bot")
+            logger.info("Interview finished - uploading transcript and notifying analysis bot")
             try:
-                # Skip notification if recording wasn't successful
-                if not egress_id:
-                    logger.warning("No recording egress ID available - skipping analysis notification")
-                    return
-                
-                # Save transcript if we have any
-                if conversation_transcripts:
-                    logger.info(f"Saving {len(conversation_transcripts)} transcript segments")
-                    save_result = save_transcript(conversation_transcripts, room_name, user_id, job_id)
-                    if save_result:
-                        logger.info("Transcript saved successfully")
-                    else:
-                        logger.warning("Failed to save transcript")
-                    
-                # Skip notification for demo interviews
-                is_demo = False
-                application_id = None
-                
-                if participant and participant.metadata:
-                    try:
-                        metadata = json.loads(participant.metadata)
-                        is_demo = metadata.get("is_demo", False)
-                        application_id = metadata.get("application_id")
-                    except json.JSONDecodeError:
-                        logger.warning("Failed to parse participant metadata as JSON")
-                
-                if is_demo:
-                    logger.info("Demo interview - skipping analysis notification")
-                    return
-                    
-                if not user_id or not job_id:
-                    logger.warning("Missing user_id or job_id - skipping analysis notification")
-                    return
-                    
-                # Prepare minimal payload
-                payload = {
-                    "recording_id": egress_id,
-                    "user_id": user_id,
-                    "job_id": job_id,
-                    "application_id": application_id
-                }
-                print("reaches here")
-                # Get the analysis bot endpoint from environment variables
-                analysis_endpoint = os.environ.get("ANALYSIS_BOT_ENDPOINT")
-                if not analysis_endpoint:
-                    logger.error("Missing ANALYSIS_BOT_ENDPOINT environment variable")
-                    return
-
-                # Send notification to analysis bot
-                headers = {
-                    "Content-Type": "application/json",
-                    # "Authorization": f"Bearer {os.environ.get('ANALYSIS_BOT_API_KEY', '')}"
-                }
-                
-                response = requests.post(
-                    analysis_endpoint,
-                    json=payload,
-                    headers=headers,
-                    timeout=10  # 10 second timeout
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Analysis bot notification successful")
-                else:
-                    logger.error(f"Analysis bot notification failed: {response.status_code} - {response.text}")
-                        
-            except Exception as e:
-                logger.error(f"Error notifying analysis bot: {str(e)}", exc_info=True)
+                await run_post_interview(userdata, transcript, room_name, metadata)
+            finally:
+                # after the final drain, shutdown callbacks run concurrently
+                await stop_outbox_worker()
         
 
         # Register the shutdown callback
-        ctx.add_shutdown_callback(notify_analysis_bot)
+        ctx.add_shutdown_callback(in_session_context(notify_analysis_bot))
+        if userdata.summarizer:
+            ctx.add_shutdown_callback(in_session_context(userdata.summarizer.aclose))
+        if userdata.prefetcher:
+            ctx.add_shutdown_callback(in_session_context(userdata.prefetcher.aclose))
+
+        ACTIVE_SESSIONS.inc()
+
+        async def report_usage():
+            ACTIVE_SESSIONS.dec()
+            summary = usage_collector.get_summary()
+            observe_usage(summary)
+            logger.info("Usage summary: %s", summary)
+            userdata.latency.report()
+
+        ctx.add_shutdown_callback(in_session_context(report_usage))
         
-        logger.info(f"Starting voice agent for participant {participant.identity}")
+        logger.info("Starting voice agent for participant %s", participant.identity)
         
         # Greet the user
         logger.info("Creating greeting")
@@ -193,21 +194,30 @@ async def entrypoint(ctx: JobContext):
             agent= GreeterAgent(initial_node=initial_node, context_data=context_data),
             room=ctx.room,
             room_input_options=RoomInputOptions(
-                noise_cancellation=  noise_cancellation.BVC())
+                noise_cancellation=model_pool.noise_cancellation)
         )
         logger.info("Greeting sent, agent is now listening")
         
     except Exception as e:
-        logger.error(f"Error in entrypoint: {str(e)}", exc_info=True)
+        flush_session_log()
+        logger.error("Error in entrypoint: %s", e, exc_info=True)
         raise
 
 
 if __name__ == "__main__":
+    setup_logging()
+    logger.info("Voice agent application starting")
+    start_metrics_server()
+    if JOB_EXECUTOR_TYPE == JobExecutorType.THREAD:
+        # jobs are prewarmed on their own threads, plugins have to be registered from this one
+        import_plugins()
     logger.info("Starting voice agent application via CLI")
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
             prewarm_fnc=prewarm,
+            # "thread" runs jobs as threads of shared processes, see turn_service.py
+            job_executor_type=JOB_EXECUTOR_TYPE,
         ),
     )
     logger.info("Voice agent application shutting down")
@@ -0,0 +1,120 @@
+"""
+Startup profile of the worker, to keep cold starts (and autoscaling lag) in check.
+
+    python startup_profile.py imports --top 25
+    python startup_profile.py ready --runs 5 --output startup.json
+    python startup_profile.py ready --runs 5 --baseline startup.json --max-regression 0.2
+
+`imports` runs `python -X importtime -c "import session"` and lists the slowest modules and
+top-level packages by cumulative import time.
+
+`ready` starts fresh interpreters and measures, from process start:
+- import: `import session`, what the worker's main process pays before it registers with the
+  server, and every job process before it is prewarmed
+- ready: import plus `prewarm`, when a job process can take its first interview
+
+With --baseline, exits with 1 if the median ready time is more than --max-regression (a fraction)
+above the baseline's.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+MARKER = "STARTUP "
+
+# run in a fresh interpreter, argv[1] is the time.time() the parent started it at
+CHILD = f"""
+import json, sys, time
+from types import SimpleNamespace
+started = float(sys.argv[1])
+import session
+imported = time.time()
+session.prewarm(SimpleNamespace(userdata={{}}))
+ready = time.time()
+print({MARKER!r} + json.dumps({{"import_s": imported - started, "ready_s": ready - started}}), flush=True)
+"""
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) for every module imported by `import <module>`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((name, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def imports_command(args: argparse.Namespace) -> int:
+    rows = profile_imports(args.module)
+    total = next((cumulative for name, _, cumulative in rows if name == args.module), 0)
+    packages: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in rows:
+        packages[name.split(".")[0]] += self_us
+
+    print(f"import {args.module}: {total / 1000:.0f} ms, {len(rows)} modules")
+    print("\nSlowest modules (cumulative):")
+    for name, _, cumulative in sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+    print("\nSlowest packages (own time of their modules):")
+    for name, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:>8.1f} ms  {name}")
+    return 0
+
+
+def _measure_once() -> Dict[str, float]:
+    result = subprocess.run([sys.executable, "-c", CHILD, repr(time.time())], capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):])
+    raise RuntimeError(f"startup run failed:\n{result.stderr[-2000:]}")
+
+
+def ready_command(args: argparse.Namespace) -> int:
+    runs = [_measure_once() for _ in range(args.runs)]
+    report: Dict[str, Any] = {"runs": args.runs}
+    for key in ("import_s", "ready_s"):
+        values = [run[key] for run in runs]
+        report[key] = {"median": round(statistics.median(values), 3), "min": round(min(values), 3), "max": round(max(values), 3)}
+    print(f"import: median {report['import_s']['median']:.3f}s  ready: median {report['ready_s']['median']:.3f}s  ({args.runs} runs)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    before, after = baseline["ready_s"]["median"], report["ready_s"]["median"]
+    change = (after - before) / before
+    print(f"ready vs baseline: {before:.3f}s -> {after:.3f}s ({change:+.0%})")
+    return 1 if change > args.max_regression else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profile worker imports and measure time to a ready job process.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    imports = commands.add_parser("imports", help="-X importtime profile of the worker's imports")
+    imports.add_argument("--module", default="session")
+    imports.add_argument("--top", type=int, default=25)
+    ready = commands.add_parser("ready", help="time to import and prewarm, in fresh interpreters")
+    ready.add_argument("--runs", type=int, default=5)
+    ready.add_argument("--output", help="write the results as JSON to this file")
+    ready.add_argument("--baseline", help="results of an earlier run to compare with")
+    ready.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+    return imports_command(args) if args.command == "imports" else ready_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from typing import TYPE_CHECKING, Any, List, Optional, Protocol, Set
+
+from flow import Node
+
+if TYPE_CHECKING:
+    from context import UserData
+
+logger = logging.getLogger("voice-agent")
+
+SUMMARY_PROMPT = (
+    "Summarise the candidate's answer to the interview question below in at most two sentences. "
+    "Keep concrete facts, examples and numbers, and leave out filler.\n\n"
+    "Question: {question}\n\nTranscript:\n{transcript}"
+)
+
+
+class CompletionLLM(Protocol):
+    """Minimal completion interface used by the summariser, so it can run against a local stub."""
+    async def complete(self, prompt: str) -> str: ...
+
+
+class LiveKitCompletionLLM:
+    """
+    CompletionLLM backed by a livekit `llm.LLM`, such as the session's OpenAI model.
+    """
+    def __init__(self, llm: Any):
+        self._llm = llm
+
+    async def complete(self, prompt: str) -> str:
+        from livekit.agents.llm import ChatContext
+
+        chat_ctx = ChatContext()
+        chat_ctx.add_message(role="user", content=prompt)
+        parts: List[str] = []
+        async with self._llm.chat(chat_ctx=chat_ctx) as stream:
+            async for chunk in stream:
+                if chunk.delta and chunk.delta.content:
+                    parts.append(chunk.delta.content)
+        return "".join(parts).strip()
+
+
+def format_transcript(items: List[Any]) -> str:
+    """Render the spoken messages of a question as plain transcript lines."""
+    lines = []
+    for item in items:
+        if item.type != "message" or item.role not in ("user", "assistant"):
+            continue
+        speaker = "Candidate" if item.role == "user" else "Interviewer"
+        lines.append(f"{speaker}: {item.text_content or ''}")
+    return "\n".join(lines)
+
+
+class AnswerSummarizer:
+    """
+    Compresses answered questions into short summaries in `UserData.answers`, in the background.
+
+    Summaries are produced between turns, off the critical path. Once a summary is stored
+    the raw items of that question are compacted out of the shared chat history, and later
+    agents see the summaries plus the live question instead.
+    """
+    def __init__(self, backend: CompletionLLM, timeout: float = 15.0):
+        self.backend = backend
+        self.timeout = timeout
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, userdata: "UserData", node: Node) -> Optional[asyncio.Task]:
+        """
+        Start summarising the answer given at `node`, returns None when there is nothing to summarise.
+        """
+        transcript = format_transcript(userdata.history.items_for(node.id))
+        if not transcript:
+            return None
+        task = asyncio.create_task(self._summarize(userdata, node, transcript))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _summarize(self, userdata: "UserData", node: Node, transcript: str) -> None:
+        try:
+            summary = await asyncio.wait_for(
+                self.backend.complete(SUMMARY_PROMPT.format(question=node.content, transcript=transcript)),
+                timeout=self.timeout,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Failed to summarise answer for node %s: %s", node.id, e)
+            return
+        if not summary:
+            return
+        userdata.answers[node.id] = summary
+        removed = userdata.history.compact(node.id)
+        logger.debug("Summarised answer for node %s, compacted %d chat items", node.id, removed)
+
+    async def aclose(self) -> None:
+        """Wait briefly for pending summaries, then cancel the rest."""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.timeout)
+        for task in pending:
+            task.cancel()
+
+
+def summaries_enabled() -> bool:
+    return os.environ.get("SUMMARIZE_ANSWERS", "true").lower() not in ("0", "false", "no")
+
+
+def build_summary_message(userdata: "UserData") -> Optional[str]:
+    """
+    Return the system message listing the summarised answers so far, or None if there are none.
+    """
+    if not userdata.answers:
+        return None
+    lines = ["Summary of the candidate's earlier answers:"]
+    for node_id, summary in userdata.answers.items():
+        question = userdata.flow.get_node_content(node_id)
+        lines.append(f"- Q: {question}\n  A: {summary}")
+    return "\n".join(lines)
@@ -0,0 +1,85 @@
+import pytest
+
+from flow import FlowGraph, FlowValidationError
+
+
+def _node(node_id, node_type, content=""):
+    return {"id": node_id, "type": node_type, "data": {"content": content or node_id}}
+
+
+def _edges(*pairs):
+    return [{"id": f"e{i}", "source": source, "target": target} for i, (source, target) in enumerate(pairs)]
+
+
+def test_compiles_a_branching_flow():
+    graph = FlowGraph(
+        nodes=[
+            _node("start", "start"),
+            _node("q1", "question"),
+            _node("branch", "branching"),
+            _node("q2", "question"),
+            _node("q3", "question"),
+            _node("end", "conclusion"),
+        ],
+        edges=_edges(("start", "q1"), ("q1", "branch"), ("branch", "q2"), ("branch", "end"), ("q2", "q3"), ("q3", "end")),
+    )
+    assert graph.get_initial_node().id == "start"
+    assert graph.get_next_node("start").id == "q1"
+    assert [node.id for node in graph.get_branch_options("branch")] == ["q2", "end"]
+    assert graph.get_depth("q3") == 4
+    assert graph.get_remaining_questions("q1") == 2
+    assert graph.get_remaining_questions("q3") == 0
+
+
+def test_rejects_several_start_nodes():
+    with pytest.raises(FlowValidationError, match="exactly one start node, found 2"):
+        FlowGraph(
+            nodes=[_node("s1", "start"), _node("s2", "start"), _node("end", "conclusion")],
+            edges=_edges(("s1", "end"), ("s2", "end")),
+        )
+
+
+def test_rejects_a_flow_without_start_node():
+    with pytest.raises(FlowValidationError, match="found 0"):
+        FlowGraph(nodes=[_node("q1", "question"), _node("end", "conclusion")], edges=_edges(("q1", "end")))
+
+
+def test_rejects_dangling_edges():
+    with pytest.raises(FlowValidationError, match="unknown nodes"):
+        FlowGraph(
+            nodes=[_node("start", "start"), _node("q1", "question"), _node("end", "conclusion")],
+            edges=_edges(("start", "q1"), ("q1", "end"), ("q1", "missing")),
+        )
+
+
+def test_rejects_cycles():
+    with pytest.raises(FlowValidationError, match="cycle through node q1"):
+        FlowGraph(
+            nodes=[_node("start", "start"), _node("q1", "question"), _node("branch", "branching"), _node("end", "conclusion")],
+            edges=_edges(("start", "q1"), ("q1", "branch"), ("branch", "q1"), ("branch", "end")),
+        )
+
+
+def test_rejects_an_unreachable_end_node():
+    with pytest.raises(FlowValidationError, match="no end node reachable"):
+        FlowGraph(
+            nodes=[_node("start", "start"), _node("q1", "question"), _node("q2", "question"), _node("end", "conclusion")],
+            edges=_edges(("start", "q1"), ("q1", "q2"), ("q2", "q1")),
+        )
+
+
+def test_rejects_dead_ends():
+    with pytest.raises(FlowValidationError, match=r"no outgoing edges: \['q2'\]"):
+        FlowGraph(
+            nodes=[_node("start", "start"), _node("branch", "branching"), _node("q2", "question"), _node("end", "conclusion")],
+            edges=_edges(("start", "branch"), ("branch", "q2"), ("branch", "end")),
+        )
+
+
+def test_unreachable_nodes_are_only_a_warning(caplog):
+    graph = FlowGraph(
+        nodes=[_node("start", "start"), _node("q1", "question"), _node("orphan", "question"), _node("end", "conclusion")],
+        edges=_edges(("start", "q1"), ("q1", "end"), ("orphan", "end")),
+    )
+    assert graph.get_depth("orphan") == -1
+    assert "unreachable" in caplog.text
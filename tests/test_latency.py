@@ -0,0 +1,62 @@
+import pytest
+
+from latency import TurnLatencyTracker
+
+
+class EOUMetrics:
+    def __init__(self, speech_id, delay):
+        self.speech_id = speech_id
+        self.end_of_utterance_delay = delay
+        self.transcription_delay = delay
+
+
+class LLMMetrics:
+    def __init__(self, speech_id, ttft):
+        self.speech_id = speech_id
+        self.ttft = ttft
+
+
+class TTSMetrics:
+    def __init__(self, speech_id, ttfb):
+        self.speech_id = speech_id
+        self.ttfb = ttfb
+
+
+def _turns(tracker):
+    return tracker.session.summary().get("turn", {}).get("count", 0)
+
+
+def test_records_a_reply_turn():
+    tracker = TurnLatencyTracker()
+    tracker.on_metrics(EOUMetrics("a", 0.2))
+    tracker.on_metrics(LLMMetrics("a", 0.3))
+    tracker.on_metrics(TTSMetrics("a", 0.1))
+    assert _turns(tracker) == 1
+    assert tracker.session.stages["turn"].total == pytest.approx(0.6)
+
+
+def test_carries_the_answer_over_a_handoff():
+    tracker = TurnLatencyTracker()
+    tracker.on_metrics(EOUMetrics("answer", 0.2))
+    tracker.on_metrics(LLMMetrics("answer", 0.3))
+    tracker.start_handoff()
+    tracker.finish_handoff("q2", 0.01)
+    assert "handoff" not in tracker.session.stages
+    # the new agent asks the next question from on_enter
+    tracker.on_metrics(LLMMetrics("question", 0.4))
+    tracker.on_metrics(TTSMetrics("question", 0.1))
+    assert _turns(tracker) == 1
+    total = tracker.session.stages["turn"].total
+    handoff = tracker.session.stages["handoff"].total
+    assert total == pytest.approx(0.2 + 0.3 + 0.4 + 0.1 + handoff)
+
+
+def test_next_answer_drops_an_unspoken_handoff():
+    tracker = TurnLatencyTracker()
+    tracker.on_metrics(EOUMetrics("answer", 0.2))
+    tracker.on_metrics(LLMMetrics("answer", 0.3))
+    tracker.start_handoff()
+    tracker.finish_handoff("q2", 0.01)
+    tracker.on_metrics(EOUMetrics("next", 0.2))
+    tracker.on_metrics(TTSMetrics("cached", 0.1))
+    assert _turns(tracker) == 0
@@ -0,0 +1,109 @@
+import json
+
+from metadata import SessionMetadata
+
+FLOW = {"nodes": [], "edges": []}
+
+
+def _parse(**fields):
+    return SessionMetadata.parse(json.dumps(fields))
+
+
+def test_parses_an_interview_context():
+    metadata = _parse(
+        type="interview_context",
+        applicant_id="a-1",
+        user_id=42,
+        job_id="j-1",
+        applicant_name="Sam",
+        scout_name="Alex",
+        is_demo=True,
+        voice={"id": "voice-1"},
+        flow=FLOW,
+    )
+    assert metadata.errors == []
+    assert metadata.is_interview
+    assert metadata.user_id == "42"
+    assert metadata.applicant_name == "Sam"
+    assert metadata.is_demo is True
+    assert metadata.voice_id == "voice-1"
+    assert metadata.flow == FLOW
+    assert metadata.context["scout_name"] == "Alex"
+
+
+def test_empty_metadata():
+    for raw in (None, "", b""):
+        assert SessionMetadata.parse(raw).errors == ["metadata is empty"]
+
+
+def test_invalid_json():
+    metadata = SessionMetadata.parse("{not json")
+    assert len(metadata.errors) == 1
+    assert metadata.errors[0].startswith("metadata is not valid JSON")
+
+
+def test_json_that_is_not_an_object():
+    assert SessionMetadata.parse("[1, 2]").errors == ["metadata is a JSON list, not an object"]
+
+
+def test_collects_every_error_and_keeps_defaults():
+    metadata = _parse(
+        type="interview_context",
+        applicant_id=["a"],
+        job_id=True,
+        applicant_name=7,
+        is_demo="true",
+        voice={"id": 3},
+        flow=[],
+    )
+    assert metadata.errors == [
+        "applicant_id should be a string, got list",
+        "job_id should be a string, got bool",
+        "applicant_name should be a string, got int",
+        "is_demo should be a boolean, got 'true'",
+        "voice.id should be a string, got int",
+        "flow should be an object, got list",
+    ]
+    assert metadata.applicant_id is None
+    assert metadata.job_id is None
+    assert metadata.applicant_name == "7"
+    # still treated as a demo, so it is not recorded
+    assert metadata.is_demo is True
+    assert metadata.voice_id == ""
+    assert metadata.flow == {}
+
+
+def test_missing_flow_of_an_interview():
+    assert _parse(type="interview_context").errors == ["flow is missing"]
+
+
+def test_voice_that_is_not_an_object():
+    metadata = _parse(voice="voice-1")
+    assert metadata.errors == ["voice should be an object, got str"]
+    assert metadata.voice_id == ""
+
+
+def test_other_metadata_types_have_no_context():
+    metadata = _parse(type="something_else", user_id="u-1")
+    assert metadata.errors == []
+    assert not metadata.is_interview
+    assert metadata.context == {}
+    assert metadata.user_id == "u-1"
+
+
+def test_flow_key_is_prefixed_with_the_flow_id_and_version():
+    metadata = _parse(type="interview_context", flow={"id": "flow-1", "version": 3, **FLOW})
+    assert metadata.flow_key.startswith("flow-1@3:")
+
+
+def test_flow_key_changes_when_a_flow_is_edited_in_place():
+    flow = {"id": "flow-1", "version": 3, **FLOW}
+    edited = {**flow, "nodes": [{"id": "start"}]}
+    assert _parse(type="interview_context", flow=flow).flow_key != _parse(type="interview_context", flow=edited).flow_key
+
+
+def test_flow_key_hashes_the_flow_without_an_id():
+    first = _parse(type="interview_context", flow={"nodes": [], "edges": []})
+    second = _parse(type="interview_context", flow={"edges": [], "nodes": []})
+    assert first.flow_key == second.flow_key
+    assert first.flow_key != _parse(type="interview_context", flow={"nodes": [{"id": "start"}], "edges": []}).flow_key
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+
+import pytest
+
+import outbox
+from outbox import BACKOFF_BASE, BACKOFF_MAX, LEASE_SECONDS, Outbox, OutboxWorker, PermanentError
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def box(tmp_path, clock):
+    box = Outbox(str(tmp_path / "outbox.db"), max_attempts=3)
+    yield box
+    box.close()
+
+
+def test_claim_leases_items_in_order(box):
+    ids = box.append([("webhook", {"n": 1}), ("s3_object", {"n": 2})])
+    items = box.claim()
+    assert [item.id for item in items] == ids
+    assert [item.payload for item in items] == [{"n": 1}, {"n": 2}]
+    assert all(item.attempts == 0 for item in items)
+    # leased, so another drainer does not get them
+    assert box.claim() == []
+
+
+def test_claim_respects_the_limit(box):
+    box.append([("webhook", {"n": n}) for n in range(5)])
+    assert len(box.claim(limit=2)) == 2
+    assert len(box.claim(limit=10)) == 3
+
+
+def test_expired_lease_is_claimed_again(box, clock):
+    box.append([("webhook", {})])
+    assert len(box.claim()) == 1
+    clock.now += LEASE_SECONDS - 1
+    assert box.claim() == []
+    clock.now += 1
+    assert len(box.claim()) == 1
+
+
+def test_complete_removes_items(box):
+    box.append([("webhook", {}), ("webhook", {})])
+    items = box.claim()
+    box.complete([items[0].id])
+    assert box.pending() == 1
+
+
+def test_retry_later_backs_off_exponentially(box, clock):
+    box.append([("webhook", {})])
+    item = box.claim()[0]
+    assert box.retry_later([(item, "boom")]) == []
+    clock.now += BACKOFF_BASE - 0.5
+    assert box.claim() == []
+    clock.now += 0.5
+    item = box.claim()[0]
+    assert item.attempts == 1
+
+    box.retry_later([(item, "boom")])
+    clock.now += BACKOFF_BASE ** 2 - 0.5
+    assert box.claim() == []
+    clock.now += 0.5
+    assert box.claim()[0].attempts == 2
+
+
+def test_backoff_is_capped(tmp_path, clock):
+    box = Outbox(str(tmp_path / "capped.db"), max_attempts=100)
+    box.append([("webhook", {})])
+    item = box.claim()[0]
+    item.attempts = 40
+    box.retry_later([(item, "boom")])
+    clock.now += BACKOFF_MAX
+    assert len(box.claim()) == 1
+    box.close()
+
+
+def test_items_are_dead_lettered_after_max_attempts(box, clock):
+    box.append([("webhook", {"n": 1})])
+    for attempt in range(3):
+        item = box.claim()[0]
+        dead = box.retry_later([(item, f"failure {attempt}")])
+        clock.now += BACKOFF_MAX
+    assert [item.payload for item in dead] == [{"n": 1}]
+    assert box.pending() == 0
+    assert box.dead() == 1
+
+
+def test_items_survive_reopening(tmp_path, clock):
+    path = str(tmp_path / "outbox.db")
+    first = Outbox(path)
+    first.append([("webhook", {"n": 1})])
+    first.close()
+    second = Outbox(path)
+    assert [item.payload for item in second.claim()] == [{"n": 1}]
+    second.close()
+
+
+def test_drain_delivers_retries_and_dead_letters(box):
+    calls = []
+
+    async def webhook(payload):
+        calls.append(payload["n"])
+        if payload["n"] == 2:
+            raise PermanentError("rejected")
+        return payload["n"] == 1
+
+    box.append([("webhook", {"n": 1}), ("webhook", {"n": 2}), ("webhook", {"n": 3}), ("unknown", {})])
+    completed = asyncio.run(OutboxWorker(box, {"webhook": webhook}).drain())
+    assert sorted(calls) == [1, 2, 3]
+    # delivered, dead-lettered as permanent and dead-lettered for having no handler
+    assert completed == 3
+    assert box.pending() == 1
+    assert box.dead() == 2
+    errors = box._conn.execute("SELECT kind, last_error FROM outbox_dead ORDER BY id").fetchall()
+    assert errors == [("webhook", "rejected"), ("unknown", "no handler for unknown")]
+
+
+def test_worker_drains_on_its_own_thread(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"))
+    threads = []
+
+    async def webhook(payload):
+        threads.append(threading.current_thread().name)
+        return True
+
+    worker = OutboxWorker(box, {"webhook": webhook})
+    worker.start()
+    try:
+        # as a session would, from another thread and event loop
+        async def session():
+            await asyncio.to_thread(box.append, [("webhook", {"n": 1})])
+            worker.wake()
+            for _ in range(200):
+                if box.pending() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            box.append([("webhook", {"n": 2})])
+            return await worker.drain_now()
+
+        assert asyncio.run(session()) == 1
+        assert threads == ["outbox-worker", "outbox-worker"]
+    finally:
+        worker.stop()
+    assert not worker.running
+    # a stopped worker can be started again
+    worker.start()
+    worker.stop()
+    box.close()
@@ -0,0 +1,35 @@
+from worker_metrics import Counter, Gauge, Histogram, Registry
+
+
+def _registry():
+    registry = Registry()
+    counter = registry.register(Counter("deliveries_total", "Deliveries", ["outcome"]))
+    gauge = registry.register(Gauge("active_sessions", "Sessions"))
+    histogram = registry.register(Histogram("lag_seconds", "Lag", buckets=(0.1, 1.0)))
+    return registry, counter, gauge, histogram
+
+
+def test_exposition_combines_the_snapshots_of_other_processes():
+    job, counter, gauge, histogram = _registry()
+    counter.inc("ok")
+    gauge.inc()
+    histogram.observe(0.5)
+    main, counter, _, _ = _registry()
+    counter.inc("ok")
+    text = main.exposition([job.snapshot(), job.snapshot()])
+    assert 'deliveries_total{outcome="ok"} 3.0' in text
+    assert "active_sessions 2.0" in text
+    assert 'lag_seconds_bucket{le="1.0"} 2.0' in text
+
+
+def test_merging_a_finished_process_keeps_its_counters_only():
+    job, counter, gauge, histogram = _registry()
+    counter.inc("ok")
+    gauge.inc()
+    histogram.observe(0.05)
+    main = _registry()[0]
+    main.merge(job.snapshot())
+    text = main.exposition()
+    assert 'deliveries_total{outcome="ok"} 1.0' in text
+    assert "\nactive_sessions " not in text
+    assert "lag_seconds_count 1.0" in text
@@ -0,0 +1,204 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from recording import CustomJSONEncoder
+
+logger = logging.getLogger("voice-agent")
+
+SPOOL_DIR = os.environ.get("TRANSCRIPT_SPOOL_DIR", "spool")
+# a part is checkpointed once it holds this many segments or is this old
+PART_SEGMENTS = int(os.environ.get("TRANSCRIPT_PART_SEGMENTS", "20"))
+PART_INTERVAL = float(os.environ.get("TRANSCRIPT_PART_INTERVAL", "120"))
+
+OutboxEntry = Tuple[str, Dict[str, Any]]
+
+
+def _part_key(key: str, name: str) -> str:
+    """Parts are stored next to the manifest, under `<manifest key stem>_parts/`."""
+    return f"{key.rsplit('.', 1)[0]}_parts/{name}.ndjson"
+
+
+def _part_entry(key: str, body: str) -> OutboxEntry:
+    return ("s3_object", {"key": key, "body": body, "content_type": "application/x-ndjson"})
+
+
+def _manifest_entry(room_name: str, key: str, segments: int, parts: List[str], recovered: bool = False) -> OutboxEntry:
+    """The manifest only lists the parts, the segments themselves are in the parts."""
+    manifest: Dict[str, Any] = {
+        "room_name": room_name,
+        "timestamp": datetime.now().isoformat(),
+        "segments": segments,
+        "parts": parts,
+    }
+    if recovered:
+        manifest["recovered"] = True
+    return ("s3_object", {
+        "key": key,
+        "body": json.dumps(manifest, separators=(",", ":"), cls=CustomJSONEncoder),
+        "content_type": "application/json",
+    })
+
+
+class TranscriptWriter:
+    """
+    Streams transcript segments to a local NDJSON spool file as the interview runs.
+
+    Segments are checkpointed to object storage in numbered parts while the interview is
+    in progress, and `finish` produces the final compact manifest next to the recording.
+    Only the segments of the current part are kept in memory.
+
+    The spool is written on the writer's own thread, so appending a segment never blocks the
+    event loop. Its first line is a header with the room and the manifest key, and the file is
+    locked while the writer has it open: `recover_orphaned_spools` can tell a spool left by a
+    crashed job from one still being written by another process.
+    """
+    def __init__(self, room_name: str, key: str, upload: bool = True, spool_dir: str = SPOOL_DIR):
+        self.room_name = room_name
+        # S3 key of the final manifest, parts are stored next to it
+        self.key = key
+        self.upload = upload
+        self.segments = 0
+        self.parts: List[str] = []
+        self.spool_path = os.path.join(spool_dir, f"{room_name}-{int(time.time())}.ndjson")
+        # one thread, so lines are written in the order they were appended
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcript-spool")
+        self._spool = None
+        header = json.dumps({"room_name": room_name, "key": key, "upload": upload}, separators=(",", ":"))
+        self._io.submit(self._open, spool_dir, header)
+        self._part: List[str] = []
+        self._part_started = time.monotonic()
+        self._last_user_at: Optional[float] = None
+
+    def _open(self, spool_dir: str, header: str) -> None:
+        try:
+            os.makedirs(spool_dir, exist_ok=True)
+            # locked under a name the sweep does not match, so it never sees the spool unlocked
+            temp_path = self.spool_path + ".tmp"
+            self._spool = open(temp_path, "w", encoding="utf-8")
+            fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._spool.write(header + "\n")
+            self._spool.flush()
+            os.rename(temp_path, self.spool_path)
+        except OSError as e:
+            logger.error("Failed to open transcript spool %s: %s", self.spool_path, e, exc_info=True)
+
+    def _write(self, line: str) -> None:
+        if self._spool is None:
+            return
+        try:
+            self._spool.write(line + "\n")
+            self._spool.flush()
+        except OSError as e:
+            logger.error("Failed to write to transcript spool %s: %s", self.spool_path, e)
+
+    def append(self, speaker: str, role: str, text: str, node_id: Optional[str] = None) -> Optional[OutboxEntry]:
+        """
+        Append one segment to the spool.
+        Returns the outbox entry of a part when one is due for checkpointing, None otherwise.
+        """
+        now = time.time()
+        segment: Dict[str, Any] = {"ts": now, "speaker": speaker, "role": role, "node_id": node_id, "text": text}
+        if role == "user":
+            self._last_user_at = now
+        elif role == "assistant" and self._last_user_at is not None:
+            # time from the candidate's last turn being committed to the agent's reply
+            segment["latency_ms"] = round((now - self._last_user_at) * 1000)
+            self._last_user_at = None
+
+        line = json.dumps(segment, separators=(",", ":"), cls=CustomJSONEncoder)
+        self._io.submit(self._write, line)
+        self.segments += 1
+        self._part.append(line)
+
+        if len(self._part) >= PART_SEGMENTS or time.monotonic() - self._part_started >= PART_INTERVAL:
+            return self.checkpoint()
+        return None
+
+    def checkpoint(self) -> Optional[OutboxEntry]:
+        """Cut the current part and return its outbox entry, or None if there is nothing to upload."""
+        if not self._part:
+            return None
+        body = "\n".join(self._part) + "\n"
+        self._part = []
+        self._part_started = time.monotonic()
+        if not self.upload:
+            return None
+        part_key = _part_key(self.key, f"part-{len(self.parts) + 1:05d}")
+        self.parts.append(part_key)
+        return _part_entry(part_key, body)
+
+    def finish(self) -> List[OutboxEntry]:
+        """
+        Close the spool and return the outbox entries for the last part and the manifest.
+        Blocks on file I/O, call it off the event loop.
+        """
+        entries: List[OutboxEntry] = []
+        last_part = self.checkpoint()
+        if last_part:
+            entries.append(last_part)
+        # waits for the pending writes
+        self._io.shutdown(wait=True)
+        if self._spool is not None:
+            self._spool.close()
+        if not self.upload or not self.segments:
+            return entries
+        entries.append(_manifest_entry(self.room_name, self.key, self.segments, self.parts))
+        return entries
+
+    def discard_spool(self) -> None:
+        """Remove the local spool once its contents are safely in the outbox."""
+        try:
+            os.remove(self.spool_path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return self.segments
+
+
+def recover_orphaned_spools(enqueue: Callable[[List[OutboxEntry]], None], spool_dir: str = SPOOL_DIR) -> int:
+    """
+    Hand the spools left behind by jobs that crashed before their post-interview delivery to
+    `enqueue`, then remove them. Spools still locked by a running writer are skipped.
+
+    The parts a crashed job had already checkpointed are not known any more, so the whole spool
+    is uploaded as a single `recovered` part, listed by a manifest marked as recovered.
+    Blocks on file I/O.
+    Returns the number of spools recovered.
+    """
+    recovered = 0
+    for path in sorted(glob.glob(os.path.join(spool_dir, "*.ndjson"))):
+        try:
+            with open(path, encoding="utf-8") as spool:
+                try:
+                    fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                # another process may have recovered and removed it while we waited for the lock
+                if not os.path.exists(path) or not os.path.samestat(os.fstat(spool.fileno()), os.stat(path)):
+                    continue
+                header = json.loads(spool.readline() or "{}")
+                lines = spool.readlines()
+                segments = len(lines)
+                if header.get("upload") and header.get("key") and segments:
+                    part_key = _part_key(header["key"], "recovered")
+                    enqueue([
+                        _part_entry(part_key, "".join(lines)),
+                        _manifest_entry(header["room_name"], header["key"], segments, [part_key], recovered=True),
+                    ])
+                    logger.warning("Recovered transcript spool %s of room %s (%d segments)", path, header["room_name"], segments)
+                    recovered += 1
+                # removed while still locked, so no other sweep picks it up again
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Failed to recover transcript spool %s: %s", path, e)
+    return recovered
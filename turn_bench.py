@@ -0,0 +1,138 @@
+"""
+Throughput and latency of the batching turn detector (turn_service.py) per batch window.
+
+Simulates --sessions interviews sharing a process, each asking for an end-of-turn prediction at
+random (Poisson) intervals averaging --interval seconds, for --duration seconds per window. The
+"unbatched" row runs one request at a time, like the inference process does.
+
+    python turn_bench.py --sessions 32 --interval 0.5 --windows 0,2,5,10
+
+Runs the real model, which has to be downloaded first (`python session.py download-files`). Without
+it, --synthetic BASE_MS,PER_ITEM_MS stands in a model whose batch of n costs BASE_MS + n * PER_ITEM_MS.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from latency import Histogram
+from turn_service import OnnxTurnModel, TurnInferenceService
+
+QUESTIONS = [
+    "Can you walk me through a project you're proud of?",
+    "How did you handle the database migration?",
+    "What would you do differently next time?",
+    "Tell me about a time you disagreed with a teammate.",
+]
+ANSWERS = [
+    "Sure, so",
+    "I think the main challenge was the migration itself, because we had",
+    "We split the rollout in three phases and monitored error rates after each one.",
+    "Honestly I'd start with the tests, um",
+    "Yes.",
+    "It depends on the team, but usually I would first try to understand their point of view and then",
+]
+
+
+class SyntheticTurnModel:
+    """Stand-in for the ONNX model: a batch of n takes base + n * per_item seconds."""
+    def __init__(self, base: float, per_item: float):
+        self.base = base
+        self.per_item = per_item
+
+    def load(self) -> None:
+        pass
+
+    def predict(self, conversations: List[List[Dict[str, str]]]) -> List[float]:
+        time.sleep(self.base + self.per_item * len(conversations))
+        return [0.5] * len(conversations)
+
+
+def _conversation(rng: random.Random) -> List[Dict[str, str]]:
+    turns = []
+    for _ in range(rng.randint(1, 3)):
+        turns.append({"role": "assistant", "content": rng.choice(QUESTIONS)})
+        turns.append({"role": "user", "content": rng.choice(ANSWERS)})
+    return turns
+
+
+async def _session(service: TurnInferenceService, args: argparse.Namespace, seed: int, latency: Histogram, deadline: float) -> int:
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    done = 0
+    while True:
+        await asyncio.sleep(rng.expovariate(1 / args.interval))
+        if loop.time() >= deadline:
+            return done
+        started = time.perf_counter()
+        await service.predict(_conversation(rng))
+        latency.observe(time.perf_counter() - started)
+        done += 1
+
+
+async def run_window(model: Any, args: argparse.Namespace, window: Optional[float]) -> Dict[str, Any]:
+    # window None: one request per inference, no batching
+    service = TurnInferenceService(model, window=window or 0.0, max_batch=args.max_batch if window is not None else 1)
+    service.start()
+    latency = Histogram(size=100_000)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(_session(service, args, i, latency, deadline) for i in range(args.sessions)))
+    wall = time.perf_counter() - started
+    service.stop()
+    stats = service.stats()
+    return {
+        "window_ms": None if window is None else window * 1000,
+        "predictions": sum(counts),
+        "throughput_per_s": round(sum(counts) / wall, 1),
+        "mean_batch": stats["mean_batch"],
+        "latency": latency.summary(),
+    }
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    if args.synthetic:
+        base, per_item = (float(v) / 1000 for v in args.synthetic.split(","))
+        model: Any = SyntheticTurnModel(base, per_item)
+    else:
+        model = OnnxTurnModel()
+    model.load()
+
+    rows = []
+    for window in [None] + args.windows:
+        row = await run_window(model, args, window)
+        rows.append(row)
+        label = "unbatched" if window is None else f"{row['window_ms']:g} ms"
+        print(
+            f"{label:<10} {row['throughput_per_s']:>8} /s  batch={row['mean_batch']}  "
+            f"p50={row['latency']['p50_ms']} ms  p99={row['latency']['p99_ms']} ms",
+            flush=True,
+        )
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the batching turn detector per batch window.")
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent sessions")
+    parser.add_argument("--interval", type=float, default=1.0, help="mean seconds between predictions per session")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per window")
+    parser.add_argument("--windows", default="0,2,5,10", help="comma separated batch windows in ms")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--synthetic", help="BASE_MS,PER_ITEM_MS: use a synthetic model instead of the real one")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+    args.windows = [float(ms) / 1000 for ms in args.windows.split(",")]
+
+    rows = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+End-of-turn inference batched across the sessions of a process.
+
+By default each session's turn detector sends every prediction to the worker's inference process,
+one request at a time. With TURN_BATCHING enabled, the turn detector of every session in the process
+goes to one TurnInferenceService instead: requests that arrive within TURN_BATCH_WINDOW_MS of each
+other are run together on the service's own thread, and each caller gets its probability back
+through a future.
+
+Batching only pays off when several interviews share a process, i.e. with the thread job
+executor (JOB_EXECUTOR_TYPE=thread). With one job per process every session would load its own copy
+of the model, so leave it off there. `turn_bench.py` measures throughput and latency per window.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from livekit.plugins.turn_detector.base import MAX_HISTORY_TOKENS, EOUModelBase
+from livekit.plugins.turn_detector.multilingual import MultilingualModel, _EUORunnerMultilingual
+
+from latency import Histogram
+from worker_metrics import TURN_BATCH_SIZE
+
+logger = logging.getLogger("voice-agent")
+
+TURN_BATCHING = os.environ.get("TURN_BATCHING", "false").lower() == "true"
+BATCH_WINDOW = float(os.environ.get("TURN_BATCH_WINDOW_MS", "5")) / 1000
+MAX_BATCH = int(os.environ.get("TURN_MAX_BATCH", "16"))
+
+
+class OnnxTurnModel:
+    """The multilingual turn detector's tokenizer and ONNX session, run over several conversations at once."""
+    def __init__(self):
+        self._runner = _EUORunnerMultilingual()
+
+    def load(self) -> None:
+        self._runner.initialize()
+
+    def predict(self, conversations: List[List[Dict[str, str]]]) -> List[float]:
+        texts = [self._runner._format_chat_ctx(messages) for messages in conversations]
+        encoded = self._runner._tokenizer(
+            texts, add_special_tokens=False, max_length=MAX_HISTORY_TOKENS, truncation=True,
+        )["input_ids"]
+
+        # The exported model takes no attention mask, so padding would change the predictions:
+        # conversations are batched with the others of the same token length
+        by_length: Dict[int, List[int]] = {}
+        for i, ids in enumerate(encoded):
+            by_length.setdefault(len(ids), []).append(i)
+
+        probabilities = [0.0] * len(texts)
+        for rows in by_length.values():
+            input_ids = np.array([encoded[i] for i in rows], dtype=np.int64)
+            output = self._runner._session.run(None, {"input_ids": input_ids})[0]
+            for row, i in enumerate(rows):
+                probabilities[i] = float(np.asarray(output[row]).reshape(-1)[-1])
+        return probabilities
+
+
+@dataclass
+class _Request:
+    messages: List[Dict[str, str]]
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+    queued: float = field(default_factory=time.perf_counter)
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]) -> None:
+    # the caller may have timed out and cancelled the future in the meantime
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _reply(request: "_Request", result: Any, error: Optional[BaseException] = None) -> None:
+    try:
+        request.loop.call_soon_threadsafe(_resolve, request.future, result, error)
+    except RuntimeError:
+        # the session ended and its loop is closed
+        pass
+
+
+class TurnInferenceService:
+    """
+    Turn detector inference shared by every session of the process, run on a dedicated thread.
+
+    Implements livekit's InferenceExecutor, so the turn detector plugin can use it in place of the
+    worker's inference process (see BatchedTurnDetector). The thread waits for a first request, then
+    collects the others arriving within `window` seconds (at most `max_batch`) and runs them as one
+    batch. Requests already queued are always taken, so batches also form under load with a window of 0.
+    """
+    def __init__(self, model: Optional[Any] = None, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.model = model or OnnxTurnModel()
+        self.window = window
+        self.max_batch = max_batch
+        self.batch_sizes = Histogram()
+        self.queue_wait = Histogram()
+        self._queue: "queue.SimpleQueue[Optional[_Request]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Load the model and start the inference thread, once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.model.load()
+            self._thread = threading.Thread(target=self._serve, name="turn-inference", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    async def predict(self, messages: List[Dict[str, str]]) -> float:
+        """End-of-turn probability of the last message of a conversation, batched with other sessions' requests."""
+        loop = asyncio.get_running_loop()
+        request = _Request(messages=messages, loop=loop, future=loop.create_future())
+        self._queue.put(request)
+        return await request.future
+
+    async def do_inference(self, method: str, data: bytes) -> Optional[bytes]:
+        # InferenceExecutor: `data` is what the turn detector plugin sends to the inference process
+        messages = json.loads(data)["chat_ctx"]
+        probability = await self.predict(messages)
+        return json.dumps({"eou_probability": probability}).encode()
+
+    def _collect(self, first: _Request) -> List[Optional[_Request]]:
+        batch: List[Optional[_Request]] = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            batch.append(request)
+            if request is None:
+                break
+        return batch
+
+    def _serve(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            stopping = batch[-1] is None
+            requests = [request for request in batch if request is not None]
+            self._run(requests)
+            if stopping:
+                return
+
+    def _run(self, requests: List[_Request]) -> None:
+        started = time.perf_counter()
+        for request in requests:
+            self.queue_wait.observe(started - request.queued)
+        self.batch_sizes.observe(len(requests))
+        TURN_BATCH_SIZE.observe(len(requests))
+        try:
+            results = self.model.predict([request.messages for request in requests])
+        except Exception as e:
+            logger.error("Turn detector batch of %d failed: %s", len(requests), e, exc_info=True)
+            for request in requests:
+                _reply(request, None, e)
+            return
+        for request, probability in zip(requests, results):
+            _reply(request, probability)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = self.batch_sizes
+        return {
+            "batches": sizes.count,
+            "requests": int(sizes.total),
+            "mean_batch": round(sizes.total / sizes.count, 2) if sizes.count else None,
+            "queue_wait": self.queue_wait.summary(),
+        }
+
+
+class BatchedTurnDetector(MultilingualModel):
+    """The multilingual turn detector, with its predictions run by a TurnInferenceService instead of the inference process."""
+    def __init__(self, service: TurnInferenceService, *, unlikely_threshold: Optional[float] = None):
+        # skip MultilingualModel.__init__, which takes the executor from the job context
+        EOUModelBase.__init__(self, model_type="multilingual", inference_executor=service, unlikely_threshold=unlikely_threshold)
+
+
+# shared by every session of this process
+turn_service = TurnInferenceService()
@@ -0,0 +1,381 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("voice-agent")
+
+# job processes write their metric values here, the main worker process serves them all
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: Any) -> str:
+    # label values escape backslash, double quote and line feed in the text format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # recording is called from the event loop and from other threads (turn inference, loop monitor)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def _combine(self, total: Any, value: Any) -> Any:
+        raise NotImplementedError
+
+    def _copy(self, value: Any) -> Any:
+        return value
+
+    def snapshot(self) -> List[List[Any]]:
+        """The values of this process as JSON, [[labels, value], ...]."""
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+    def merge(self, snapshot: List[List[Any]]) -> None:
+        """Add the snapshot of a finished process to this one's values."""
+        with self._lock:
+            for labels, value in snapshot:
+                labels = tuple(labels)
+                current = self._values.get(labels)
+                self._values[labels] = value if current is None else self._combine(current, value)
+
+    def _merged(self, snapshots: Sequence[List[List[Any]]]) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            values = {labels: self._copy(value) for labels, value in self._values.items()}
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                labels = tuple(labels)
+                current = values.get(labels)
+                values[labels] = value if current is None else self._combine(current, value)
+        return list(values.items())
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter. Recording takes the metric's lock for the read-modify-write of its
+    value, uncontended in practice and cheap enough for the audio hot path.
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _combine(self, total: float, value: float) -> float:
+        return total + value
+
+    def collect(self, snapshots: Sequence[List[List[Any]]] = ()) -> List[str]:
+        """Exposition lines of this process's values combined with other processes' snapshots."""
+        lines = self.header()
+        for labels, value in self._merged(snapshots):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, recorded under a lock like Counter. Across processes the
+    values of the running ones are summed, or their maximum is taken with aggregate="max".
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labels)
+        self.aggregate = aggregate
+
+    def _combine(self, total: float, value: float) -> float:
+        return max(total, value) if self.aggregate == "max" else total + value
+
+    def merge(self, snapshot: List[List[Any]]) -> None:
+        # the value of a process that is gone is not current any more
+        pass
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in seconds, exported in the Prometheus text format."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _combine(self, total: List[float], value: List[float]) -> List[float]:
+        return [a + b for a, b in zip(total, value)]
+
+    def _copy(self, value: List[float]) -> List[float]:
+        return list(value)
+
+    def collect(self, snapshots: Sequence[List[List[Any]]] = ()) -> List[str]:
+        """Exposition lines of this process's values combined with other processes' snapshots."""
+        lines = self.header()
+        for labels, series in self._merged(snapshots):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def exposition(self, snapshots: Sequence[Dict[str, Any]] = ()) -> str:
+        """The text format of this process's metrics, combined with the snapshots of other processes."""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect([snapshot[metric.name] for snapshot in snapshots if metric.name in snapshot]))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        for name, values in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+
+registry = Registry()
+
+ACTIVE_SESSIONS = registry.register(Gauge("interview_active_sessions", "Interviews currently running in this worker"))
+HANDOFFS = registry.register(Counter("interview_handoffs_total", "Agent handoffs by the type of the node handed off to", ["node_type"]))
+PIPELINE_REQUESTS = registry.register(Counter("interview_pipeline_requests_total", "LLM, STT and TTS requests", ["service"]))
+PIPELINE_LATENCY = registry.register(Histogram(
+    "interview_pipeline_latency_seconds",
+    "LLM time to first token, TTS time to first byte and STT request duration",
+    ["service"],
+))
+USAGE = registry.register(Counter("interview_usage_total", "Usage from the session UsageCollector", ["kind"]))
+EGRESS_SETUP = registry.register(Histogram("interview_egress_setup_seconds", "Time to start the recording egress", ["outcome"]))
+DELIVERIES = registry.register(Counter("interview_deliveries_total", "Post-interview upload and webhook delivery attempts", ["kind", "outcome"]))
+LOOP_LAG = registry.register(Histogram(
+    "interview_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+))
+MODEL_LOAD = registry.register(Gauge(
+    "interview_model_load_seconds", "Load and warm-up time of the shared models", ["model"], aggregate="max",
+))
+BLOCKING_CALLS = registry.register(Counter(
+    "interview_blocking_calls_total",
+    "Event loop stalls over the threshold, by the application function that blocked",
+    ["location"],
+))
+TURN_BATCH_SIZE = registry.register(Histogram(
+    "interview_turn_batch_size",
+    "End-of-turn predictions run together by the batching turn detector",
+    buckets=(1, 2, 4, 8, 16, 32),
+))
+
+_SERVICES = {"LLMMetrics": ("llm", "ttft"), "TTSMetrics": ("tts", "ttfb"), "STTMetrics": ("stt", "duration")}
+
+
+def observe_pipeline_metrics(metrics: Any) -> None:
+    """Record one item from the session's `metrics_collected` events."""
+    service = _SERVICES.get(type(metrics).__name__)
+    if service is None:
+        return
+    name, field = service
+    PIPELINE_REQUESTS.inc(name)
+    value = getattr(metrics, field, None)
+    if value is not None and value >= 0:
+        PIPELINE_LATENCY.observe(value, name)
+
+
+def observe_usage(summary: Any) -> None:
+    """Add a finished session's UsageSummary to the usage counters."""
+    for kind in ("llm_prompt_tokens", "llm_completion_tokens", "tts_characters_count", "stt_audio_duration"):
+        value = getattr(summary, kind, 0) or 0
+        if value:
+            USAGE.inc(kind, amount=value)
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot() -> None:
+    """Write the metric values of this process to METRICS_DIR, for the main process to serve."""
+    path = _snapshot_path(os.getpid())
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(registry.snapshot(), f, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning("Failed to write metrics snapshot %s: %s", path, e)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# one scrape at a time folds the snapshots of finished processes into this process's values
+_collect_lock = threading.Lock()
+
+
+def _read_snapshots() -> List[Dict[str, Any]]:
+    """
+    The snapshots of the running job processes. Those of finished processes are merged into the
+    values of this process and removed, so their counters and histograms keep counting.
+    """
+    snapshots = []
+    with _collect_lock:
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[:-len(".json")])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Failed to read metrics snapshot %s: %s", path, e)
+                continue
+            if _alive(pid):
+                snapshots.append(snapshot)
+                continue
+            registry.merge(snapshot)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return snapshots
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.exposition(_read_snapshots()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_exporter: Optional[threading.Thread] = None
+
+
+def start_metrics_server() -> Optional[int]:
+    """
+    Serve /metrics on METRICS_PORT from a daemon thread, so scrapes never touch the event loop.
+    Call it from the main worker process, before the worker starts: the endpoint serves the
+    values of this process together with those the job processes write to METRICS_DIR.
+
+    Returns the bound port, or None when METRICS_PORT is not set or the port is taken.
+    """
+    global _server
+    if _server is not None:
+        return _server.server_address[1]
+    port = os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        # snapshots of the processes of a previous run
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json*")):
+            os.remove(path)
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Failed to start the metrics endpoint on port %s: %s", port, e)
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on port %s", port)
+    return int(port)
+
+
+def start_metrics_export() -> None:
+    """
+    Write the metric values of this job process to METRICS_DIR every METRICS_FLUSH_INTERVAL
+    seconds and at exit. Call it from prewarm; it does nothing in the process serving /metrics,
+    which runs the jobs of the thread executor itself.
+    """
+    global _exporter
+    if _server is not None or _exporter is not None or not os.environ.get("METRICS_PORT"):
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning("Failed to create the metrics directory %s: %s", METRICS_DIR, e)
+        return
+
+    def _export():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            write_snapshot()
+
+    _exporter = threading.Thread(target=_export, name="metrics-export", daemon=True)
+    _exporter.start()
+    atexit.register(write_snapshot)